@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+PyTVShows - Benchmarks and correctness checks for pytvshows.bencode
+
+Reports throughput and peak memory of bdecode, bdecode_views,
+bdecode_stream, bencode and encode/decode round trips on generated corpora.
+Each measurement runs in a forked process so peak memory isn't shared between
+them.
+
+Before benchmarking, randomized round trips and malformed inputs are checked
+against every decoder, so a faster decoder that gives different answers is
+caught, and the limits of the incremental Decoder are checked. The corpora
+and checks are generated from a fixed seed, so runs are reproducible.
+
+Usage: python benchmarks/bencode_bench.py [options]
+
+Options:
+  -c, --check       Only run the correctness checks.
+  -q, --quick       Fewer checks and benchmark runs.
+  -s N, --seed=N    Seed for generated data. Default: 1
+"""
+
+import getopt
+import os
+import random
+import resource
+from StringIO import StringIO
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from pytvshows import bencode
+
+DECODERS = [
+    ('bdecode', bencode.bdecode),
+    ('bdecode_views', bencode.bdecode_views),
+    ('bdecode_stream', lambda x: bencode.bdecode_stream(StringIO(x))[0]),
+]
+# Also check Decoder with chunks that split every value
+CHECK_DECODERS = DECODERS + [
+    ('bdecode_stream, 3-byte chunks',
+        lambda x: bencode.bdecode_stream(StringIO(x), 3)[0]),
+]
+
+# Corpora
+
+def make_torrent(rand, pieces, files):
+    """Returns a bencoded torrent with pieces pieces and files files."""
+    info = {
+        'name': 'Show.Name.S01.720p.HDTV',
+        'piece length': 262144,
+        'pieces': random_string(rand, 20 * pieces),
+    }
+    if files == 1:
+        info['length'] = pieces * 262144
+    else:
+        info['files'] = [{'length': 262144 * pieces / files,
+                          'path': ['Show.Name.S01E%02d' % i, 'video.mkv']}
+                         for i in range(files)]
+    return bencode.bencode({
+        'announce': 'http://tracker.example.com/announce',
+        'announce-list': [['http://tracker.example.com/announce'],
+                          ['http://backup.example.com/announce']],
+        'creation date': 1190000000,
+        'info': info,
+    })
+
+def make_deep_list(depth, width):
+    """Returns width lists nested depth deep, each ending in an integer."""
+    value = 1
+    for i in range(depth):
+        value = [value]
+    return bencode.bencode([value] * width)
+
+def make_scrape_response(rand, torrents):
+    """Returns a bencoded scrape response for torrents info_hashes."""
+    files = {}
+    for i in range(torrents):
+        files[random_string(rand, 20)] = {
+            'complete': rand.randint(0, 5000),
+            'downloaded': rand.randint(0, 50000),
+            'incomplete': rand.randint(0, 5000),
+            'name': 'Show.Name.S01E%02d.HDTV' % (i % 100),
+        }
+    return bencode.bencode({'files': files})
+
+def get_corpora(rand, quick=False):
+    """Returns a list of (name, bencoded string, runs) tuples."""
+    scale = 1
+    if quick:
+        scale = 10
+    return [
+        ('small single-file torrent', make_torrent(rand, 1000, 1),
+            200 / scale),
+        ('large multi-file torrent', make_torrent(rand, 400000, 2000),
+            10 / scale or 1),
+        ('deep lists', make_deep_list(400, 200), 10 / scale or 1),
+        ('large scrape response', make_scrape_response(rand, 20000),
+            5 / scale or 1),
+    ]
+
+# Correctness checks
+
+def random_string(rand, length):
+    return ''.join([chr(rand.randrange(256)) for i in xrange(length)])
+
+def random_value(rand, depth=0):
+    """Returns a random value that bencode can encode."""
+    kind = rand.randrange(depth < 4 and 4 or 2)
+    if kind == 0:
+        return rand.choice([0, 1, -1, rand.randint(-10**6, 10**6),
+                            rand.randint(-10**30, 10**30)])
+    elif kind == 1:
+        # Sometimes long enough to come back as a view
+        length = rand.choice([0, 1, rand.randrange(64),
+                              bencode.VIEW_THRESHOLD + rand.randrange(64)])
+        return random_string(rand, length)
+    elif kind == 2:
+        return [random_value(rand, depth + 1)
+                for i in range(rand.randrange(6))]
+    else:
+        value = {}
+        for i in range(rand.randrange(6)):
+            value[random_string(rand, rand.randrange(12))] = \
+                random_value(rand, depth + 1)
+        return value
+
+def plain(value):
+    """Converts buffers returned by bdecode_views to strings."""
+    if isinstance(value, buffer):
+        return str(value)
+    elif isinstance(value, list):
+        return [plain(v) for v in value]
+    elif isinstance(value, dict):
+        d = {}
+        for k, v in value.items():
+            d[k] = plain(v)
+        return d
+    return value
+
+def decode(decoder, data):
+    """Returns ('ok', plain value) or ('error', None) for decoder(data).
+    Exceptions other than BTFailure are not caught."""
+    try:
+        return ('ok', plain(decoder(data)))
+    except bencode.BTFailure:
+        return ('error', None)
+
+MALFORMED = [
+    '', 'i', 'ie', 'i-e', 'i01e', 'i-0e', 'i1', 'l', 'd', 'x', '-1:a',
+    '1:', '2:a', '01:a', 'd1:a', 'd1:ai1e', 'di1ei2ee', 'i1ei2e', 'le1:a',
+    'l' * 100, 'd' * 100, '9999999999:a', '1:a1:b',
+    # Lengths must be digits only, though int() takes signs and whitespace
+    'd+1:ai1ee', 'd 1:ai1ee', 'd1 :ai1ee', 'd-0:i1ee', 'l+1:ae', 'l1 :ae',
+    'l-0:e', '1\n:a',
+]
+
+def check_limits():
+    """Checks that Decoder enforces its limits and rejects garbage before
+    reading all of it. Returns a list of failure messages."""
+    failures = []
+    deep = 'l' * 5000 + 'e' * 5000
+    cases = [
+        # (description, data, Decoder arguments, should be accepted)
+        # Decoded with bdecode_views in the end, so rejected like bdecode
+        ("nesting deeper than the recursion limit", deep, {}, False),
+        ("nesting over max_depth", deep, {'max_depth': 50}, False),
+        ("nesting at max_depth", 'l' * 50 + 'e' * 50, {'max_depth': 50},
+            True),
+        ("data over max_size", '5:abcde', {'max_size': 6}, False),
+        ("data at max_size", '5:abcde', {'max_size': 7}, True),
+        ("string over max_string", 'l3:abc2:abe', {'max_string': 2},
+            False),
+    ]
+    for description, data, kwargs, accepted in cases:
+        try:
+            bencode.bdecode_stream(StringIO(data), 3, **kwargs)
+            if not accepted:
+                failures.append("Decoder accepted %s" % description)
+        except bencode.BTFailure:
+            if accepted:
+                failures.append("Decoder rejected %s" % description)
+    # Garbage and oversized lengths should fail on the first chunk
+    for data in ['<html>' + 'x' * 100000,
+                 '999999999:' + 'x' * 100000,
+                 'd4:infod6:pieces99999999:' + 'x' * 100000]:
+        decoder = bencode.Decoder(max_size=1048576)
+        try:
+            decoder.feed(data[:64])
+            failures.append("Decoder didn't reject %r early" % data[:32])
+        except bencode.BTFailure:
+            pass
+    return failures
+
+def check(rand, count):
+    """Runs the correctness checks and returns a list of failure
+    messages."""
+    failures = []
+    for i in range(count):
+        value = random_value(rand)
+        data = bencode.bencode(value)
+        for name, decoder in CHECK_DECODERS:
+            result = decode(decoder, data)
+            if result != ('ok', value):
+                failures.append("%s: round trip of %r gave %r"
+                                % (name, data[:80], result))
+            elif bencode.bencode(decoder(data)) != data:
+                failures.append("%s: encoding %r again differs"
+                                % (name, data[:80]))
+        # Every truncation and a few corrupted bytes should be rejected or
+        # decoded the same way by every decoder
+        mutations = [data[:n] for n in range(len(data)) if len(data) < 200]
+        for j in range(5):
+            if not data:
+                break
+            n = rand.randrange(len(data))
+            mutations.append(data[:n] + chr(rand.randrange(256))
+                             + data[n + 1:])
+        for mutation in mutations:
+            results = []
+            for name, decoder in CHECK_DECODERS:
+                try:
+                    results.append(decode(decoder, mutation))
+                except Exception, e:
+                    failures.append("%s: %r raised %r"
+                                    % (name, mutation[:80], e))
+                    results.append(None)
+            if mutation != data and len(mutation) < len(data) \
+                    and results[0] != ('error', None):
+                failures.append("truncated %r was accepted"
+                                % mutation[:80])
+            for result in results[1:]:
+                if result != results[0]:
+                    failures.append("decoders disagree on %r: %r"
+                                    % (mutation[:80], results))
+    for data in MALFORMED:
+        for name, decoder in CHECK_DECODERS:
+            try:
+                if decode(decoder, data) != ('error', None):
+                    failures.append("%s: accepted malformed %r"
+                                    % (name, data))
+            except Exception, e:
+                failures.append("%s: %r raised %r" % (name, data, e))
+    return failures
+
+# Benchmarks
+
+def measure(func, data, runs):
+    """Returns (best seconds, peak kB) for func(data), measured in a child
+    process."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = func(data)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+        del result
+        best = None
+        for i in range(runs):
+            start = time.time()
+            func(data)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        os.write(write_fd, "%r %r" % (best, peak))
+        os._exit(0)
+    os.close(write_fd)
+    output = os.read(read_fd, 1024)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    best, peak = output.split()
+    return (float(best), int(peak))
+
+def benchmark(corpora):
+    print "%-26s %-26s %9s %9s %9s %9s" % ("corpus", "operation", "size kB",
+        "best ms", "MB/s", "peak kB")
+    for name, data, runs in corpora:
+        decoded = bencode.bdecode(data)
+        operations = []
+        for decoder_name, decoder in DECODERS:
+            operations.append((decoder_name, decoder, data))
+        operations.append(('bencode', bencode.bencode, decoded))
+        for decoder_name, decoder in DECODERS:
+            operations.append(('%s round trip' % decoder_name,
+                lambda x, decoder=decoder: bencode.bencode(decoder(x)), data))
+        for operation, func, arg in operations:
+            best, peak = measure(func, arg, runs)
+            print "%-26s %-26s %9d %9.2f %9.1f %9d" % (name, operation,
+                len(data) / 1024, best * 1000,
+                len(data) / 1048576.0 / max(best, 1e-9), peak)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    try:
+        opts, args = getopt.getopt(argv[1:], "cqs:",
+                                   ["check", "quick", "seed="])
+    except getopt.error, msg:
+        print >> sys.stderr, msg
+        return 2
+    check_only = False
+    quick = False
+    seed = 1
+    for option, value in opts:
+        if option in ("-c", "--check"):
+            check_only = True
+        elif option in ("-q", "--quick"):
+            quick = True
+        elif option in ("-s", "--seed"):
+            seed = int(value)
+    rand = random.Random(seed)
+    count = 2000
+    if quick:
+        count = 200
+    failures = check(rand, count) + check_limits()
+    if failures:
+        for failure in failures[:50]:
+            print failure[:200]
+        print "%s checks failed" % len(failures)
+        return 1
+    print "%s random values checked, seed %s" % (count, seed)
+    if not check_only:
+        benchmark(get_corpora(rand, quick))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,717 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+PyTVShows - End-to-end benchmark of scripts/pytvshows against a local server
+
+Generates tvRSS-style feeds for a number of shows, cycling through the four
+show types (seasonepisode, date, title and time) with descriptions in the
+formats Show.get_episodes() parses, and a bencoded torrent for every entry.
+A local HTTP server serves the feeds (with ETags, so unchanged feeds get a
+304), the torrents and scrape responses for their tracker.
+
+Each show's state is set up so its latest episodes are new. pytvshows is then
+run as a separate process, as it would be from cron, in two scenarios:
+
+  cold - The new episodes are downloaded, so every feed, torrent and tracker
+         is fetched
+  warm - pytvshows is run again straight away, so the feeds haven't changed
+
+For each scenario the best wall time of several runs, the requests of each
+kind the server answered, the bytes it sent and the peak RSS of the pytvshows
+process are reported and compared against a baseline file. The baseline is
+written the first time, or with --save. The data is generated from a fixed
+seed, so runs are reproducible. The state is set up with the state-backend
+given in the pytvshows options.
+
+Before benchmarking, behaviour that the benchmark wouldn't notice going wrong
+is checked against the same server and data.
+
+Usage: python benchmarks/endtoend.py [options] [-- pytvshows options]
+
+Options:
+  -b FILE, --baseline=FILE
+                    Baseline file. Default: endtoend.baseline next to this
+                    script
+  -c, --check       Only run the correctness checks.
+  -m N, --entries=N Entries in each feed. Default: 30
+  -n N, --shows=N   Number of shows. Default: 20
+  -N N, --new=N     New episodes of each show. Default: 2
+  -r N, --runs=N    Runs of each scenario. Default: 3
+  -s, --save        Save the results as the baseline.
+  --seed=N          Seed for generated data. Default: 1
+"""
+
+import BaseHTTPServer
+import cgi
+import calendar
+import ConfigParser
+import email.Utils
+import getopt
+import md5
+import os
+import random
+import shutil
+import signal
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import urlparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+import pytvshows
+from pytvshows import asynchttp, bencode, control, scheduler
+import pytvshows.state as state
+
+SCRIPT = os.path.join(ROOT, 'scripts', 'pytvshows')
+SHOW_TYPES = ['seasonepisode', 'date', 'title', 'time']
+QUALITIES = ['HDTV', 'PDTV', 'DSRIP']
+# Statistics compared against the baseline, and whether lower is better
+METRICS = [
+    ('wall_time', True),
+    ('requests', True),
+    ('feeds', None),
+    ('torrents', None),
+    ('scrapes', None),
+    ('not_modified', None),
+    ('connections', True),
+    ('kb_sent', True),
+    ('peak_rss_kb', True),
+]
+
+# Synthetic data
+
+class Site(object):
+    """The feeds and torrents served for a benchmark.
+
+    Arguments:
+    rand - random.Random to generate data with
+    port - Port of the server
+    shows - Number of shows
+    entries - Entries in each feed
+    new - New episodes of each show
+    """
+    def __init__(self, rand, port, shows, entries, new):
+        self.port = port
+        self.new = new
+        # Exact name -> list of entry dictionaries, newest first
+        self.shows = {}
+        # Path -> bencoded torrent
+        self.torrents = {}
+        # Exact name -> state to set up before a run
+        self.state = {}
+        now = time.time() - 86400
+        for i in range(shows):
+            exact_name = 'show%04d' % i
+            show_type = SHOW_TYPES[i % len(SHOW_TYPES)]
+            human_name = 'Show %d' % i
+            items = []
+            for n in range(entries):
+                if show_type == 'date':
+                    published = now - n * 86400
+                else:
+                    published = now - n * 7 * 86400
+                items.append(self._make_entry(rand, exact_name, human_name,
+                                              show_type, entries - n,
+                                              published))
+            self.shows[exact_name] = items
+            self.state[exact_name] = {
+                'human_name': human_name,
+                'show_type': show_type,
+                'last_key': items[min(new, entries - 1)]['key'],
+            }
+
+    def _make_entry(self, rand, exact_name, human_name, show_type, number,
+                    published):
+        season, episode = divmod(number - 1, 22)
+        season += 1
+        episode += 1
+        date = time.strftime("%Y-%m-%d", time.gmtime(published))
+        quality = rand.choice(QUALITIES)
+        if show_type == 'seasonepisode':
+            title = "%s %dx%02d [%s - LOL]" % (human_name, season, episode,
+                                               quality)
+            description = "Show Name: %s; Show Title: Episode %d; " \
+                          "Season: %d; Episode: %d" % (human_name, number,
+                                                       season, episode)
+            key = "(%d, %d)" % (season, episode)
+        elif show_type == 'date':
+            title = "%s %s [%s]" % (human_name, date, quality)
+            description = "Show Name: %s; Show Title: n/a; " \
+                          "Episode Date: %s" % (human_name, date)
+            key = date
+        elif show_type == 'title':
+            title = "%s - Programme %d [%s]" % (human_name, number, quality)
+            description = "Show Name: %s; Show Title: Programme %d" \
+                          % (human_name, number)
+            key = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(published))
+        else:
+            title = "%s [%s]" % (human_name, quality)
+            description = "Show Name: %s" % human_name
+            key = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(published))
+        path = '/torrents/%s/%d.torrent' % (exact_name, number)
+        self.torrents[path] = self._make_torrent(rand, title)
+        return {
+            'title': title,
+            'description': description,
+            'path': path,
+            'published': published,
+            'key': key,
+        }
+
+    def _make_torrent(self, rand, name):
+        pieces = rand.randint(50, 400)
+        return bencode.bencode({
+            'announce': 'http://127.0.0.1:%d/announce' % self.port,
+            'info': {
+                'name': name,
+                'piece length': 262144,
+                'length': pieces * 262144,
+                'pieces': ('%0*x' % (40 * pieces,
+                    rand.getrandbits(160 * pieces))).decode('hex'),
+            },
+        })
+
+    def get_feed(self, exact_name):
+        items = []
+        for entry in self.shows[exact_name]:
+            items.append("<item><title>%s</title>"
+                         "<link>http://127.0.0.1:%d%s</link>"
+                         "<description>%s</description>"
+                         "<pubDate>%s</pubDate></item>"
+                % (cgi.escape(entry['title']), self.port, entry['path'],
+                   cgi.escape(entry['description']),
+                   email.Utils.formatdate(entry['published'])))
+        return '<?xml version="1.0" encoding="UTF-8"?>\n' \
+               '<rss version="2.0"><channel><title>%s</title>' \
+               '<link>http://127.0.0.1/</link><description>Feed' \
+               '</description>%s</channel></rss>' \
+               % (exact_name, ''.join(items))
+
+
+# Server
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count('connections')
+
+    def do_GET(self):
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(self.path)
+        site = self.server.site
+        if path.startswith('/feed/') and path[6:] in site.shows:
+            self.server.count('feeds')
+            body = site.get_feed(path[6:])
+            etag = '"%s"' % md5.new(body).hexdigest()
+            if self.headers.get('if-none-match') == etag:
+                self.server.count('not_modified')
+                self.send(304, '', None)
+            else:
+                self.send(200, body, 'application/rss+xml', etag)
+        elif path in site.torrents:
+            self.server.count('torrents')
+            self.send(200, site.torrents[path], 'application/x-bittorrent')
+        elif path == '/scrape':
+            self.server.count('scrapes')
+            files = {}
+            for info_hash in cgi.parse_qs(query).get('info_hash', []):
+                files[info_hash] = {'complete': 10, 'downloaded': 100,
+                                    'incomplete': 5}
+            self.send(200, bencode.bencode({'files': files}), 'text/plain')
+        else:
+            self.server.count('not_found')
+            self.send(404, 'Not found', 'text/plain')
+
+    def send(self, code, body, content_type, etag=None):
+        self.send_response(code)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count('requests')
+        self.server.count('bytes', len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        # Set to the Site to serve
+        self.site = None
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        self._lock.acquire()
+        try:
+            self.counts[name] = self.counts.get(name, 0) + amount
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            counts = self.counts
+            self.counts = {}
+            return counts
+        finally:
+            self._lock.release()
+
+# Running
+
+def write_config(directory, site):
+    fp = open(os.path.join(directory, 'config'), "w")
+    try:
+        fp.write("[pytvshows]\n"
+                 "state-file = %s\n"
+                 "output-directory = %s\n"
+                 "feed = http://127.0.0.1:%d/feed/%%s\n"
+                 % (os.path.join(directory, 'state'),
+                    os.path.join(directory, 'torrents'), site.port))
+        for exact_name in sorted(site.shows.keys()):
+            fp.write("\n[%s]\n" % exact_name)
+    finally:
+        fp.close()
+
+def run_pytvshows(directory, args):
+    """Runs pytvshows in a new process and returns (seconds, exit status,
+    peak RSS in kB)."""
+    start = time.time()
+    pid = start_pytvshows(directory, args)
+    pid, status, rusage = os.wait4(pid, 0)
+    return (time.time() - start, status, rusage.ru_maxrss)
+
+def start_pytvshows(directory, args):
+    """Starts pytvshows in a new process, logging to the log file in
+    directory, and returns its process ID."""
+    log = os.open(os.path.join(directory, 'log'),
+                  os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+    env = os.environ.copy()
+    env['PYTHONPATH'] = ROOT
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.dup2(log, 1)
+            os.dup2(log, 2)
+            os.execve(sys.executable, [sys.executable, SCRIPT, '-c',
+                      os.path.join(directory, 'config')] + args, env)
+        finally:
+            os._exit(127)
+    os.close(log)
+    return pid
+
+def get_state_backend(args):
+    """Returns the state backend that the pytvshows options args pick."""
+    backend = 'journal'
+    for i in range(len(args)):
+        if args[i].startswith('--state-backend='):
+            backend = args[i].split('=', 1)[1]
+        elif args[i] == '--state-backend' and i + 1 < len(args):
+            backend = args[i + 1]
+    return backend
+
+def write_state(path, backend, shows):
+    store = state.open_store(backend, path)
+    try:
+        store.set_many(shows)
+    finally:
+        store.close()
+
+def run_scenarios(site, server, runs, args):
+    """Returns a dictionary of scenario name to a dictionary of
+    statistics."""
+    results = {}
+    for i in range(runs):
+        directory = tempfile.mkdtemp(prefix='pytvshows-bench-')
+        try:
+            os.mkdir(os.path.join(directory, 'torrents'))
+            write_config(directory, site)
+            write_state(os.path.join(directory, 'state'),
+                        get_state_backend(args), site.state)
+            for scenario in ('cold', 'warm'):
+                server.reset()
+                seconds, status, peak = run_pytvshows(directory, args)
+                if status != 0:
+                    print >> sys.stderr, \
+                        "pytvshows failed in the %s scenario:" % scenario
+                    sys.stderr.write(open(os.path.join(directory,
+                                                       'log')).read())
+                    sys.exit(1)
+                counts = server.reset()
+                saved = len(os.listdir(os.path.join(directory, 'torrents')))
+                result = {
+                    'wall_time': seconds,
+                    'requests': counts.get('requests', 0),
+                    'feeds': counts.get('feeds', 0),
+                    'torrents': counts.get('torrents', 0),
+                    'scrapes': counts.get('scrapes', 0),
+                    'not_modified': counts.get('not_modified', 0),
+                    'connections': counts.get('connections', 0),
+                    'kb_sent': counts.get('bytes', 0) / 1024,
+                    'peak_rss_kb': peak,
+                    'saved': saved,
+                }
+                best = results.get(scenario)
+                if best is None or seconds < best['wall_time']:
+                    results[scenario] = result
+        finally:
+            shutil.rmtree(directory)
+    return results
+
+# Correctness checks
+
+def check_state_backends(site):
+    """Checks that a state file written with each backend is imported when
+    another backend is used. Returns a list of failure messages."""
+    failures = []
+    names = sorted(state.backends.keys())
+    for old in names:
+        for new in names:
+            if new == old:
+                continue
+            directory = tempfile.mkdtemp(prefix='pytvshows-check-')
+            try:
+                path = os.path.join(directory, 'state')
+                write_state(path, old, site.state)
+                try:
+                    store = state.open_store(new, path)
+                    try:
+                        shows = store.get_all()
+                    finally:
+                        store.close()
+                except state.StateError, e:
+                    failures.append("switching from %s to %s: %s"
+                                    % (old, new, e))
+                    continue
+                if shows != site.state:
+                    failures.append("switching from %s to %s changed the "
+                                    "state" % (old, new))
+                if state.get_backend(path) != new:
+                    failures.append("switching from %s to %s left a %s "
+                        "state file" % (old, new, state.get_backend(path)))
+                if state.get_backend("%s.%s" % (path, old)) != old:
+                    failures.append("switching from %s to %s didn't keep "
+                                    "the old state file" % (old, new))
+            finally:
+                shutil.rmtree(directory)
+    return failures
+
+def check_async_engine(site):
+    """Checks that with the async engine, the new episodes of every show are
+    saved without any blocking request, even with the scrape cache off.
+    Returns a list of failure messages."""
+    directory = tempfile.mkdtemp(prefix='pytvshows-check-')
+    try:
+        pytvshows.config['feed'] = "http://127.0.0.1:%d/feed/%%s" % site.port
+        pytvshows.config['output-directory'] = directory
+        # Torrents of different shows have the same names on the server
+        pytvshows.config['friendly-filenames'] = True
+        pytvshows.config['scrape-cache-ttl'] = 0
+        blocking = []
+        urlopen = pytvshows.connection_pool.urlopen
+        def counted_urlopen(url, *args, **kwargs):
+            blocking.append(url)
+            return urlopen(url, *args, **kwargs)
+        pytvshows.connection_pool.urlopen = counted_urlopen
+        engine = asynchttp.Engine(pytvshows.connection_pool)
+        outcomes = []
+        try:
+            for exact_name in sorted(site.state.keys()):
+                show = pytvshows.Show(exact_name, **site.state[exact_name])
+                show.save_new_episodes_async(engine, outcomes.append)
+            engine.run()
+        finally:
+            engine.close()
+        failures = []
+        for success, value in outcomes:
+            if not success:
+                failures.append("checking a show failed: %s"
+                    % ''.join(traceback.format_exception_only(*value[:2])))
+        if blocking:
+            failures.append("%d blocking requests with the async engine, "
+                            "such as %s" % (len(blocking), blocking[0]))
+        expected = 0
+        for items in site.shows.values():
+            expected += min(site.new, len(items) - 1)
+        saved = len(os.listdir(directory))
+        if saved != expected:
+            failures.append("the async engine saved %d torrents instead of "
+                            "%d" % (saved, expected))
+        return failures
+    finally:
+        shutil.rmtree(directory)
+
+def check_unwritable_torrent_cache(site):
+    """Checks that the new episodes of every show are still saved when the
+    torrent cache's directory can't be written to. Returns a list of failure
+    messages."""
+    directory = tempfile.mkdtemp(prefix='pytvshows-check-')
+    try:
+        output = os.path.join(directory, 'output')
+        os.mkdir(output)
+        pytvshows.config['feed'] = "http://127.0.0.1:%d/feed/%%s" % site.port
+        pytvshows.config['output-directory'] = output
+        # Torrents of different shows have the same names on the server
+        pytvshows.config['friendly-filenames'] = True
+        # Torrents aren't prefetched, where errors storing them are ignored
+        pytvshows.config['first-working-torrent'] = True
+        cache = os.path.join(directory, 'torrents')
+        pytvshows.torrent_cache.load(cache)
+        # Removed rather than made read-only, which root would ignore
+        shutil.rmtree(cache)
+        failures = []
+        for exact_name in sorted(site.state.keys()):
+            show = pytvshows.Show(exact_name, **site.state[exact_name])
+            try:
+                show.save_new_episodes()
+            except:
+                failures.append("checking %s with an unwritable torrent "
+                    "cache failed: %s" % (exact_name,
+                    ''.join(traceback.format_exception_only(
+                        *sys.exc_info()[:2]))))
+        expected = 0
+        for items in site.shows.values():
+            expected += min(site.new, len(items) - 1)
+        saved = len(os.listdir(output))
+        if saved != expected:
+            failures.append("%d torrents were saved with an unwritable "
+                            "torrent cache instead of %d" % (saved, expected))
+        return failures
+    finally:
+        shutil.rmtree(directory)
+
+def check_daemon_intervals(site, args):
+    """Checks that a daemon schedules each show from the publishing times
+    in its feed when the show's state has a feed watermark, so only its new
+    entries are parsed. Returns a list of failure messages."""
+    directory = tempfile.mkdtemp(prefix='pytvshows-check-')
+    pid = None
+    try:
+        os.mkdir(os.path.join(directory, 'torrents'))
+        write_config(directory, site)
+        shows = {}
+        expected = {}
+        now = time.time()
+        for exact_name, values in site.state.items():
+            items = site.shows[exact_name]
+            shows[exact_name] = values.copy()
+            shows[exact_name]['feed_watermark'] = time.strftime(
+                "%Y-%m-%d %H:%M:%S",
+                time.gmtime(items[min(site.new, len(items) - 1)]
+                            ['published']))
+            # The times as the feed gives them, to the second
+            times = [calendar.timegm(email.Utils.parsedate(
+                         email.Utils.formatdate(item['published'])))
+                     for item in items]
+            expected[exact_name] = scheduler.get_interval(times, now,
+                                                          1800, 86400)
+        write_state(os.path.join(directory, 'state'),
+                    get_state_backend(args), shows)
+        socket_path = os.path.join(directory, 'socket')
+        pid = start_pytvshows(directory, args + ['-d', '--no-detach',
+            '-i', '30', '-x', socket_path,
+            '-p', os.path.join(directory, 'pid')])
+        failures = []
+        deadline = time.time() + 60
+        for exact_name in sorted(expected.keys()):
+            interval = None
+            while interval is None and time.time() < deadline:
+                try:
+                    status = control.send_command(socket_path,
+                                                  ['status', exact_name])
+                except (socket.error, control.ControlError):
+                    status = ''
+                for line in status.splitlines():
+                    if line.strip().startswith('interval:'):
+                        interval = int(line.split(':', 1)[1])
+                if interval is None:
+                    time.sleep(0.1)
+            if interval is None:
+                failures.append("the daemon didn't check %s" % exact_name)
+            elif abs(interval - expected[exact_name]) > 60:
+                failures.append("the daemon checks %s every %d seconds "
+                    "instead of %d" % (exact_name, interval,
+                                       expected[exact_name]))
+        return failures
+    finally:
+        if pid is not None:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        shutil.rmtree(directory)
+
+def run_in_child(func, *args):
+    """Returns the failure messages of func(*args), run in a child process
+    so what it leaves behind in pytvshows doesn't affect other checks."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            try:
+                failures = func(*args)
+            except:
+                failures = ["%s raised:\n%s" % (func.__name__,
+                                                traceback.format_exc())]
+            os.write(write_fd, ''.join([failure.replace("\n", " ") + "\n"
+                                        for failure in failures]))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    output = []
+    while True:
+        data = os.read(read_fd, 4096)
+        if not data:
+            break
+        output.append(data)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return ''.join(output).splitlines()
+
+def check(site, server, args):
+    """Runs the correctness checks and returns a list of failure
+    messages."""
+    return check_state_backends(site) \
+        + run_in_child(check_async_engine, site) \
+        + run_in_child(check_unwritable_torrent_cache, site) \
+        + check_daemon_intervals(site, args)
+
+# Baseline
+
+def load_baseline(path):
+    """Returns (parameters, results) from a baseline file, or None if it
+    doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    parser = ConfigParser.RawConfigParser()
+    parser.read(path)
+    parameters = {}
+    results = {}
+    for section in parser.sections():
+        values = {}
+        for key, value in parser.items(section):
+            values[key] = float(value)
+        if section == 'parameters':
+            parameters = values
+        else:
+            results[section] = values
+    return (parameters, results)
+
+def save_baseline(path, parameters, results):
+    parser = ConfigParser.RawConfigParser()
+    parser.add_section('parameters')
+    for key, value in sorted(parameters.items()):
+        parser.set('parameters', key, repr(value))
+    for scenario in sorted(results.keys()):
+        parser.add_section(scenario)
+        for key, value in sorted(results[scenario].items()):
+            parser.set(scenario, key, repr(value))
+    fp = open(path, "w")
+    try:
+        parser.write(fp)
+    finally:
+        fp.close()
+
+def report(results, baseline, scenarios=('cold', 'warm'), metrics=METRICS):
+    print "%-8s %-14s %12s %12s %9s" % ("scenario", "metric", "result",
+                                        "baseline", "change")
+    for scenario in scenarios:
+        for metric, lower_is_better in metrics:
+            value = results[scenario][metric]
+            line = "%-8s %-14s %12s" % (scenario, metric, _format(value))
+            if baseline and metric in baseline.get(scenario, {}):
+                old = baseline[scenario][metric]
+                line += " %12s" % _format(old)
+                if old:
+                    change = (value - old) * 100.0 / old
+                    line += " %+8.1f%%" % change
+                    if lower_is_better is not None and abs(change) >= 10:
+                        if (change < 0) == lower_is_better:
+                            line += "  better"
+                        else:
+                            line += "  worse"
+            print line
+
+def _format(value):
+    if isinstance(value, float) and value != int(value):
+        return "%.3f" % value
+    return "%d" % value
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    try:
+        opts, args = getopt.getopt(argv[1:], "b:cm:n:N:r:s",
+            ["baseline=", "check", "entries=", "new=", "runs=", "save",
+             "seed=", "shows="])
+    except getopt.error, msg:
+        print >> sys.stderr, msg
+        return 2
+    baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'endtoend.baseline')
+    parameters = {'shows': 20, 'entries': 30, 'new': 2, 'seed': 1}
+    runs = 3
+    save = False
+    check_only = False
+    for option, value in opts:
+        if option in ("-b", "--baseline"):
+            baseline_path = value
+        elif option in ("-c", "--check"):
+            check_only = True
+        elif option in ("-m", "--entries"):
+            parameters['entries'] = int(value)
+        elif option in ("-n", "--shows"):
+            parameters['shows'] = int(value)
+        elif option in ("-N", "--new"):
+            parameters['new'] = int(value)
+        elif option in ("-r", "--runs"):
+            runs = int(value)
+        elif option in ("-s", "--save"):
+            save = True
+        elif option == "--seed":
+            parameters['seed'] = int(value)
+    server = Server()
+    site = Site(random.Random(parameters['seed']), server.server_address[1],
+                parameters['shows'], parameters['entries'], parameters['new'])
+    server.site = site
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    print "%(shows)d shows, %(entries)d entries, %(new)d new, " \
+          "seed %(seed)d" % parameters
+    failures = check(site, server, args)
+    if failures:
+        for failure in failures[:50]:
+            print failure[:200]
+        print "%s checks failed" % len(failures)
+        return 1
+    print "Checks passed"
+    if check_only:
+        return 0
+    results = run_scenarios(site, server, runs, args)
+    baseline = load_baseline(baseline_path)
+    if baseline and baseline[0] != parameters:
+        print "Baseline %s is for different parameters, not comparing." \
+              % baseline_path
+        baseline = None
+    report(results, baseline and baseline[1])
+    if save or not os.path.exists(baseline_path):
+        save_baseline(baseline_path, parameters, results)
+        print "Saved baseline to %s" % baseline_path
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
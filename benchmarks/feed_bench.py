@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+PyTVShows - Benchmarks and correctness checks for pytvshows.tvrss
+
+Reports the speed and peak memory of feedparser and tvrss on large tvRSS-style
+feeds, generated in the formats of every show type as in endtoend.py, both
+for parsing alone and for reading the entries with parse_entry() as
+Show.get_entries() does. Each measurement runs in a forked process, so peak
+memory isn't shared between them.
+
+Before benchmarking, the entries tvrss reads from every corpus are checked
+against feedparser's, field by field, so a faster parser that gives
+different answers is caught. The feeds are generated from a fixed seed, so
+runs are reproducible.
+
+Usage: python benchmarks/feed_bench.py [options]
+
+Options:
+  -c, --check       Only run the correctness checks.
+  -q, --quick       Smaller feeds and fewer benchmark runs.
+  -s N, --seed=N    Seed for generated data. Default: 1
+"""
+
+import getopt
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bencode_bench import measure
+import memory
+import feedparser
+import pytvshows
+from pytvshows import tvrss
+
+PARSERS = [
+    ('feedparser', feedparser.parse),
+    ('tvrss', tvrss.parse),
+]
+FIELDS = ['title', 'link', 'description', 'id']
+
+# Corpora
+
+def make_feed(rand, entries):
+    """Returns a feed with entries entries for each show type."""
+    site = memory.FeedSite(rand, 80, len(memory.endtoend.SHOW_TYPES),
+                           entries, 0)
+    feeds = [site.get_feed(exact_name)
+             for exact_name in sorted(site.shows.keys())]
+    # One channel with the items of every feed
+    items = [feed[feed.index('<item>'):feed.rindex('</item>') + 7]
+             for feed in feeds]
+    return feeds[0][:feeds[0].index('<item>')] + ''.join(items) \
+        + '</channel></rss>'
+
+def get_corpora(rand, quick=False):
+    """Returns a list of (name, feed, runs) tuples."""
+    scale = 1
+    if quick:
+        scale = 10
+    return [
+        ('small feed', make_feed(rand, 50 / scale), 20 / scale or 1),
+        ('large feed', make_feed(rand, 500 / scale), 5 / scale or 1),
+        ('huge feed', make_feed(rand, 5000 / scale), 2 / scale or 1),
+    ]
+
+# Correctness checks
+
+def check(corpora):
+    """Returns a list of the differences between the entries of feedparser
+    and tvrss for each corpus."""
+    failures = []
+    for name, data, runs in corpora:
+        expected = feedparser.parse(data)['entries']
+        try:
+            got = tvrss.parse(data)['entries']
+        except tvrss.UnsupportedFeedError, e:
+            failures.append("%s: tvrss can't parse it: %s" % (name, e))
+            continue
+        if len(got) != len(expected):
+            failures.append("%s: %d entries instead of %d"
+                            % (name, len(got), len(expected)))
+            continue
+        for i, (a, b) in enumerate(zip(expected, got)):
+            for field in FIELDS:
+                if a.get(field) != b.get(field):
+                    failures.append("%s: entry %d %s: %r instead of %r"
+                        % (name, i, field, b.get(field), a.get(field)))
+            if tuple(a.updated_parsed) != tuple(b.updated_parsed):
+                failures.append("%s: entry %d updated_parsed: %r instead "
+                    "of %r" % (name, i, b.updated_parsed, a.updated_parsed))
+    return failures
+
+# Benchmarks
+
+def read_entries(parse):
+    """Returns a function that parses a feed with parse and reads its
+    entries with parse_entry()."""
+    def read(data):
+        return [pytvshows.parse_entry(entry)
+                for entry in parse(data)['entries']]
+    return read
+
+def benchmark(corpora):
+    print "%-12s %-26s %9s %9s %9s %9s" % ("corpus", "operation", "entries",
+        "best ms", "MB/s", "peak kB")
+    for name, data, runs in corpora:
+        entries = len(tvrss.parse(data)['entries'])
+        operations = []
+        for parser_name, parse in PARSERS:
+            operations.append((parser_name, parse))
+        for parser_name, parse in PARSERS:
+            operations.append(('%s + parse_entry' % parser_name,
+                               read_entries(parse)))
+        for operation, func in operations:
+            best, peak = measure(func, data, runs)
+            print "%-12s %-26s %9d %9.2f %9.2f %9d" % (name, operation,
+                entries, best * 1000,
+                len(data) / 1048576.0 / max(best, 1e-9), peak)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    try:
+        opts, args = getopt.getopt(argv[1:], "cqs:",
+                                   ["check", "quick", "seed="])
+    except getopt.error, msg:
+        print >> sys.stderr, msg
+        return 2
+    check_only = False
+    quick = False
+    seed = 1
+    for option, value in opts:
+        if option in ("-c", "--check"):
+            check_only = True
+        elif option in ("-q", "--quick"):
+            quick = True
+        elif option in ("-s", "--seed"):
+            seed = int(value)
+    corpora = get_corpora(random.Random(seed), quick)
+    failures = check(corpora)
+    if failures:
+        for failure in failures[:50]:
+            print failure[:200]
+        print "%s checks failed" % len(failures)
+        return 1
+    print "%s feeds checked, seed %s" % (len(corpora), seed)
+    if not check_only:
+        benchmark(corpora)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
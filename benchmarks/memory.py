@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+PyTVShows - Memory benchmark of the shows a long-running pytvshows keeps
+
+Generates large tvRSS-style feeds for a number of shows, in the same formats
+as endtoend.py, and reads them in a child process the way the daemon does:
+each feed is parsed into a Show and its episodes and torrents are built with
+Show.get_episodes(). The shows are then kept, and the memory they hold on to
+is measured in two scenarios:
+
+  keep - The parsed feed is kept in each show's rss property
+  drop - keep-feed is switched off, so only the entries are kept
+
+For each scenario the resident memory the shows add, the same per show, the
+size of a single Torrent and episode object and the time taken are reported
+and compared against a baseline file. The baseline is written the first
+time, or with --save. The data is generated from a fixed seed, so runs are
+reproducible.
+
+Resident memory is read from /proc/self/statm. Where that doesn't exist, the
+growth in peak memory is reported instead.
+
+Usage: python benchmarks/memory.py [options]
+
+Options:
+  -b FILE, --baseline=FILE
+                    Baseline file. Default: memory.baseline next to this
+                    script
+  -m N, --entries=N Entries in each feed. Default: 200
+  -n N, --shows=N   Number of shows. Default: 200
+  -s, --save        Save the results as the baseline.
+  --seed=N          Seed for generated data. Default: 1
+"""
+
+import gc
+import getopt
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import endtoend
+import pytvshows
+
+SCENARIOS = ['keep', 'drop']
+# Statistics compared against the baseline, and whether lower is better
+METRICS = [
+    ('rss_kb', True),
+    ('rss_kb_per_show', True),
+    ('torrent_bytes', True),
+    ('episode_bytes', True),
+    ('episodes', None),
+    ('torrents', None),
+    ('seconds', True),
+]
+
+class FeedSite(endtoend.Site):
+    """The feeds of endtoend.Site, without generating torrents for them."""
+    def _make_torrent(self, rand, name):
+        return None
+
+def get_rss_kb():
+    """Returns the resident memory of this process in kB, or its peak where
+    that isn't available."""
+    try:
+        fp = open('/proc/self/statm')
+        try:
+            pages = int(fp.read().split()[1])
+        finally:
+            fp.close()
+        return pages * resource.getpagesize() / 1024
+    except (IOError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def get_object_bytes(obj):
+    """Returns the size of obj and its attribute dictionary, if it has one,
+    in bytes. Needs Python 2.6 or later, returns 0 otherwise."""
+    if not hasattr(sys, 'getsizeof'):
+        return 0
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def load_shows(site, keep_feed):
+    """Reads every feed of site into a Show and returns a dictionary of
+    statistics about the memory they hold on to."""
+    pytvshows.config['keep-feed'] = keep_feed
+    gc.collect()
+    before = get_rss_kb()
+    start = time.time()
+    shows = []
+    for exact_name in sorted(site.shows.keys()):
+        details = site.state[exact_name]
+        show = pytvshows.Show(exact_name, details['human_name'],
+                              details['show_type'], details['last_key'])
+        show._read_rss_feed(exact_name, site.get_feed(exact_name), {})
+        show.get_episodes()
+        shows.append(show)
+    seconds = time.time() - start
+    gc.collect()
+    rss = get_rss_kb() - before
+    episodes = []
+    for show in shows:
+        episodes.extend(show.episodes.values())
+        episodes.extend(show.specials.values())
+    torrents = []
+    for episode in episodes:
+        torrents.extend(episode.torrents)
+    return {
+        'rss_kb': rss,
+        'rss_kb_per_show': float(rss) / max(len(shows), 1),
+        'torrent_bytes': get_object_bytes(torrents[0]),
+        'episode_bytes': get_object_bytes(episodes[0]),
+        'episodes': len(episodes),
+        'torrents': len(torrents),
+        'seconds': seconds,
+    }
+
+def measure(site, keep_feed):
+    """Returns the statistics of load_shows(), measured in a child process
+    so each scenario starts from the same memory."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            result = load_shows(site, keep_feed)
+            os.write(write_fd, ''.join(["%s %r\n" % item
+                                        for item in result.items()]))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    output = []
+    while True:
+        data = os.read(read_fd, 4096)
+        if not data:
+            break
+        output.append(data)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    result = {}
+    for line in ''.join(output).splitlines():
+        key, value = line.split(' ', 1)
+        result[key] = float(value)
+    if not result:
+        print >> sys.stderr, "Loading the shows failed."
+        sys.exit(1)
+    return result
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    try:
+        opts, args = getopt.getopt(argv[1:], "b:m:n:s",
+            ["baseline=", "entries=", "save", "seed=", "shows="])
+    except getopt.error, msg:
+        print >> sys.stderr, msg
+        return 2
+    baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'memory.baseline')
+    parameters = {'shows': 200, 'entries': 200, 'seed': 1}
+    save = False
+    for option, value in opts:
+        if option in ("-b", "--baseline"):
+            baseline_path = value
+        elif option in ("-m", "--entries"):
+            parameters['entries'] = int(value)
+        elif option in ("-n", "--shows"):
+            parameters['shows'] = int(value)
+        elif option in ("-s", "--save"):
+            save = True
+        elif option == "--seed":
+            parameters['seed'] = int(value)
+    site = FeedSite(random.Random(parameters['seed']), 80,
+                    parameters['shows'], parameters['entries'], 0)
+    print "%(shows)d shows, %(entries)d entries, seed %(seed)d" % parameters
+    results = {}
+    for scenario in SCENARIOS:
+        results[scenario] = measure(site, scenario == 'keep')
+    baseline = endtoend.load_baseline(baseline_path)
+    if baseline and baseline[0] != parameters:
+        print "Baseline %s is for different parameters, not comparing." \
+              % baseline_path
+        baseline = None
+    endtoend.report(results, baseline and baseline[1], SCENARIOS, METRICS)
+    if save or not os.path.exists(baseline_path):
+        endtoend.save_baseline(baseline_path, parameters, results)
+        print "Saved baseline to %s" % baseline_path
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
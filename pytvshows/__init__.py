@@ -14,10 +14,18 @@ if not hasattr(sys, "version_info") or sys.version_info < (2,4):
 
 # TODO:
 # * Support range of episodes (21-22 for example)
-# * Per-show settings such as quality
 
+import pytvshows.asynchttp as asynchttp
 import pytvshows.bencode as bencode
+import pytvshows.connection as connection
 import pytvshows.logger as logging
+import pytvshows.pool as pool
+import pytvshows.retry as retry
+import pytvshows.timing as timing
+import pytvshows.torrentcache as torrentcache
+import pytvshows.tracker as tracker
+import pytvshows.tvrss as tvrss
+from pytvshows.quality import QualityMatcher
 
 root_logger = logging.getLogger('')
 root_logger.setLevel(logging.DEBUG)
@@ -27,15 +35,19 @@ formatter = logging.Formatter('%(levelname)-8s: %(message)s')
 console.setFormatter(formatter)
 root_logger.addHandler(console)
 
+import calendar
 import datetime
+import email.Utils
 try:
     import feedparser
 except ImportError:
     logging.error("PyTVShows depends on feedparser 4.1 "
                   "(http://feedparser.org/)")
     sys.exit(1)
+import errno
 import operator
 import os
+import random
 import re
 import sha
 import socket; socket_errors = []
@@ -64,7 +76,20 @@ config = {
         "[720P": 3,
     },
     'quality': 1,
-    'friendly-filenames': False
+    'friendly-filenames': False,
+    'torrent-jobs': 1,
+    'first-working-torrent': False,
+    'scrape-cache-ttl': 600,
+    'scrape-batch-size': 50,
+    # Whether Show keeps the parsed feed in its rss property once its 
+    # entries have been read, see Show.get_entries()
+    'keep-feed': True,
+    # Parser for feeds, feedparser or tvrss, see parse_feed()
+    'feed-parser': 'feedparser',
+    # Limits on bencoded data from servers, see _read_bencoded()
+    'max-torrent-size': 20971520,
+    'max-scrape-size': 4194304,
+    'max-bencode-depth': 32,
 }
 
 class TorrentError(Exception): pass
@@ -81,6 +106,22 @@ class ShowFeedNotModifiedError(ShowFeedError): pass
 class ShowFeedNoEpisodesError(ShowFeedError): pass
 class ShowDetailsError(ShowError): pass
 
+# Scrape responses and tracker history shared by all torrents, see 
+# Torrent._check_tracker()
+scrape_cache = tracker.ScrapeCache()
+tracker_health = tracker.TrackerHealth()
+# Keep-alive connections used for feeds, torrents and trackers
+connection_pool = connection.ConnectionPool(USER_AGENT)
+# Downloaded torrent files, see Torrent.fetch(). Does nothing until it is 
+# loaded with a directory
+torrent_cache = torrentcache.TorrentCache()
+# Torrents that failed, so they are retried with backoff, see 
+# _BaseEpisode.get_torrent()
+failed_torrents = retry.FailedTorrents()
+# Durations of the phases of a run for --profile. Records nothing until it is
+# enabled
+timings = timing.Timings()
+
 class Torrent(object):
     """A single torrent file for an episode.
     
@@ -91,6 +132,11 @@ class Torrent(object):
     published_time - Publishing time of torrent as a datetime.datetime object
     filename - Filename to save torrent to
     """
+    # There can be thousands of these in a long-running process
+    __slots__ = ('episode', 'url', 'quality', 'published_time', 'dict', 
+                 'file', 'info_hash', 'tracker', 'tracker_response', 
+                 '_server_filename', '_prefetched', '_error')
+    
     def __init__(self, episode, url, quality, published_time):
         self.episode = episode
         self.url = url
@@ -99,105 +145,308 @@ class Torrent(object):
         
         self.dict = None
         self.file = None
+        self.info_hash = None
+        self.tracker = None
         self.tracker_response = None
         
         self._server_filename = None
+        self._prefetched = False
+        # exc_info of the error download_async() gave up with, raised again
+        # by download() and fetch() instead of trying again
+        self._error = None
         
     def download(self):
+        """Download this torrent if it hasn't been already, then check its
+        trackers unless a working one has been found already, by verify(),
+        verify_async() or scrape_torrents(). See fetch() and verify().
+        
+        Returns the torrent as a bdecoded dictionary.
+        """
+        if self._error:
+            pool.reraise(self._error)
+        if not self.dict:
+            self.fetch()
+        if not self.tracker:
+            self.verify()
+        return self.dict
+    
+    def fetch(self):
         """Download this torrent and store the bdecoded dictionary and
-        the torrent file in the dict and file properties respectively.
-        The first successful tracker response is stored in the 
-        tracker_response property.
+        the torrent file in the dict and file properties respectively. A 
+        copy in torrent_cache is used instead if it is fresh or the server
+        says it hasn't changed.
         
         Returns the torrent as a bdecoded dictionary.
         """
-        # TODO: there is no need downloading & checking each time tracker 
-        #       fails split this up into downloading torrent and checking 
-        #       tracker
-        logging.debug("Downloading %s..." % self.url)
-        request = urllib2.Request(self.url)
-        request.add_header('User-Agent', USER_AGENT)
+        if self._error:
+            pool.reraise(self._error)
+        start = timings.start()
         try:
-            f = urllib2.urlopen(request)
+            return self._fetch()
+        finally:
+            timings.stop(start, 'torrent', show=self.episode.show.exact_name)
+    
+    def fetch_async(self, engine, callback):
+        """Like fetch(), but downloads the torrent with engine, an 
+        asynchttp.Engine. callback is called with the outcome when it is
+        done, like the outcomes of pool.run()."""
+        if self._error:
+            callback((False, self._error))
+            return
+        start = timings.start()
+        def finish(outcome):
+            timings.stop(start, 'torrent', show=self.episode.show.exact_name)
+            callback(outcome)
+        outcome = pool.call(self._get_fetch_headers)
+        if not outcome[0]:
+            finish(outcome)
+            return
+        cached, headers = outcome[1]
+        if headers is None:
+            finish(pool.call(self._load_cached, cached))
+            return
+        engine.fetch(self.url, 
+            lambda response, error: finish(pool.call(self._fetched_async, 
+                                                     cached, response, error)),
+            headers, config['max-torrent-size'])
+    
+    def _fetch(self):
+        cached, headers = self._get_fetch_headers()
+        if headers is None:
+            return self._load_cached(cached)
+        try:
+            f = connection_pool.urlopen(self.url, headers)
         except urllib2.URLError, e:
-            if hasattr(e, "reason"):
-                raise TorrentDownloadError, "Could not reach server: %s" \
-                                            % e.reason
-            elif hasattr(e, "code"):
-                raise TorrentDownloadError, e
-            else:
-                raise TorrentDownloadError, "Unknown URLError: %s" % e
-        torrent_file = f.read()
+            self._check_fetch_error(e, cached)
+            return self._load_cached(cached)
+        spans = {}
+        # Check if torrent is valid while it downloads
+        try:
+            torrent_dict, torrent_file = _read_bencoded(f, 
+                config['max-torrent-size'], spans)
+        except bencode.BTFailure, e:
+            raise TorrentError, "Downloaded file is either " \
+                                "corrupted or not a torrent: %s" % e
+        except urllib2.URLError, e:
+            raise TorrentDownloadError, "Download failed: %s" % e.reason
+        return self._load(torrent_dict, torrent_file, spans, f.headers)
+    
+    def _fetched_async(self, cached, response, error):
+        """Loads the torrent from a response to fetch_async()."""
+        if isinstance(error, asynchttp.ResponseTooLargeError):
+            raise TorrentError, "Downloaded file is either corrupted or " \
+                                "not a torrent: %s" % error.reason
+        elif error is not None:
+            self._check_fetch_error(error, cached)
+            return self._load_cached(cached)
+        spans = {}
+        try:
+            torrent_dict = _decode_bencoded(response.body, 
+                config['max-torrent-size'], spans)
+        except bencode.BTFailure, e:
+            raise TorrentError, "Downloaded file is either " \
+                                "corrupted or not a torrent: %s" % e
+        return self._load(torrent_dict, response.body, spans, 
+                          response.headers)
+    
+    def _get_fetch_headers(self):
+        """Returns a (cached, headers) tuple of the copy of this torrent in
+        torrent_cache, or None, and the headers to download it with, or 
+        None if the cached copy is fresh enough to use as it is."""
+        cached = torrent_cache.get(self.url)
+        if cached and cached[1]['fresh']:
+            logging.debug("Using cached copy of %s" % self.url)
+            return (cached, None)
+        logging.debug("Downloading %s..." % self.url)
+        headers = {}
+        if cached and cached[1]['etag']:
+            headers['If-None-Match'] = cached[1]['etag']
+        if cached and cached[1]['last_modified']:
+            headers['If-Modified-Since'] = cached[1]['last_modified']
+        return (cached, headers)
+    
+    def _check_fetch_error(self, e, cached):
+        """Raises TorrentDownloadError for a urllib2.URLError downloading
+        this torrent, unless the server said the cached copy hasn't 
+        changed."""
+        if cached and getattr(e, "code", None) == 304:
+            logging.debug("Cached copy of %s is still valid." % self.url)
+            torrent_cache.revalidated(self.url)
+        elif hasattr(e, "reason"):
+            raise TorrentDownloadError, "Could not reach server: %s" \
+                                        % e.reason
+        elif hasattr(e, "code"):
+            raise TorrentDownloadError, e
+        else:
+            raise TorrentDownloadError, "Unknown URLError: %s" % e
+    
+    def _load_cached(self, cached):
+        """Loads this torrent from its copy in torrent_cache."""
+        spans = {}
+        self._server_filename = cached[1]['filename']
+        try:
+            torrent_dict = bencode.bdecode_views(cached[0], spans=spans)
+        except bencode.BTFailure, e:
+            raise TorrentError, "Cached file is corrupted: %s" % e
+        return self._load(torrent_dict, cached[0], spans)
+    
+    def _load(self, torrent_dict, torrent_file, spans, headers=None):
+        """Checks and stores a decoded torrent. If it was downloaded, 
+        headers are the response headers and it is stored in 
+        torrent_cache."""
         # This is for use in save()
-        if "content-disposition" in f.headers.dict:
+        if headers is not None and "content-disposition" in headers.dict:
             r = re.compile('filename="(.+?)"')
-            m = r.search(f.headers.dict["content-disposition"])
+            m = r.search(headers.dict["content-disposition"])
             if m:
                 self._server_filename = m.group(1)
-        # Check if torrent is valid
-        try:
-            torrent_dict = bencode.bdecode(torrent_file)
-        except bencode.BTFailure:
-            raise TorrentError, "Downloaded file is either " \
-                                "corrupted or not a torrent"
+        if not isinstance(torrent_dict, dict) or 'info' not in torrent_dict:
+            raise TorrentError, "Downloaded file is not a torrent"
         if 'announce' not in torrent_dict.keys():
             raise TorrentError, "Tracker not found in torrent file"
         logging.debug('Torrent "%s" downloaded, %s bytes' 
                         % (torrent_dict['info']['name'], len(torrent_file)))
-        # Check if trackers work
-        logging.debug("Checking tracker (%s)..." % torrent_dict['announce'])
+        self.dict = torrent_dict
+        self.file = torrent_file
+        # Hash the info dictionary as it was encoded, which is what trackers
+        # know the torrent by even if it wasn't encoded canonically
+        start, end = spans['info']
+        self.info_hash = sha.new(buffer(torrent_file, start, end - start)
+                                 ).digest()
+        if headers is not None:
+            torrent_cache.put(self.url, torrent_file, self.info_hash,
+                              headers.get('etag'), 
+                              headers.get('last-modified'),
+                              self._server_filename)
+        return torrent_dict
+    
+    def verify(self):
+        """Check the trackers of this torrent, downloading it first if it
+        hasn't been already. The announce URL of the first working tracker
+        is stored in the tracker property and its scrape response in the 
+        tracker_response property.
+        
+        Returns the announce URL of the working tracker.
+        """
+        if not self.dict:
+            self.fetch()
+        torrent_dict = self.dict
         chosen_tracker = None
+        tracker_response = None
         no_scrape_trackers = []
-        # Step 1: Check main tracker, make a note if it doesn't support scrape
-        try:
-            scrape_url = self._get_scrape_url(torrent_dict['announce'])
+        # Step 1: Check main tracker, then announce-list trackers, the ones
+        # that have worked best in the past first. Make a note of the ones
+        # that don't support scrape
+        urls, skipped = tracker_health.order(self._get_announce_urls())
+        for url in skipped:
+            logging.debug("Skipping tracker (%s), it has failed recently." 
+                            % url)
+        for url in urls:
+            logging.debug("Checking tracker (%s)..." % url)
             try:
-                tracker_response = self._check_tracker(scrape_url,
-                                            torrent_dict, scrape=True)
-                chosen_tracker = torrent_dict['announce']
+                tracker_response = self._check_tracker(url, torrent_dict)
+                chosen_tracker = url
+                break
+            except TorrentNoScrapeError:
+                logging.debug("Tracker does not support scraping.")
+                no_scrape_trackers.append(url)
             except TorrentTrackerError, e:
                 logging.debug("Tracker error: %s" % e)
-        except TorrentNoScrapeError:
-            logging.debug("Tracker does not support scraping.")
-            no_scrape_trackers.append(torrent_dict['announce'])
-        # Step 2: Check announce-list trackers, again make a note of no scrape
-        if not chosen_tracker:
-            if 'announce-list' in torrent_dict \
-                    and torrent_dict['announce-list']:
-                for url in torrent_dict['announce-list']:
-                    logging.debug("Checking tracker (%s)..." % url)
-                    try:
-                        scrape_url = self._get_scrape_url(url)
-                        try:
-                            tracker_response = self._check_tracker(scrape_url, 
-                                                torrent_dict, scrape=True)
-                            chosen_tracker = url
-                            break
-                        except TorrentTrackerError, e:
-                            logging.debug("Tracker error: %s" % e)
-                    except TorrentNoScrapeError:
-                        logging.debug("Tracker does not support scraping.")
-                        no_scrape_trackers.append(url)
-        # Step 3: If these all fail to find a working tracker, use first 
+        # Step 2: If these all fail to find a working tracker, use first 
         # tracker without scraping support that can be connected to.
-        if not chosen_tracker:
+        if not chosen_tracker and no_scrape_trackers:
             logging.debug("Falling back to a tracker without scrape support.")
             for url in no_scrape_trackers:
-                request = urllib2.Request(req_url)
-                request.add_header('User-Agent', USER_AGENT)
+                start = time.time()
                 try:
-                    f = urllib2.urlopen(request)
+                    connection_pool.urlopen(url).close()
                 except urllib2.URLError, e:
+                    tracker_health.record_failure(url)
                     continue
+                tracker_health.record_success(url, time.time() - start)
                 chosen_tracker = url
                 break
         if not chosen_tracker:
             raise TorrentDownloadError, "No working tracker found"
         logging.debug("Working tracker found (%s)" % chosen_tracker)
-        self.dict = torrent_dict
-        self.file = torrent_file
+        self.tracker = chosen_tracker
         self.tracker_response = tracker_response
-        return torrent_dict
+        return chosen_tracker
+    
+    def verify_async(self, engine, callback):
+        """Like verify(), but checks the trackers one at a time in the same
+        order with engine, an asynchttp.Engine, downloading the torrent 
+        first if it hasn't been already. callback is called with the outcome
+        when it is done, like the outcomes of pool.run()."""
+        if not self.dict:
+            def fetched(outcome):
+                if outcome[0]:
+                    self.verify_async(engine, callback)
+                else:
+                    callback(outcome)
+            self.fetch_async(engine, fetched)
+            return
+        outcome = pool.call(tracker_health.order, self._get_announce_urls())
+        if not outcome[0]:
+            callback(outcome)
+            return
+        urls, skipped = outcome[1]
+        for url in skipped:
+            logging.debug("Skipping tracker (%s), it has failed recently." 
+                            % url)
+        no_scrape_trackers = []
+        def found(url, tracker_response):
+            logging.debug("Working tracker found (%s)" % url)
+            self.tracker = url
+            self.tracker_response = tracker_response
+            callback((True, url))
+        def not_found():
+            try:
+                raise TorrentDownloadError, "No working tracker found"
+            except TorrentDownloadError:
+                callback((False, sys.exc_info()))
+        def check(i):
+            # Step 1: Check main tracker, then announce-list trackers
+            if i == len(urls):
+                if no_scrape_trackers:
+                    logging.debug("Falling back to a tracker without scrape "
+                                  "support.")
+                fall_back(0)
+                return
+            url = urls[i]
+            logging.debug("Checking tracker (%s)..." % url)
+            def checked(outcome):
+                success, value = outcome
+                if success:
+                    found(url, value)
+                    return
+                if issubclass(value[0], TorrentNoScrapeError):
+                    logging.debug("Tracker does not support scraping.")
+                    no_scrape_trackers.append(url)
+                elif issubclass(value[0], TorrentTrackerError):
+                    logging.debug("Tracker error: %s" % value[1])
+                else:
+                    callback(outcome)
+                    return
+                check(i + 1)
+            self._check_tracker_async(engine, url, checked)
+        def fall_back(i):
+            # Step 2: Use the first tracker without scraping support that 
+            # can be connected to
+            if i == len(no_scrape_trackers):
+                not_found()
+                return
+            url = no_scrape_trackers[i]
+            start = time.time()
+            def opened(response, error):
+                if error is not None:
+                    tracker_health.record_failure(url)
+                    fall_back(i + 1)
+                    return
+                tracker_health.record_success(url, time.time() - start)
+                found(url, None)
+            engine.fetch(url, opened, max_size=config['max-scrape-size'])
+        check(0)
     
     def save(self, directory=None, filename=None, retry=3):
         """Save torrent to path, or output-directory or output-directory2
@@ -222,7 +471,7 @@ class Torrent(object):
                 directory = config['output-directory2']
             else:
                 raise TorrentWriteError, "Output directory doesn't exist."
-        if not self.file:
+        if not self.tracker or not self.file:
             if retry > 1:
                 self.download_retry(retry)
             else:
@@ -245,17 +494,49 @@ class Torrent(object):
         filename = self._get_valid_filename(filename)
         path = os.path.join(directory, filename)
         logging.debug("Saving torrent to %s..." % path)
+        start = timings.start()
         try:
-            f = open(path, "w")
-        except IOError, e:
-            raise TorrentSaveError, "Can't open torrent file for writing: %s"\
-                                        % e
-        try:
-            f.write(self.file)
+            _write_atomically(path, self.file)
         finally:
-            f.close()
+            timings.stop(start, 'save', show=self.episode.show.exact_name)
         return path
     
+    def release(self):
+        """Forgets the downloaded torrent and the tracker that was checked,
+        to free the memory they use. They are downloaded again if the
+        torrent is needed after all."""
+        self.dict = None
+        self.file = None
+        self.info_hash = None
+        self.tracker = None
+        self.tracker_response = None
+    
+    def download_async(self, engine, callback, count=3):
+        """Like download_retry(), but downloads this torrent and checks its
+        trackers with engine, an asynchttp.Engine. callback is called with
+        the outcome when it is done, like the outcomes of pool.run().
+        
+        If it fails, download() and fetch() raise the same error afterwards
+        instead of trying again.
+        """
+        attempts = {'count': 1}
+        def verified(outcome):
+            success, value = outcome
+            if success:
+                callback((True, self.dict))
+                return
+            if issubclass(value[0], TorrentDownloadError) \
+                    and attempts['count'] < count:
+                logging.debug("Download attempt %s of %s failed: %s. "
+                             "Retrying..." % (attempts['count'], count, 
+                                              value[1]))
+                attempts['count'] += 1
+                self.verify_async(engine, verified)
+                return
+            self._error = value
+            callback(outcome)
+        self.verify_async(engine, verified)
+    
     def download_retry(self, count=3):
         """Same as download(), but retries count times upon failure."""
         i = 1
@@ -271,36 +552,66 @@ class Torrent(object):
                     raise
 
     def _check_tracker(self, url, torrent_dict, scrape=False):
-        """Check tracker. url is an announce URL if scrape is False.
+        """Check tracker. url is an announce URL if scrape is False. Whether
+        the tracker could be reached is recorded against url in 
+        tracker_health.
         
         Returns tracker response as bedecoded dictionary.
         """
+        health_url = url
         if not scrape:
             url = self._get_scrape_url(url)
-        info_hash = sha.new(bencode.bencode(torrent_dict['info'])).digest()
-        req_url = url+"?"+urllib.urlencode({'info_hash': info_hash}) 
-        request = urllib2.Request(req_url)
-        request.add_header('User-Agent', USER_AGENT)
-        try:
-            f = urllib2.urlopen(request)
-        except urllib2.URLError, e:
-            if hasattr(e, "reason"):
-                raise TorrentTrackerError, "Could not reach tracker: %s" \
-                                            % e.reason
-            elif hasattr(e, "code"):
-                raise TorrentTrackerError, e
-            else:
-                raise TorrentTrackerError, "Unknown URLError: %s" % e
+        info_hash = self._get_info_hash(torrent_dict)
+        tracker_response = scrape_cache.get(url, info_hash)
+        if tracker_response is not None:
+            logging.debug("Cached tracker response: %s" % tracker_response)
+        else:
+            tracker_response = _scrape(url, [info_hash], health_url)
+            scrape_cache.set(url, info_hash, tracker_response,
+                             config['scrape-cache-ttl'])
+        return _check_scrape(tracker_response)
+    
+    def _check_tracker_async(self, engine, url, callback):
+        """Like _check_tracker() for the announce URL url of this torrent, 
+        but with engine, an asynchttp.Engine. callback is called with the
+        outcome."""
         try:
-            tracker_response = bencode.bdecode(f.read())
-        except bencode.BTFailure:
-            raise TorrentTrackerError, "Unrecognised tracker response. " \
-                                       "Torrent may not exist on tracker."
-        logging.debug("Valid tracker response: %s" % tracker_response)
-        if "files" not in tracker_response.keys() \
-                or not tracker_response["files"]:
-            raise TorrentTrackerError, "Torrent does not exist on tracker."
-        return tracker_response
+            scrape_url = self._get_scrape_url(url)
+            info_hash = self._get_info_hash(self.dict)
+            tracker_response = scrape_cache.get(scrape_url, info_hash)
+        except Exception:
+            callback((False, sys.exc_info()))
+            return
+        if tracker_response is not None:
+            logging.debug("Cached tracker response: %s" % tracker_response)
+            callback(pool.call(_check_scrape, tracker_response))
+            return
+        def scraped(outcome):
+            if outcome[0]:
+                scrape_cache.set(scrape_url, info_hash, outcome[1],
+                                 config['scrape-cache-ttl'])
+                outcome = pool.call(_check_scrape, outcome[1])
+            callback(outcome)
+        _scrape_async(engine, scrape_url, [info_hash], url, scraped)
+    
+    def _get_info_hash(self, torrent_dict):
+        if torrent_dict is self.dict and self.info_hash:
+            return self.info_hash
+        # Not our own torrent, so there are no original bytes to hash
+        return sha.new(bencode.bencode(torrent_dict['info'])).digest()
+
+    def _get_announce_urls(self):
+        """Returns the announce URLs of this torrent without duplicates, main
+        tracker first."""
+        urls = [self.dict['announce']]
+        for tier in self.dict.get('announce-list') or []:
+            # announce-list is a list of tiers, each a list of URLs
+            if isinstance(tier, str):
+                tier = [tier]
+            for url in tier:
+                if url not in urls:
+                    urls.append(url)
+        return urls
 
     def _get_scrape_url(self, announce_url):
         """Converts an announce URL to a scrape URL."""
@@ -318,8 +629,304 @@ class Torrent(object):
         s = s.replace(":", "-") # Make our dates pretty
         return re.sub(r'[^-A-Za-z0-9_\[\]. ]', '', s)
         
+def scrape_torrents(torrents):
+    """Checks the trackers of several downloaded torrents, sending one 
+    scrape request for each batch of torrents that share a tracker instead
+    of one per torrent. Each torrent is tried on its trackers in the order
+    Torrent.verify() would use until one of them knows about it.
+    
+    The tracker and tracker_response properties are set for torrents a 
+    tracker knows about, so Torrent.download() doesn't check them again, 
+    and the responses are cached in scrape_cache for Torrent.verify(). 
+    Trackers without scrape support are left to Torrent.verify().
+    
+    Returns a list of the torrents a tracker knew about.
+    """
+    pending = _get_pending_scrapes(torrents)
+    found = []
+    while pending:
+        for url, scrape_url, batch in _get_scrape_batches(pending):
+            logging.debug("Checking tracker (%s) for %s torrents..." 
+                            % (url, len(batch)))
+            try:
+                files = _scrape(scrape_url, 
+                    [torrent.info_hash for torrent in batch], url)
+                files = files.get("files") or {}
+            except TorrentTrackerError, e:
+                logging.debug("Tracker error: %s" % e)
+                files = {}
+            _record_scrapes(pending, found, url, scrape_url, batch, files)
+    return found
+
+def scrape_torrents_async(engine, torrents, callback):
+    """Like scrape_torrents(), but sends the scrape requests for each round
+    of trackers at once with engine, an asynchttp.Engine. callback is called
+    with the outcome when it is done, like the outcomes of pool.run()."""
+    pending = _get_pending_scrapes(torrents)
+    found = []
+    def next_round():
+        outcome = pool.call(_get_scrape_batches, pending)
+        if not outcome[0]:
+            callback(outcome)
+        elif not outcome[1]:
+            callback((True, found))
+        else:
+            pool.run_async(scrape_batch, outcome[1], finished)
+    def scrape_batch(item, done):
+        url, scrape_url, batch = item
+        logging.debug("Checking tracker (%s) for %s torrents..." 
+                        % (url, len(batch)))
+        def scraped(outcome):
+            success, value = outcome
+            if success:
+                files = value.get("files") or {}
+            elif issubclass(value[0], TorrentTrackerError):
+                logging.debug("Tracker error: %s" % value[1])
+                files = {}
+            else:
+                done(outcome)
+                return
+            done(pool.call(_record_scrapes, pending, found, url, scrape_url,
+                           batch, files))
+        _scrape_async(engine, scrape_url, 
+                      [torrent.info_hash for torrent in batch], url, scraped)
+    def finished(outcomes):
+        for outcome in outcomes:
+            if not outcome[0]:
+                callback(outcome)
+                return
+        next_round()
+    next_round()
+
+def _get_pending_scrapes(torrents):
+    """Returns a dictionary of the downloaded torrents of torrents that 
+    haven't found a tracker to the announce URLs to try, best first."""
+    pending = {}
+    for torrent in torrents:
+        if torrent.dict and not torrent.tracker:
+            urls, skipped = tracker_health.order(torrent._get_announce_urls())
+            pending[torrent] = urls
+    return pending
+
+def _get_scrape_batches(pending):
+    """Groups pending torrents, see _get_pending_scrapes(), by the next 
+    tracker they have to try, forgetting those with none left. Returns a 
+    list of (announce URL, scrape URL, torrents) tuples with at most 
+    scrape-batch-size torrents each."""
+    groups = {}
+    for torrent, urls in pending.items():
+        while urls:
+            try:
+                scrape_url = torrent._get_scrape_url(urls[0])
+                break
+            except TorrentNoScrapeError:
+                urls.pop(0)
+        if not urls:
+            del pending[torrent]
+            continue
+        groups.setdefault((urls[0], scrape_url), []).append(torrent)
+    batches = []
+    for (url, scrape_url), group in groups.items():
+        for i in range(0, len(group), config['scrape-batch-size']):
+            batches.append((url, scrape_url, 
+                            group[i:i + config['scrape-batch-size']]))
+    return batches
+
+def _record_scrapes(pending, found, url, scrape_url, batch, files):
+    """Records the files of a scrape response for a batch of torrents from 
+    _get_scrape_batches(), moving those the tracker knew about from pending
+    to found."""
+    for torrent in batch:
+        if files.get(torrent.info_hash):
+            response = {"files": 
+                        {torrent.info_hash: files[torrent.info_hash]}}
+            scrape_cache.set(scrape_url, torrent.info_hash, 
+                             response, config['scrape-cache-ttl'])
+            torrent.tracker = url
+            torrent.tracker_response = response
+            found.append(torrent)
+            del pending[torrent]
+        else:
+            pending[torrent].pop(0)
+
+def prefetch_torrents(torrents):
+    """Downloads torrents that haven't been already, using torrent-jobs 
+    threads from the config, then checks their trackers together with
+    scrape_torrents(). Errors are ignored: Torrent.download() raises them 
+    again. Each torrent is only prefetched once."""
+    torrents = [torrent for torrent in torrents if not torrent._prefetched]
+    for torrent in torrents:
+        torrent._prefetched = True
+    pool.run(lambda torrent: torrent.dict or torrent.fetch(), torrents, 
+             config['torrent-jobs'])
+    scrape_torrents([torrent for torrent in torrents if torrent.dict])
+
+def prefetch_torrents_async(engine, torrents, callback):
+    """Like prefetch_torrents(), but downloads the torrents at once with 
+    engine, an asynchttp.Engine, then checks their trackers with 
+    scrape_torrents_async(). callback is called with the outcome when it is
+    done, like the outcomes of pool.run()."""
+    torrents = [torrent for torrent in torrents if not torrent._prefetched]
+    for torrent in torrents:
+        torrent._prefetched = True
+    def fetch(torrent, done):
+        if torrent.dict:
+            done((True, torrent.dict))
+        else:
+            torrent.fetch_async(engine, done)
+    def fetched(outcomes):
+        scrape_torrents_async(engine, 
+            [torrent for torrent in torrents if torrent.dict], callback)
+    pool.run_async(fetch, torrents, fetched)
+
+def _write_atomically(path, data):
+    """Writes data to path through a hidden temporary file in the same
+    directory, which is renamed into place once it is complete, so nothing
+    watching the directory sees a partly written file. Raises 
+    TorrentWriteError if it can't be written."""
+    directory, filename = os.path.split(path)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    for i in range(100):
+        temp_path = os.path.join(directory, ".%s.%08x.part" 
+                                 % (filename, random.getrandbits(32)))
+        try:
+            fd = os.open(temp_path, flags, 0666)
+            break
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise TorrentWriteError, "Can't open torrent file for " \
+                                         "writing: %s" % e
+    else:
+        raise TorrentWriteError, "Can't open torrent file for writing: " \
+                                 "no free temporary filename in %s" \
+                                 % directory
+    try:
+        try:
+            offset = 0
+            while offset < len(data):
+                offset += os.write(fd, buffer(data, offset, 65536))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Windows won't rename over an existing file
+            if os.name != 'nt' or not os.path.exists(path):
+                raise
+            os.remove(path)
+            os.rename(temp_path, path)
+    except (IOError, OSError), e:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise TorrentWriteError, "Can't write torrent file: %s" % e
+
+def _read_bencoded(f, max_size, spans=None):
+    """Reads and decodes bencoded data from the file-like object f as it
+    arrives, giving up with BTFailure as soon as it is invalid, nested more 
+    than max-bencode-depth deep or longer than max_size bytes. Returns a 
+    (value, data) tuple. See bencode.Decoder."""
+    try:
+        return bencode.bdecode_stream(f, max_size=max_size, spans=spans,
+                                      max_depth=config['max-bencode-depth'])
+    finally:
+        f.close()
+
+def _decode_bencoded(data, max_size, spans=None):
+    """Decodes bencoded data that has already been downloaded with the same
+    limits as _read_bencoded()."""
+    decoder = bencode.Decoder(max_size=max_size, spans=spans,
+                              max_depth=config['max-bencode-depth'])
+    decoder.feed(data)
+    return decoder.close()
+
+def _scrape(url, info_hashes, health_url):
+    """Sends a scrape request for info_hashes to the scrape URL url and
+    returns the response as a bdecoded dictionary. Whether the tracker could
+    be reached is recorded against health_url in tracker_health."""
+    start = time.time()
+    timer = timings.start()
+    try:
+        try:
+            f = connection_pool.urlopen(_get_scrape_request(url, info_hashes))
+            tracker_response = _read_bencoded(f, 
+                                              config['max-scrape-size'])[0]
+        except urllib2.URLError, e:
+            raise _get_scrape_error(health_url, e)
+        except bencode.BTFailure:
+            raise _get_scrape_error(health_url)
+    finally:
+        timings.stop(timer, 'tracker', host=urlparse.urlsplit(url)[1])
+    latency = time.time() - start
+    logging.debug("Valid tracker response: %s" % tracker_response)
+    tracker_health.record_success(health_url, latency)
+    return tracker_response
+
+def _scrape_async(engine, url, info_hashes, health_url, callback):
+    """Like _scrape(), but sends the request with engine, an 
+    asynchttp.Engine. callback is called with the outcome, like the outcomes
+    of pool.run()."""
+    start = time.time()
+    timer = timings.start()
+    def scraped(response, error):
+        timings.stop(timer, 'tracker', host=urlparse.urlsplit(url)[1])
+        latency = time.time() - start
+        callback(pool.call(_scraped_async, health_url, response, error, 
+                           latency))
+    engine.fetch(_get_scrape_request(url, info_hashes), scraped, 
+                 max_size=config['max-scrape-size'])
+
+def _scraped_async(health_url, response, error, latency):
+    """Returns the bdecoded response to _scrape_async()."""
+    if isinstance(error, asynchttp.ResponseTooLargeError):
+        raise _get_scrape_error(health_url)
+    elif error is not None:
+        raise _get_scrape_error(health_url, error)
+    try:
+        tracker_response = _decode_bencoded(response.body, 
+                                            config['max-scrape-size'])
+    except bencode.BTFailure:
+        raise _get_scrape_error(health_url)
+    logging.debug("Valid tracker response: %s" % tracker_response)
+    tracker_health.record_success(health_url, latency)
+    return tracker_response
+
+def _get_scrape_request(url, info_hashes):
+    """Returns the URL of a scrape request for info_hashes to the scrape URL
+    url."""
+    return url+"?"+urllib.urlencode([('info_hash', info_hash) 
+                                     for info_hash in info_hashes])
+
+def _get_scrape_error(health_url, e=None):
+    """Records a failed scrape against health_url in tracker_health and
+    returns the TorrentTrackerError to raise for e, a urllib2.URLError, or
+    for an unrecognised response if e is None."""
+    tracker_health.record_failure(health_url)
+    if e is None:
+        return TorrentTrackerError("Unrecognised tracker response. "
+                                   "Torrent may not exist on tracker.")
+    elif hasattr(e, "reason"):
+        return TorrentTrackerError("Could not reach tracker: %s" % e.reason)
+    elif hasattr(e, "code"):
+        return TorrentTrackerError(e)
+    else:
+        return TorrentTrackerError("Unknown URLError: %s" % e)
+
+def _check_scrape(tracker_response):
+    """Returns a scrape response for a single torrent, raising 
+    TorrentTrackerError if the torrent isn't in it."""
+    if "files" not in tracker_response.keys() \
+            or not tracker_response["files"]:
+        raise TorrentTrackerError, "Torrent does not exist on tracker."
+    return tracker_response
+
 class _BaseEpisode(object):
-    """The abstract class for an episode object."""
+    """The abstract class for an episode object. Subclasses declare 
+    __slots__ too, so episodes don't each carry a dictionary."""
+    __slots__ = ('show', 'key', 'torrents')
+    
     def __init__(self, show, key):
         self.show = show
         self.key = key
@@ -343,9 +950,21 @@ class _BaseEpisode(object):
         return torrent
     
     def get_torrent(self, quality=None):
-        """Picks a suitable torrent and returns it."""
+        """Picks a suitable torrent and returns it. Torrents that have failed
+        recently are skipped, see failed_torrents. The other torrents are
+        released once it has been picked, see Torrent.release()."""
         if not quality:
-            quality = config["quality"]
+            quality = self.show.quality
+        chosen = None
+        try:
+            chosen = self._get_torrent(quality)
+        finally:
+            for torrent in self.torrents:
+                if torrent is not chosen:
+                    torrent.release()
+        return chosen
+    
+    def _get_torrent(self, quality):
         # bish, bash, bosh
         #if len(self.torrents) == 1 and self.torrents[0].quality <= quality:
         #    return self.torrents[0]
@@ -354,46 +973,15 @@ class _BaseEpisode(object):
         #elif len(self.torrents) == 1:
         #    raise EpisodeNoWorkingTorrentsError
         
-        # Use the highest quality available in the feed. This is to avoid
-        # delays trying to find a higher quality torrent if there's really
-        # no chance of finding one.
-        # The only disadvantage to this method is when a higher quality 
-        # episode does actually pop up, we will probably miss the first one.
-        wanted_quality = min(quality, self.show.best_quality)
-        shortlist = []
         # First try : download the episodes for which we have the wanted
         # quality
-        for torrent in self.torrents:
-            if torrent.quality == wanted_quality:
-                try:
-                    torrent.download_retry()
-                    shortlist.append(torrent)
-                except TorrentError, e:
-                    logging.warn("Torrent download failed: %s" % e)
+        shortlist = self._download_torrents(
+            failed_torrents.filter(self._get_wanted_torrents(quality)))
         # Second try : download the episodes for which the quality delay has
         # expired, with the best guess for quality
         if not shortlist:
-            min_published_time = sorted(self.torrents,
-                key=operator.attrgetter("published_time"))[0].published_time
-            d = (datetime.datetime.now() - min_published_time)
-            if (d.days * 86400 + d.seconds) > (6 * 3600 * wanted_quality):
-                # Pick highest quality that isn't larger than the wanted
-                # quality
-                max_quality = 0
-                for torrent in self.torrents:
-                    if torrent.quality > wanted_quality:
-                        continue
-                    if torrent.quality > max_quality:
-                        max_quality = torrent.quality
-                for torrent in self.torrents:
-                    if torrent.quality == max_quality:
-                        try:
-                            torrent.download_retry()
-                            shortlist.append(torrent)
-                        except TorrentError, e:
-                            logging.warn("Torrent download failed: %s" % e)
-            else:
-                raise EpisodeQualityDelayError
+            shortlist = self._download_torrents(
+                failed_torrents.filter(self._get_fallback_torrents(quality)))
         if not shortlist:
             raise EpisodeNoWorkingTorrentsError
         # Find best torrent out of our shortlist
@@ -404,10 +992,133 @@ class _BaseEpisode(object):
                       key=operator.attrgetter("published_time"), 
                       reverse=True)[0]
     
+    def _get_wanted_torrents(self, quality=None):
+        """Returns the torrents that get_torrent tries first."""
+        if not quality:
+            quality = self.show.quality
+        # Use the highest quality available in the feed. This is to avoid
+        # delays trying to find a higher quality torrent if there's really
+        # no chance of finding one.
+        # The only disadvantage to this method is when a higher quality 
+        # episode does actually pop up, we will probably miss the first one.
+        wanted_quality = min(quality, self.show.best_quality)
+        return [torrent for torrent in self.torrents 
+                if torrent.quality == wanted_quality]
+    
+    def _get_fallback_torrents(self, quality=None):
+        """Returns the torrents that get_torrent tries if none of the wanted
+        ones work, or raises EpisodeQualityDelayError if it is too soon to
+        give up on the wanted quality."""
+        if not quality:
+            quality = self.show.quality
+        wanted_quality = min(quality, self.show.best_quality)
+        min_published_time = sorted(self.torrents,
+            key=operator.attrgetter("published_time"))[0].published_time
+        d = (datetime.datetime.now() - min_published_time)
+        if (d.days * 86400 + d.seconds) <= (6 * 3600 * wanted_quality):
+            raise EpisodeQualityDelayError
+        # Pick highest quality that isn't larger than the wanted quality
+        max_quality = 0
+        for torrent in self.torrents:
+            if torrent.quality > wanted_quality:
+                continue
+            if torrent.quality > max_quality:
+                max_quality = torrent.quality
+        return [torrent for torrent in self.torrents 
+                if torrent.quality == max_quality]
+    
+    def prefetch_async(self, engine, callback, quality=None):
+        """Downloads the torrents get_torrent() would try and checks their
+        trackers with engine, an asynchttp.Engine, all at once. get_torrent()
+        and save() then pick the same torrent they would have otherwise, 
+        without waiting for the network. callback is called with the outcome
+        when it is done, like the outcomes of pool.run()."""
+        def download(torrents, done):
+            torrents = sorted(torrents, 
+                              key=operator.attrgetter("published_time"),
+                              reverse=True)
+            def prefetched(outcome):
+                if not outcome[0]:
+                    callback(outcome)
+                    return
+                pool.run_async(
+                    lambda torrent, done: torrent.download_async(engine, done),
+                    torrents, done)
+            if config['first-working-torrent']:
+                prefetched((True, None))
+            else:
+                prefetch_torrents_async(engine, torrents, prefetched)
+        def wanted_done(outcomes):
+            for outcome in outcomes:
+                if outcome[0]:
+                    callback((True, None))
+                    return
+            try:
+                torrents = failed_torrents.filter(
+                    self._get_fallback_torrents(quality))
+            except EpisodeQualityDelayError:
+                callback((True, None))
+                return
+            except Exception:
+                callback((False, sys.exc_info()))
+                return
+            download(torrents, lambda outcomes: callback((True, None)))
+        download(failed_torrents.filter(self._get_wanted_torrents(quality)),
+                 wanted_done)
+    
+    def _download_torrents(self, torrents):
+        """Downloads torrents using torrent-jobs threads from the config and
+        returns a list of the ones that worked, latest published first.
+        
+        If first-working-torrent is set in the config, no more torrents are
+        started once the torrent that get_torrent would pick has worked.
+        """
+        # get_torrent picks the latest torrent, so start with that
+        torrents = sorted(torrents, key=operator.attrgetter("published_time"),
+                          reverse=True)
+        if not config['first-working-torrent']:
+            # They will all be downloaded anyway, so check the trackers they
+            # share in one go
+            prefetch_torrents(torrents)
+        finished = [None] * len(torrents)
+        def done(i, outcome):
+            success, value = outcome
+            finished[i] = success
+            if success:
+                failed_torrents.record_success(torrents[i].url)
+            elif issubclass(value[0], TorrentError):
+                logging.warn("Torrent download failed: %s" % value[1])
+                failed_torrents.record_failure(torrents[i].url, value[1])
+            if not config['first-working-torrent']:
+                return False
+            # Every torrent ranked above a working one must have failed
+            for success in finished:
+                if success is None:
+                    return False
+                elif success:
+                    return True
+            return False
+        outcomes = pool.run(lambda torrent: torrent.download_retry(), 
+                            torrents, config['torrent-jobs'], done)
+        shortlist = []
+        for torrent, outcome in zip(torrents, outcomes):
+            if not outcome:
+                continue
+            success, value = outcome
+            if success:
+                shortlist.append(torrent)
+            elif not issubclass(value[0], TorrentError):
+                pool.reraise(value)
+        return shortlist
+    
     def save(self, quality=None):
         """Picks a suitable torrent for this episode (get_torrent), 
-        saves it, then returns path saved to."""
-        return self.get_torrent(quality).save()
+        saves it, then returns path saved to. The torrent is released once
+        it has been saved."""
+        torrent = self.get_torrent(quality)
+        path = torrent.save()
+        torrent.release()
+        return path
     
     def __str__(self):
         raise NotImplementedError
@@ -423,6 +1134,8 @@ class Episode(_BaseEpisode):
     quality - Integer quality of episode, as specified in config
     published_time - Publishing time of torrent as a datetime.datetime object
     """
+    __slots__ = ()
+    
     def __init__(self, show, torrent_url, quality, published_time):
         super(Episode, self).__init__(show, published_time)
         super(Episode, self).add_torrent(torrent_url, quality, published_time)
@@ -444,6 +1157,8 @@ class EpisodeWithSeasonAndEpisode(_BaseEpisode):
     show - Show object that this episode belongs to
     key - (season, episode) tuple
     """ 
+    __slots__ = ()
+    
     def __str__(self):
         return "%s %02dx%02d" % (self.show, self.key[0], self.key[1])
 
@@ -455,6 +1170,8 @@ class EpisodeWithDate(_BaseEpisode):
     show - Show object that this episode belongs to
     key - Date of show's airing as a date object
     """
+    __slots__ = ()
+    
     def __str__(self):
         return "%s %s" % (self.show, self.key)
 
@@ -468,6 +1185,8 @@ class SpecialEpisode(EpisodeWithDate):
     show - Show object that this episode belongs to
     published_date - Date of show's airing as a date object
     """
+    __slots__ = ()
+    
     def __str__(self):
         return "%s %s [special]" % (self.show, self.key)
 
@@ -485,6 +1204,8 @@ class EpisodeWithTitle(Episode):
     quality - Integer quality of episode, as specified in config
     published_time - Publishing time of torrent as a datetime.datetime object
     """
+    __slots__ = ('title',)
+    
     def __init__(self, show, title, torrent_url, quality, published_time):
         super(EpisodeWithTitle, self).__init__(show, torrent_url, quality, 
                                       published_time)
@@ -493,6 +1214,111 @@ class EpisodeWithTitle(Episode):
     def __str__(self):
         return "%s - %s" % (self.show, self.title)
 
+# Fields of a tvRSS.net description, such as "Show Name: Lost; Show Title: 
+# Pilot; Season: 1; Episode: 1", in any order
+_field_re = re.compile(r'(Show\s*Name|Show\s*Title|Season|Episode\s*Date|'
+                       r'Episode)\s*:\s*([^;]*)')
+_field_names = {
+    'showname': 'show_name',
+    'showtitle': 'show_title',
+    'season': 'season',
+    'episodedate': 'date',
+    'episode': 'episode',
+}
+_whitespace_re = re.compile(r'\s+')
+
+class FeedEntry(object):
+    """The details of a feed entry that episodes are keyed by, parsed from
+    its description with parse_entry(). Details that are missing from the 
+    description are None.
+    
+    Properties:
+    url - URL to the torrent
+    title - Title of the entry
+    quality - Integer quality of the torrent, as specified in config
+    published_time - Publishing time as a datetime.datetime object
+    show_name - Human friendly name of the show
+    show_title - Title of the episode, None if it is "n/a"
+    season - Season number
+    episode - Episode number
+    date - Date of the episode's airing as a datetime.date object
+    guid - GUID of the entry, or its link if it has none
+    """
+    __slots__ = ('url', 'title', 'quality', 'published_time', 'show_name',
+                 'show_title', 'season', 'episode', 'date', 'guid')
+    
+    def __init__(self, url, title, quality, published_time, guid=None):
+        self.url = url
+        self.title = title
+        self.quality = quality
+        self.published_time = published_time
+        self.guid = guid
+        self.show_name = None
+        self.show_title = None
+        self.season = None
+        self.episode = None
+        self.date = None
+
+def parse_entry(entry, quality_matcher=None):
+    """Returns a FeedEntry for a feedparser entry, reading its description
+    in a single scan. Its quality is given by quality_matcher, a 
+    QualityMatcher, or quality_matches in config if it is None."""
+    if quality_matcher is None:
+        quality_matcher = QualityMatcher(config["quality_matches"])
+    record = FeedEntry(
+        url = entry.link,
+        title = entry.title,
+        quality = quality_matcher.get_quality(entry.title),
+        published_time = datetime.datetime(*entry.updated_parsed[:6]),
+        guid = get_guid(entry))
+    for m in _field_re.finditer(entry.get('description', '')):
+        name = _field_names[_whitespace_re.sub('', m.group(1)).lower()]
+        value = m.group(2).strip()
+        if name == 'show_name':
+            record.show_name = value
+        elif name == 'show_title':
+            if value and "n/a" not in value.lower():
+                record.show_title = value
+        elif name == 'date':
+            try:
+                record.date = datetime.date(*(time.strptime(
+                    value, "%Y-%m-%d")[0:3]))
+            except ValueError:
+                pass
+        elif value.isdigit():
+            setattr(record, name, int(value))
+    return record
+
+def parse_feed(data):
+    """Parses a feed with the parser set in feed-parser in the config. This
+    is either feedparser, or tvrss, which is faster but only reads what 
+    Show needs. tvrss falls back to feedparser on feeds that it can't read
+    exactly as feedparser would, see tvrss.Parser."""
+    if config['feed-parser'] == 'tvrss':
+        try:
+            return tvrss.parse(data)
+        except tvrss.UnsupportedFeedError, e:
+            logging.debug("Parsing feed with feedparser instead: %s" % e)
+    return feedparser.parse(data)
+
+def get_guid(entry):
+    """Returns the GUID of a feedparser entry, or its link if it has 
+    none."""
+    return entry.get('id') or entry.get('link')
+
+def hash_guid(guid):
+    """Returns the short hash of an entry GUID that Show.feed_seen keeps, 
+    so it takes little room in the state file."""
+    if isinstance(guid, unicode):
+        guid = guid.encode('utf-8')
+    return sha.new(guid).hexdigest()[:16]
+
+def normalize_title(title):
+    """Returns an episode title in lower case with runs of whitespace 
+    replaced by single spaces, so titles that differ only in those respects
+    compare equal."""
+    return _whitespace_re.sub(' ', title).strip().lower()
+
 
 class Show(object):
     """Represents a show. For example, "Friends".
@@ -518,10 +1344,23 @@ class Show(object):
     feed_last_modified - The last last_modified response from the feed server
                          as a datetime.datetime object with 6 arguments. If a
                          string is supplied, it will be converted.
+    quality - The preferred and maximum quality to download for this show. 
+              Default: "quality" in config
+    quality_matches - Dictionary of substrings of torrent titles to 
+                      qualities for this show. Default: "quality_matches" in
+                      config
+    feed_watermark - Publishing time before which every entry of the feed 
+                     was old at the last check, as a datetime.datetime 
+                     object with 6 arguments. If a string is supplied, it 
+                     will be converted. See get_new_entries().
+    feed_seen - Hashes of the GUIDs of the entries published since 
+                feed_watermark that were old at the last check, see 
+                hash_guid(). A space-separated string will be split.
     """
     def __init__(self, exact_name, human_name=None, show_type=None, 
                  last_key=None, last_special=None, feed_etag=None, 
-                 feed_last_modified=None):
+                 feed_last_modified=None, quality=None, 
+                 quality_matches=None, feed_watermark=None, feed_seen=None):
         self.exact_name = exact_name
         self.human_name = human_name
         self.show_type = show_type
@@ -566,10 +1405,31 @@ class Show(object):
             assert isinstance(self.feed_last_modified,
                 datetime.datetime), "feed_last_modified is not a " \
                 "datetime.datetime object"
+        self.quality = quality
+        if self.quality is None:
+            self.quality = config["quality"]
+        if quality_matches is None:
+            quality_matches = config["quality_matches"]
+        self.quality_matcher = QualityMatcher(quality_matches)
+        self.feed_watermark = feed_watermark
+        if isinstance(self.feed_watermark, str):
+            self.feed_watermark = datetime.datetime(*(time.strptime(
+                        self.feed_watermark, "%Y-%m-%d %H:%M:%S")[0:6]))
+        if isinstance(feed_seen, str):
+            feed_seen = feed_seen.split()
+        self.feed_seen = set(feed_seen or [])
         self.rss = None
+        self.entries = None
+        # Publishing times of every entry of the feed the last time it was
+        # read, as datetime.datetime objects
+        self.published_times = []
         self.episodes = {}
         self.specials = {}
         self.best_quality = 0
+        # Keys of "title" episodes by normalize_title() of their titles
+        self._titles = {}
+        # Whether episodes and specials have been read from the feed
+        self._episodes_built = False
 
     def save_new_episodes(self):
         """Saves new episodes and sets both last_key and last_special.
@@ -577,6 +1437,14 @@ class Show(object):
         Returns a (episodes, specials) tuple containing dictionaties of the 
         episodes and specials downloaded."""
         new_episodes, new_specials = self.get_new_episodes()
+        if not config['first-working-torrent']:
+            # Download the torrents each episode tries first up front, so the
+            # trackers they share are checked in batches
+            torrents = []
+            for episode in new_episodes.values() + new_specials.values():
+                torrents.extend(failed_torrents.filter(
+                    episode._get_wanted_torrents(self.quality)))
+            prefetch_torrents(torrents)
         for key in sorted(new_episodes.keys()):
             if self._save_episode(new_episodes[key]):
                 self.last_key = key
@@ -585,35 +1453,96 @@ class Show(object):
                 self.last_special = key
         return (new_episodes, new_specials)
 
+    def save_new_episodes_async(self, engine, callback):
+        """Like save_new_episodes(), but downloads the feed and the torrents
+        of new episodes with engine, an asynchttp.Engine, so many shows can
+        be checked at once on one thread. The episodes are then picked and 
+        saved by save_new_episodes() exactly as they would be otherwise. 
+        callback is called with its outcome when it is done, like the 
+        outcomes of pool.run()."""
+        def prefetched(outcomes):
+            callback(pool.call(self.save_new_episodes))
+        def fetched(outcome):
+            if not outcome[0]:
+                callback(outcome)
+                return
+            outcome = pool.call(self.get_new_episodes)
+            if not outcome[0]:
+                callback(outcome)
+                return
+            new_episodes, new_specials = outcome[1]
+            episodes = new_episodes.values() + new_specials.values()
+            def prefetch(episode, done):
+                episode.prefetch_async(engine, done, self.quality)
+            if config['first-working-torrent']:
+                pool.run_async(prefetch, episodes, prefetched)
+                return
+            # Check the trackers that the episodes' torrents share in 
+            # batches, as save_new_episodes() does
+            torrents = []
+            for episode in episodes:
+                torrents.extend(failed_torrents.filter(
+                    episode._get_wanted_torrents(self.quality)))
+            prefetch_torrents_async(engine, torrents, 
+                lambda outcome: pool.run_async(prefetch, episodes, 
+                                               prefetched))
+        if self.rss or self.entries is not None or self._episodes_built:
+            fetched((True, self.rss))
+        else:
+            self._get_rss_feed_async(engine, fetched)
+
+    def refresh(self):
+        """Forgets the downloaded feed and its episodes, so the next call to
+        get_episodes() or save_new_episodes() checks the feed again. Used to 
+        check a show more than once in a long-running process."""
+        self.rss = None
+        self.entries = None
+        self.published_times = []
+        self.episodes = {}
+        self.specials = {}
+        self.best_quality = 0
+        self._titles = {}
+        self._episodes_built = False
+
     def _save_episode(self, episode):
             try:
-                filename = episode.save(config["quality"])
+                filename = episode.save(self.quality)
                 logging.info("%s saved to %s" % (episode, filename))
                 return True
             except EpisodeQualityDelayError:
                 logging.debug("Delaying download of this episode to wait for "
                              "a higher quality to be released.")
             except EpisodeNoWorkingTorrentsError:
-                #if key == keys[-1]:
-                    # TODO: only warn about this once otherwise cron jobs
-                    #       will get oh-so-annoying. store in state file
-                    #       so we're only bugged once or twice
-                #    logging.info("No working torrents found for %s. The "
-                #                 "download will be attempted again next "
-                #                 "time PyTVShows is run." 
-                #                % new_episodes[key])
-                #else:
-                    # TODO: store failed torrents in the state file for
-                    #       retrying
-                logging.warn("No working torrents found for %s." % episode)
+                # Only warn once a day, otherwise cron jobs will get 
+                # oh-so-annoying. The torrents are retried with backoff
+                if failed_torrents.should_warn(str(episode)):
+                    logging.warn("No working torrents found for %s. The "
+                                 "download will be attempted again later." 
+                                 % episode)
+                else:
+                    logging.debug("Still no working torrents found for %s." 
+                                    % episode)
             return False
 
     def get_new_episodes(self):
         """Returns a (episodes, specials) tuple with dictionaries of new 
         episodes and specials.
+        
+        Once show_type and last_key are known, only the entries that are
+        new are made into episodes, see get_new_entries(). Otherwise 
+        get_episodes() reads all of them.
         """
-        if not self.episodes and not self.specials:
-            self.get_episodes()
+        if not self._episodes_built:
+            if self.show_type and self.last_key is not None \
+                    and self.entries is None:
+                self._add_episodes(self.get_new_entries())
+                self._episodes_built = True
+            else:
+                self.get_episodes()
+                self._update_watermark([
+                    (entry.published_time, entry.guid, 
+                     self._is_new(*self._get_entry_key(entry)))
+                    for entry in self.get_entries()])
         new_episodes = {}
         for key, episode in self.episodes.items():
             if key > self.last_key:
@@ -630,136 +1559,220 @@ class Show(object):
         episodes and specials properties.
         
         Updates last_key and last_special. Runs get_details() if necessary."""
+        if not self.get_entries():
+            raise ShowFeedNoEpisodesError
+        if not self.show_type:
+            self.get_details()
+        keys, special_keys = self._add_episodes(self.get_entries())
+        if keys and not self.last_key:
+            self.last_key = max(keys)
+        if special_keys and not self.last_special:
+            self.last_special = max(special_keys)
+        self._episodes_built = True
+        return (self.episodes, self.specials)
+    
+    def get_new_entries(self):
+        """Returns the entries of the RSS feed that are newer than last_key
+        or last_special as a list of FeedEntry objects, downloading the feed
+        if necessary. show_type and last_key must be known.
+        
+        Entries that were already old at the last check are skipped without
+        being parsed: those in feed_seen, and those published before 
+        feed_watermark. Only the publishing times of the entries before 
+        feed_watermark are read, for published_times, and their titles too
+        while best_quality could still go up. feed_watermark and feed_seen
+        are then updated for the next check.
+        
+        If last_special isn't known, the specials that are read are old and
+        it is set to the latest of them, as get_episodes() does.
+        """
         if not self.rss:
             self._get_rss_feed()
         if not self.rss['entries']:
             raise ShowFeedNoEpisodesError
-        if not self.show_type:
-            self.get_details()
-        episodes = {}
+        start = timings.start()
+        new_entries = []
+        # (published_time, guid, new) of the entries read
+        read = []
+        special_keys = []
+        published_times = []
+        for entry in self.rss['entries']:
+            published_time = datetime.datetime(*entry.updated_parsed[:6])
+            published_times.append(published_time)
+            if self.feed_watermark and published_time < self.feed_watermark:
+                if self.best_quality < self.quality:
+                    self._note_quality(
+                        self.quality_matcher.get_quality(entry.title))
+                continue
+            guid = get_guid(entry)
+            if guid and hash_guid(guid) in self.feed_seen:
+                self._note_quality(
+                    self.quality_matcher.get_quality(entry.title))
+                read.append((published_time, guid, False))
+                continue
+            record = parse_entry(entry, self.quality_matcher)
+            self._note_quality(record.quality)
+            special, key = self._get_entry_key(record)
+            if special and self.last_special is None:
+                special_keys.append(key)
+                read.append((published_time, guid, False))
+                continue
+            new = self._is_new(special, key)
+            if new:
+                new_entries.append(record)
+            read.append((published_time, guid, new))
+        if special_keys:
+            self.last_special = max(special_keys)
+        self.published_times = published_times
+        timings.stop(start, 'entries', show=self.exact_name)
+        self._update_watermark(read)
+        if not config['keep-feed']:
+            self.rss = None
+        return new_entries
+    
+    def _get_entry_key(self, entry):
+        """Returns a (special, key) tuple of the key of the episode, or the
+        special if special is True, that get_episodes() adds a FeedEntry 
+        to."""
+        if self.show_type == 'seasonepisode':
+            if entry.season is not None and entry.episode is not None:
+                return (False, (entry.season, entry.episode))
+        elif self.show_type == 'date':
+            if entry.date:
+                return (False, entry.date)
+        elif self.show_type == 'title':
+            if entry.show_title:
+                return (False, entry.published_time)
+        elif self.show_type == 'time':
+            return (False, entry.published_time)
+        return (True, entry.published_time.date())
+    
+    def _is_new(self, special, key):
+        """Returns whether an episode or special with key is newer than 
+        last_key or last_special."""
+        if special:
+            return self.last_special is not None and key > self.last_special
+        return key > self.last_key
+    
+    def _update_watermark(self, read):
+        """Sets feed_watermark and feed_seen from read, a list of 
+        (published_time, guid, new) tuples of the entries read from the 
+        feed. The watermark is the publishing time of the oldest new entry,
+        or the newest entry if none are new, so every entry before it is 
+        old."""
+        if not read:
+            return
+        new_times = [published_time for published_time, guid, new in read 
+                     if new]
+        if new_times:
+            watermark = min(new_times)
+        else:
+            watermark = max([published_time 
+                             for published_time, guid, new in read])
+        self.feed_watermark = watermark
+        self.feed_seen = set([hash_guid(guid) 
+                              for published_time, guid, new in read
+                              if guid and not new 
+                              and published_time >= watermark])
+    
+    def _add_episodes(self, entries):
+        """Adds episodes and specials for a list of FeedEntry objects.
+        Returns a (keys, special_keys) tuple of lists of the keys they were
+        added to."""
         keys = []
         special_keys = []
-        for episode in self.rss['entries']:
+        for entry in entries:
+            self._note_quality(entry.quality)
             if self.show_type == 'seasonepisode':
-                r = re.compile('Season\s*: ([0-9]*?);')
-                se_match = r.search(episode.description)
-                r = re.compile('Episode\s*:\ ([0-9]*?)$')
-                ep_match = r.search(episode.description)
-                if se_match and ep_match:
-                    se = (int(se_match.group(1)), int(ep_match.group(1)))
+                if entry.season is not None and entry.episode is not None:
+                    se = (entry.season, entry.episode)
                     if se not in self.episodes:
                         self.episodes[se] = \
                             EpisodeWithSeasonAndEpisode(self, se)
                     self.episodes[se].add_torrent(
-                        url = episode.link,
-                        quality = self._get_quality(episode.title),
-                        published_time = 
-                            datetime.datetime(*episode.updated_parsed[:6]))
+                        url = entry.url,
+                        quality = entry.quality,
+                        published_time = entry.published_time)
                     keys.append(se)
                 else:
-                    special_keys.append(self._add_special(episode))
+                    special_keys.append(self._add_special(entry))
             elif self.show_type == 'date':
-                r = re.compile('Episode\s*Date:\s*([0-9\-]+)$')
-                date_match = r.search(episode.description)
-                if date_match:
-                    try:
-                        date = datetime.datetime(*(time.strptime(
-                            date_match.group(1), "%Y-%m-%d")[0:6])).date()
-                    except ValueError:
-                        special_keys.append(self._add_special(episode))
-                    else:
-                        if date not in self.episodes:
-                            self.episodes[date] = EpisodeWithDate(self, date)
-                        self.episodes[date].add_torrent(
-                            url = episode.link,
-                            quality = self._get_quality(episode.title),
-                            published_time = 
-                               datetime.datetime(*episode.updated_parsed[:6]))
-                        keys.append(date)
+                if entry.date:
+                    if entry.date not in self.episodes:
+                        self.episodes[entry.date] = \
+                            EpisodeWithDate(self, entry.date)
+                    self.episodes[entry.date].add_torrent(
+                        url = entry.url,
+                        quality = entry.quality,
+                        published_time = entry.published_time)
+                    keys.append(entry.date)
                 else:
-                    special_keys.append(self._add_special(episode))
+                    special_keys.append(self._add_special(entry))
             elif self.show_type == "title":
-                r = re.compile('Show\s*Title\s*:\s*(.*?);')
-                title_match = r.search(episode.description)
-                if title_match and "n/a" not in title_match.group(1).lower():
-                    title = title_match.group(1)
+                if entry.show_title:
+                    title = entry.show_title
                     # This is our key for a title type funnily enough.
                     # We can't use the title as the key because they can't
                     # be compared.
-                    published_time \
-                            = datetime.datetime(* episode.updated_parsed[:6])
-                    # BUT! the title needs to be unique too
-                    titles = [ep.title for ep in self.episodes.values()]
+                    published_time = entry.published_time
+                    # BUT! the title needs to be unique too, ignoring case
+                    # and whitespace
+                    normalized_title = normalize_title(title)
                     # Thusforth: the wacky title type
                     if published_time not in self.episodes \
-                            and title not in titles:
+                            and normalized_title not in self._titles:
                         self.episodes[published_time] = EpisodeWithTitle(
                             show = self,
                             title = title,
-                            torrent_url = episode.link,
-                            quality = self._get_quality(episode.title), 
+                            torrent_url = entry.url,
+                            quality = entry.quality, 
                             published_time = published_time)
+                        self._titles[normalized_title] = published_time
                     keys.append(published_time)
                 else:
-                    special_keys.append(self._add_special(episode))
+                    special_keys.append(self._add_special(entry))
             elif self.show_type == "time":
-                published_time \
-                        = datetime.datetime(* episode.updated_parsed[:6])
+                published_time = entry.published_time
                 # Just forget it if two torrents have exactly the same time
                 if published_time not in self.episodes:
                     self.episodes[published_time] = Episode(
                         show = self,
-                        torrent_url = episode.link,
-                        quality = self._get_quality(episode.title), 
+                        torrent_url = entry.url,
+                        quality = entry.quality, 
                         published_time = published_time)
                     keys.append(published_time)
                 # No specials for time
             else:
                 # We really shouldn't get here
                 raise ShowError, "Unrecognised show_type"
-        if keys and not self.last_key:
-            self.last_key = max(keys)
-        if special_keys and not self.last_special:
-            self.last_special = max(special_keys)
-        return (self.episodes, self.specials)
+        return (keys, special_keys)
         
     def get_details(self):
         """If details are missing, fetches the human_name and show_type
         from the RSS feed. Returns dictionary with keys human_name and 
         show_type."""
-        if not self.rss:
-            self._get_rss_feed()
+        entries = self.get_entries()
         logging.debug("Getting details for %s..." % self)
-        if not self.rss['entries']:
+        if not entries:
             raise ShowFeedNoEpisodesError
         # Determine human title. We are assuming here that the first episode
         # in the feed has a useful description. This may cause problems
-        r = re.compile('Show Name\s*: (.*?);')
-        name_match = r.search(self.rss['entries'][0].description)
-        if not name_match:
+        human_name = entries[0].show_name
+        if not human_name:
             raise ShowDetailsError, "Could not determine show name for %s." \
                                         % self
-        human_name = name_match.group(1)
         # Determine show type
-        title_re = re.compile('Show\s*Title\s*:\s*(.*?);')
-        season_re = re.compile('Season\s*:\s*([0-9]*?);')
-        episode_re = re.compile('Episode\s*:\s*([0-9]*?)$')
-        date_re = re.compile('Episode\s*Date:\s*([0-9\-]+)$')
         d = {
             'seasonepisode': 0,
             'date': 0,
             'title': 0
         }
-        for episode in self.rss['entries']:
-            title_match = title_re.search(episode.description)
-            season_match = season_re.search(episode.description)
-            episode_match = episode_re.search(episode.description)
-            date_match = date_re.search(episode.description)
-            if season_match and episode_match:
+        for entry in entries:
+            if entry.season is not None and entry.episode is not None:
                 d['seasonepisode'] += 1
-            elif date_match:
+            elif entry.date:
                 d['date'] += 1
-            elif title_match and title_match.group(1) != 'n/a':
+            elif entry.show_title:
                 d['title'] += 1
         # Nothing could be found, fall back to "time" type
         if d.values() == [0, 0, 0]:
@@ -773,26 +1786,40 @@ class Show(object):
         self.show_type = show_type
         return {'show_type': show_type, 'human_name': human_name}
     
-    def _get_quality(self, s):
-        """Given title string, returns quality integer."""
-        for key, value in config["quality_matches"].items():
-            if key in s:
-                if value > self.best_quality:
-                    self.best_quality = value
-                return value
-        return 0
-    
-    def _add_special(self, episode):
-        """Adds a special episode from feed entry. Returns date of special."""
-        # We allow one special per day to avoid duplicates.
-        date = datetime.datetime(*episode.updated_parsed[:6]).date()
+    def get_entries(self):
+        """Returns the entries of the RSS feed as a list of FeedEntry 
+        objects, downloading the feed if necessary. The entries are parsed
+        once and kept in the entries property. The feed is then dropped 
+        from the rss property unless keep-feed is set in the config."""
+        if self.entries is None:
+            if not self.rss:
+                self._get_rss_feed()
+            start = timings.start()
+            self.entries = [parse_entry(entry, self.quality_matcher) 
+                            for entry in self.rss['entries']]
+            self.published_times = [entry.published_time 
+                                    for entry in self.entries]
+            timings.stop(start, 'entries', show=self.exact_name)
+            if not config['keep-feed']:
+                self.rss = None
+        return self.entries
+    
+    def _note_quality(self, quality):
+        """Keeps track of the best quality available in best_quality."""
+        if quality > self.best_quality:
+            self.best_quality = quality
+    
+    def _add_special(self, entry):
+        """Adds a special episode from a FeedEntry. Returns date of 
+        special."""
+        # We allow one special per day to avoid duplicates.
+        date = entry.published_time.date()
         if date not in self.specials:
             self.specials[date] = SpecialEpisode(self, date)
         self.specials[date].add_torrent(
-            url = episode.link,
-            quality = self._get_quality(episode.title),
-            published_time = 
-                datetime.datetime(*episode.updated_parsed[:6]))
+            url = entry.url,
+            quality = entry.quality,
+            published_time = entry.published_time)
         return date
     
     def _get_rss_feed(self, url=None):
@@ -801,63 +1828,88 @@ class Show(object):
         Arguments:
         url - Feed URL to download. Default: "feed" in config.
         """
+        url, headers = self._get_feed_request(url)
+        start = timings.start()
+        try:
+            try:
+                f = connection_pool.urlopen(url, headers)
+                data = f.read()
+            except urllib2.URLError, e:
+                raise self._get_feed_error(url, e)
+        finally:
+            timings.stop(start, 'feed', show=self.exact_name)
+        return self._read_rss_feed(url, data, f.headers)
+    
+    def _get_rss_feed_async(self, engine, callback, url=None):
+        """Like _get_rss_feed(), but downloads the feed with engine, an 
+        asynchttp.Engine. callback is called with the outcome, like the 
+        outcomes of pool.run()."""
+        url, headers = self._get_feed_request(url)
+        start = timings.start()
+        def fetched(response, error):
+            timings.stop(start, 'feed', show=self.exact_name)
+            if error is not None:
+                try:
+                    raise self._get_feed_error(url, error)
+                except ShowFeedError:
+                    callback((False, sys.exc_info()))
+                return
+            callback(pool.call(self._read_rss_feed, url, response.body, 
+                               response.headers))
+        engine.fetch(url, fetched, headers)
+    
+    def _get_feed_request(self, url=None):
+        """Returns a (url, headers) tuple of the feed URL, "feed" in config
+        unless url is given, and the headers to request it with."""
         if not url:
             url = config['feed'] % self.exact_name
         logging.debug("Downloading and processing %s..." % url)
-        last_modified = None
+        headers = {}
+        if self.feed_etag:
+            headers['If-None-Match'] = self.feed_etag
         if self.feed_last_modified:
-            last_modified = self.feed_last_modified.timetuple()
-        r = feedparser.parse(
-            url,
-            etag = self.feed_etag,
-            modified = last_modified,)
-            #agent = USER_AGENT,) # FIXME: only one entry is downloaded with 
-                                  # this for some reason
-        http_status = r.get('status', 200)
-        http_headers = r.get('headers', {
-          'content-type': 'application/rss+xml', 
-          'content-length':'1'})
-        exc_type = r.get("bozo_exception", Exception()).__class__
+            headers['If-Modified-Since'] = email.Utils.formatdate(
+                calendar.timegm(self.feed_last_modified.timetuple()), 
+                usegmt=True)
+        return (url, headers)
+    
+    def _get_feed_error(self, url, e):
+        """Returns the ShowFeedError to raise for e, a urllib2.URLError 
+        downloading the feed at url."""
+        if isinstance(e, urllib2.HTTPError):
+            if e.code == 304:
+                return ShowFeedNotModifiedError()
+            return ShowFeedError("HTTP error %s: %s" % (e.code, url))
+        reason = e.reason
+        if hasattr(socket, 'timeout') and isinstance(reason, socket.timeout):
+            return ShowFeedError("Connection timed out: %s" % url)
+        elif reason.__class__ in socket_errors and len(reason.args) > 1:
+            reason = reason.args[1]
+        return ShowFeedError("%s: %s" % (reason, url))
+    
+    def _read_rss_feed(self, url, data, headers):
+        """Parses a downloaded feed and stores it in the rss property, along
+        with the ETag and Last-Modified response headers to request it with
+        next time."""
+        if not data:
+            raise ShowFeedError, "Empty page: %s" % url
+        start = timings.start()
+        r = parse_feed(data)
+        timings.stop(start, 'feed_parse', show=self.exact_name)
         if not r.entries and not r.get('version', ''):
-            msg = None
-            if http_status not in [200, 302]: 
-                raise ShowFeedError, "HTTP error %s: %s" % (http_status, url)
-            elif http_status == 304:
-                raise ShowFeedNotModifiedError
-            elif 'html' in http_headers.get('content-type', 'rss'):
+            if 'html' in headers.get('content-type', 'rss'):
                 raise ShowFeedError, "Looks like HTML: %s" % url
-            elif http_headers.get('content-length', '1') == '0':
-                raise ShowFeedError, "Empty page: %s" % url
-            elif hasattr(socket, 'timeout') and exc_type == socket.timeout:
-                raise ShowFeedError, "Connection timed out: %s" % url
-            elif exc_type == IOError:
-                raise ShowFeedError, "%s: %s" % (r.bozo_exception, url)
-            elif hasattr(feedparser, 'zlib') \
-                    and exc_type == feedparser.zlib.error:
-                raise ShowFeedError, "Broken compression: %s" % f.url
-            elif exc_type in socket_errors:
-                raise ShowFeedError, "%s: %s" \
-                                     % (r.bozo_exception.args[1] + f.url)
-            elif exc_type == urllib2.URLError:
-                if r.bozo_exception.reason.__class__ in socket_errors:
-                    exc_reason = r.bozo_exception.reason.args[1]
-                else:
-                    exc_reason = r.bozo_exception.reason
-                raise ShowFeedError, "%s: %s" % (exc_reason, url)
-            elif exc_type == KeyboardInterrupt:
-                raise r.bozo_exception
-            else:
-                raise ShowFeedError, "%s: %s" \
-                    % (r.get("bozo_exception", "can't process"), f.url)
+            raise ShowFeedError, "%s: %s" \
+                % (r.get("bozo_exception", "can't process"), url)
         self.rss = r
-        try:
-            self.feed_etag = r.etag
-        except AttributeError:
-            pass
-        if hasattr(r, "modified"):
-            self.feed_last_modified = datetime.datetime(* r.modified[:6])
-        else:
-            self.feed_last_modified = None
+        self.entries = None
+        if headers.get('etag'):
+            self.feed_etag = headers['etag']
+        self.feed_last_modified = None
+        if headers.get('last-modified'):
+            modified = email.Utils.parsedate(headers['last-modified'])
+            if modified:
+                self.feed_last_modified = datetime.datetime(*modified[:6])
         return r
     
     def __str__(self):
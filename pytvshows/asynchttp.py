@@ -0,0 +1,623 @@
+# encoding: utf-8
+"""
+PyTVShows - Asynchronous HTTP client that keeps many requests in flight on a
+single thread, built on asyncore
+"""
+
+import asyncore
+import mimetools
+import socket
+import StringIO
+import sys
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+import zlib
+
+import pytvshows.connection as connection
+
+class ResponseTooLargeError(urllib2.URLError):
+    """Raised, or rather given to callbacks, when a response is longer than
+    the max_size it was fetched with."""
+    pass
+
+class Response(object):
+    """A complete HTTP response, decompressed if the server gzipped it. It
+    has the same properties as the responses of ConnectionPool.urlopen(),
+    with the body already read.
+
+    Properties:
+    url - URL of the response, after redirects
+    code - HTTP status code
+    msg - HTTP reason phrase
+    headers - Response headers as a mimetools.Message object
+    body - The body of the response
+    """
+    def __init__(self, url, code, msg, headers, body):
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+        self.body = body
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+class _Request(object):
+    def __init__(self, url, headers, callback, max_size):
+        self.url = url
+        self.headers = headers
+        self.callback = callback
+        self.max_size = max_size
+        self.redirects = 0
+        self.key = None
+        self.path = None
+        self.host = None
+        # Key of the host's statistics in the connection pool
+        self.stats_key = None
+
+class Engine(object):
+    """Sends HTTP requests without waiting for their responses, and calls a
+    callback with each response when it has arrived. run() handles the
+    requests until they have all finished, so hundreds of feeds, torrents
+    and scrapes can be downloaded at once on one thread. Connections are kept
+    open to be used again for later requests to the same host.
+
+    Like ConnectionPool, gzip compression is asked for, the User-Agent header
+    is set and redirects are followed. Responses that aren't successful are
+    given to callbacks as urllib2.HTTPError and other errors as
+    urllib2.URLError, so they can be handled like the errors of
+    ConnectionPool.urlopen().
+
+    Host names are looked up once each, and the lookup blocks. URLs that
+    aren't http, or that a proxy is set for in the environment, are opened
+    with pool in a thread instead.
+
+    Not safe to use from several threads.
+
+    Arguments:
+    pool - ConnectionPool for the URLs the engine can't open itself.
+           Requests are counted in its statistics too. Default: a new one
+    max_connections - Maximum number of connections open at once.
+                      Default: 100
+    max_per_host - Maximum number of connections open to each host at once.
+                   Default: 8
+    timeout - Seconds without any progress after which a request fails.
+              Default: 15
+    """
+    max_redirects = 5
+
+    def __init__(self, pool=None, max_connections=100, max_per_host=8,
+                 timeout=15):
+        if pool is None:
+            pool = connection.ConnectionPool()
+        self.pool = pool
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        # asyncore socket map of the open connections
+        self._map = {}
+        # Requests waiting for a connection, oldest first
+        self._queue = []
+        # (host, port) -> number of open connections and idle connections
+        self._open = {}
+        self._idle = {}
+        self._total = 0
+        # (host, port) -> (family, address) of each host looked up
+        self._addresses = {}
+        # Requests that haven't had their callbacks called yet
+        self._pending = 0
+        self._threads = 0
+        # (callback, response, error) tuples of finished requests. Threads
+        # add to it, so it is guarded by the lock
+        self._finished = []
+        self._lock = threading.Lock()
+        self._dispatching = False
+        self._dispatch_again = False
+
+    def fetch(self, url, callback, headers=None, max_size=None):
+        """Starts a GET request for url. callback is called from run() with
+        a (response, error) tuple when it has finished: a Response and None
+        if it succeeded, or None and a urllib2.URLError if it didn't.
+
+        Arguments:
+        url - URL to fetch
+        callback - Callable taking a Response and an error
+        headers - Dictionary of extra request headers. Default: None
+        max_size - The request fails with ResponseTooLargeError if the body
+                   is longer than this. Default: unlimited
+        """
+        request = _Request(url, headers, callback, max_size)
+        self._pending += 1
+        self._submit(request)
+
+    def run(self):
+        """Handles requests until every one has finished, including ones
+        started by callbacks. Exceptions raised by callbacks are passed
+        on."""
+        while self._pending:
+            self._run_callbacks()
+            if not self._pending:
+                break
+            if self._map:
+                if self._threads:
+                    # Threads can't wake select up, so check on them often
+                    timeout = 0.05
+                else:
+                    timeout = 1.0
+                asyncore.loop(timeout, False, self._map, 1)
+            else:
+                time.sleep(0.05)
+            self._check_timeouts()
+
+    def close(self):
+        """Closes every connection. Requests that haven't finished fail."""
+        requests = self._queue
+        self._queue = []
+        for dispatcher in self._map.values():
+            if dispatcher.request is not None:
+                requests.append(dispatcher.request)
+                dispatcher.request = None
+            dispatcher.close()
+        for request in requests:
+            self._finish(request, None, urllib2.URLError("Engine closed"))
+
+    def _submit(self, request):
+        scheme, netloc, path, query = urlparse.urlsplit(request.url)[:4]
+        if scheme != 'http' or scheme in urllib.getproxies():
+            self._start_thread(request)
+            return
+        host, port = urllib.splitport(urllib.splituser(netloc)[1])
+        try:
+            port = int(port or 80)
+        except ValueError:
+            self._finish(request, None,
+                         urllib2.URLError("Invalid port: %s" % netloc))
+            return
+        request.key = (host.lower(), port)
+        request.host = netloc
+        request.stats_key = (scheme, netloc.lower())
+        request.path = path or '/'
+        if query:
+            request.path += '?' + query
+        self._queue.append(request)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Starts queued requests that there are connections for. Closing a
+        connection dispatches again, so calls made while dispatching are
+        turned into another pass."""
+        if self._dispatching:
+            self._dispatch_again = True
+            return
+        self._dispatching = True
+        try:
+            again = True
+            while again:
+                self._dispatch_again = False
+                queue = self._queue
+                self._queue = []
+                waiting = []
+                for request in queue:
+                    if not self._start(request):
+                        waiting.append(request)
+                self._queue = waiting + self._queue
+                again = self._dispatch_again
+        finally:
+            self._dispatching = False
+
+    def _start(self, request):
+        """Sends request on an idle connection or a new one. Returns False
+        if it has to wait for a connection."""
+        key = request.key
+        if self._idle.get(key):
+            self._idle[key].pop().send_request(request, True)
+            return True
+        if self._open.get(key, 0) >= self.max_per_host:
+            return False
+        if self._total >= self.max_connections and not self._close_idle():
+            return False
+        try:
+            if key not in self._addresses:
+                family, socktype, proto, name, address = socket.getaddrinfo(
+                    key[0], key[1], 0, socket.SOCK_STREAM)[0]
+                self._addresses[key] = (family, address)
+            family, address = self._addresses[key]
+            dispatcher = _Connection(self, key, family)
+        except socket.error, e:
+            self.pool._count(request.stats_key, False, 0.0, True)
+            self._finish(request, None, urllib2.URLError(e))
+            return True
+        self._open[key] = self._open.get(key, 0) + 1
+        self._total += 1
+        try:
+            dispatcher.connect(address)
+        except socket.error, e:
+            dispatcher.close()
+            self.pool._count(request.stats_key, False, 0.0, True)
+            self._finish(request, None, urllib2.URLError(e))
+            return True
+        dispatcher.send_request(request, False)
+        return True
+
+    def _close_idle(self):
+        """Closes an idle connection to make room for another. Returns False
+        if there aren't any."""
+        for connections in self._idle.values():
+            if connections:
+                connections[-1].close()
+                return True
+        return False
+
+    def _closed(self, dispatcher):
+        """Forgets a connection that has been closed."""
+        key = dispatcher.key
+        self._open[key] -= 1
+        self._total -= 1
+        idle = self._idle.get(key, [])
+        for i in range(len(idle)):
+            if idle[i] is dispatcher:
+                del idle[i]
+                break
+        self._dispatch()
+
+    def _release(self, dispatcher):
+        """Keeps a connection that has finished a request for the next
+        one."""
+        self._idle.setdefault(dispatcher.key, []).append(dispatcher)
+        self._dispatch()
+
+    def _retry(self, request):
+        """Sends a request again after an idle connection turned out to be
+        closed."""
+        self._queue.insert(0, request)
+        self._dispatch()
+
+    def _response(self, request, code, msg, headers, body):
+        """Finishes a request with the response the server sent."""
+        if headers.get('content-encoding', '').lower() in ('gzip', 'x-gzip'):
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                body = decompressor.decompress(body) + decompressor.flush()
+            except zlib.error, e:
+                self._finish(request, None,
+                             urllib2.URLError("Broken compression: %s" % e))
+                return
+            if request.max_size is not None and len(body) > request.max_size:
+                self._finish(request, None, ResponseTooLargeError(
+                    "Response is larger than %s bytes" % request.max_size))
+                return
+        location = headers.get('location')
+        if code in (301, 302, 303, 307) and location:
+            if request.redirects >= self.max_redirects:
+                self._finish(request, None, urllib2.HTTPError(request.url,
+                    code, "Too many redirects", headers, None))
+                return
+            request.redirects += 1
+            request.url = urlparse.urljoin(request.url, location)
+            self._submit(request)
+            return
+        if not 200 <= code < 300:
+            self._finish(request, None, urllib2.HTTPError(request.url, code,
+                msg, headers, None))
+            return
+        self._finish(request,
+                     Response(request.url, code, msg, headers, body), None)
+
+    def _finish(self, request, response, error):
+        self._lock.acquire()
+        try:
+            self._finished.append((request.callback, response, error))
+        finally:
+            self._lock.release()
+
+    def _run_callbacks(self):
+        while True:
+            self._lock.acquire()
+            try:
+                finished = self._finished
+                self._finished = []
+            finally:
+                self._lock.release()
+            if not finished:
+                return
+            for callback, response, error in finished:
+                self._pending -= 1
+                callback(response, error)
+
+    def _check_timeouts(self):
+        now = time.time()
+        for dispatcher in self._map.values():
+            if dispatcher.request is not None and dispatcher.deadline < now:
+                # The server may have the request, so it isn't sent again
+                dispatcher.fail(urllib2.URLError(
+                    socket.timeout("timed out")), False)
+
+    def _start_thread(self, request):
+        """Fetches a URL the engine can't open itself with the connection
+        pool, in a thread."""
+        def fetch():
+            response = None
+            error = None
+            try:
+                try:
+                    f = self.pool.urlopen(request.url, request.headers)
+                    try:
+                        body = f.read(request.max_size)
+                        if request.max_size is not None and f.read(1):
+                            raise ResponseTooLargeError(
+                                "Response is larger than %s bytes"
+                                % request.max_size)
+                    finally:
+                        f.close()
+                    response = Response(f.geturl(), f.code, f.msg,
+                                        f.headers, body)
+                except urllib2.URLError, e:
+                    error = e
+                except (IOError, socket.error), e:
+                    error = urllib2.URLError(e)
+            finally:
+                self._lock.acquire()
+                try:
+                    self._threads -= 1
+                    self._finished.append((request.callback, response,
+                                           error))
+                finally:
+                    self._lock.release()
+        self._lock.acquire()
+        try:
+            self._threads += 1
+        finally:
+            self._lock.release()
+        thread = threading.Thread(target=fetch)
+        thread.setDaemon(True)
+        thread.start()
+
+class _Connection(asyncore.dispatcher):
+    """A connection to a host, sending one request at a time and reading
+    its response as it arrives."""
+    # Longest status line and headers accepted
+    max_header_size = 65536
+
+    def __init__(self, engine, key, family):
+        asyncore.dispatcher.__init__(self, map=engine._map)
+        self.engine = engine
+        self.key = key
+        self.request = None
+        self.deadline = None
+        self._reused = False
+        self._closed = False
+        self.create_socket(family, socket.SOCK_STREAM)
+        try:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error:
+            pass
+
+    def send_request(self, request, reused):
+        """Sends a request on this connection, reused if it has been used
+        before."""
+        self.request = request
+        self._reused = reused
+        self._started = time.time()
+        self.deadline = self._started + self.engine.timeout
+        self._response_time = None
+        self._received = 0
+        self._in = ''
+        self._state = 'headers'
+        self._length = None
+        self._body = []
+        self._size = 0
+        self._will_close = False
+        headers = {'Accept-Encoding': 'gzip'}
+        if self.engine.pool.user_agent:
+            headers['User-Agent'] = self.engine.pool.user_agent
+        if request.headers:
+            headers.update(request.headers)
+        lines = ["GET %s HTTP/1.1" % request.path, "Host: %s" % request.host]
+        for name, value in headers.items():
+            lines.append("%s: %s" % (name, value))
+        self._out = "\r\n".join(lines) + "\r\n\r\n"
+
+    def fail(self, error, retry=True):
+        """Closes the connection, failing its request with error. A request
+        on a reused connection that the server had closed is sent again,
+        unless retry is False."""
+        request = self.request
+        self.request = None
+        self.close()
+        if request is None:
+            return
+        if retry and self._reused and not self._received:
+            self.engine._retry(request)
+            return
+        self.engine.pool._count(request.stats_key, self._reused,
+                                time.time() - self._started, True)
+        self.engine._finish(request, None, error)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        asyncore.dispatcher.close(self)
+        self.engine._closed(self)
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return not self.connected or bool(self._out)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+        self.deadline = time.time() + self.engine.timeout
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        if self.request is None:
+            # Nothing should arrive on an idle connection
+            self.close()
+            return
+        self.deadline = time.time() + self.engine.timeout
+        self._received += len(data)
+        self._in += data
+        self._parse()
+
+    def handle_close(self):
+        if self.request is not None and self._state == 'body' \
+                and self._length is None:
+            # The body ends when the connection is closed
+            self._will_close = True
+            self._done()
+        else:
+            self.fail(urllib2.URLError(
+                socket.error("Connection closed by server")))
+
+    def handle_expt(self):
+        self.fail(urllib2.URLError(socket.error("Connection failed")))
+
+    def handle_error(self):
+        error = sys.exc_info()[1]
+        if not isinstance(error, socket.error):
+            self.close()
+            raise
+        self.fail(urllib2.URLError(error))
+
+    def _parse(self):
+        """Parses as much of the response received so far as possible."""
+        while self.request is not None:
+            if self._state == 'headers':
+                end = self._in.find("\r\n\r\n")
+                if end == -1:
+                    if len(self._in) > self.max_header_size:
+                        self.fail(urllib2.URLError("Headers are too long"))
+                    return
+                head = self._in[:end]
+                self._in = self._in[end + 4:]
+                self._parse_headers(head)
+            elif self._state == 'body':
+                if self._length is None:
+                    data = self._in
+                else:
+                    data = self._in[:self._length]
+                    self._length -= len(data)
+                self._in = self._in[len(data):]
+                self._add_body(data)
+                if self._length != 0:
+                    return
+                self._done()
+            elif self._state == 'chunk-size':
+                end = self._in.find("\r\n")
+                if end == -1:
+                    if len(self._in) > 1024:
+                        self.fail(urllib2.URLError("Invalid chunk size"))
+                    return
+                line = self._in[:end].split(';')[0].strip()
+                self._in = self._in[end + 2:]
+                try:
+                    self._length = int(line, 16)
+                except ValueError:
+                    self.fail(urllib2.URLError("Invalid chunk size"))
+                    return
+                if self._length:
+                    self._state = 'chunk'
+                else:
+                    self._state = 'trailer'
+            elif self._state == 'chunk':
+                data = self._in[:self._length]
+                self._in = self._in[len(data):]
+                self._length -= len(data)
+                self._add_body(data)
+                if self._length:
+                    return
+                self._state = 'chunk-end'
+            elif self._state == 'chunk-end':
+                if len(self._in) < 2:
+                    return
+                self._in = self._in[2:]
+                self._state = 'chunk-size'
+            elif self._state == 'trailer':
+                end = self._in.find("\r\n")
+                if end == -1:
+                    return
+                line = self._in[:end]
+                self._in = self._in[end + 2:]
+                if not line:
+                    self._done()
+
+    def _parse_headers(self, head):
+        lines = head.split("\r\n")
+        status = lines[0].split(None, 2)
+        try:
+            version, code = status[0], int(status[1])
+            if not version.startswith('HTTP/'):
+                raise ValueError
+        except (IndexError, ValueError):
+            self.fail(urllib2.URLError("Bad status line: %r" % lines[0]))
+            return
+        if 100 <= code < 200:
+            # Informational, the real response follows
+            return
+        self._response_time = time.time() - self._started
+        self._code = code
+        self._msg = ''
+        if len(status) > 2:
+            self._msg = status[2]
+        self._headers = mimetools.Message(StringIO.StringIO(
+            "\r\n".join(lines[1:]) + "\r\n\r\n"))
+        tokens = self._headers.get('connection', '').lower()
+        self._will_close = 'close' in tokens \
+            or (version == 'HTTP/1.0' and 'keep-alive' not in tokens)
+        self._state = 'body'
+        if code in (204, 304):
+            self._length = 0
+        elif 'chunked' in self._headers.get('transfer-encoding', '').lower():
+            self._state = 'chunk-size'
+        else:
+            try:
+                self._length = int(self._headers['content-length'])
+            except (KeyError, ValueError):
+                self._length = None
+                self._will_close = True
+        if self._state == 'body' and self._length == 0:
+            self._done()
+
+    def _add_body(self, data):
+        if not data:
+            return
+        self._body.append(data)
+        self._size += len(data)
+        if self.request.max_size is not None \
+                and self._size > self.request.max_size:
+            self.fail(ResponseTooLargeError("Response is larger than %s "
+                                            "bytes" % self.request.max_size))
+
+    def _done(self):
+        """Finishes the request once its response has been read."""
+        request = self.request
+        if request is None:
+            return
+        self.request = None
+        self.deadline = None
+        pool = self.engine.pool
+        pool._count(request.stats_key, self._reused,
+                    self._response_time or 0.0)
+        pool._count_bytes(request.stats_key, self._size)
+        # Releasing the connection can start another request on it
+        response = (request, self._code, self._msg, self._headers,
+                    ''.join(self._body))
+        if self._will_close:
+            self.close()
+        else:
+            self.engine._release(self)
+        self.engine._response(*response)
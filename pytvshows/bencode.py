@@ -26,9 +26,10 @@ def decode_int(x, f):
 
 def decode_string(x, f):
     colon = x.index(':', f)
-    n = int(x[f:colon])
-    if x[f] == '0' and colon != f+1:
+    # int() would also take signs and whitespace
+    if not x[f:colon].isdigit() or (x[f] == '0' and colon != f+1):
         raise ValueError
+    n = int(x[f:colon])
     colon += 1
     return (x[colon:colon+n], colon+n)
 
@@ -66,11 +67,281 @@ def bdecode(x):
         r, l = decode_func[x[0]](x, 0)
     except (IndexError, KeyError, ValueError):
         raise BTFailure("not a valid bencoded string")
+    except RuntimeError:
+        # Nested deeper than the recursion limit
+        raise BTFailure("not a valid bencoded string (nested too deep)")
     if l != len(x):
         raise BTFailure("invalid bencoded value (data after valid prefix)")
     return r
 
+# Strings at least this long are returned as buffer objects by bdecode_views
+VIEW_THRESHOLD = 1024
+
+def bdecode_views(x, threshold=VIEW_THRESHOLD, spans=None):
+    """Same as bdecode, but strings of threshold bytes or more are returned 
+    as buffer objects pointing into x instead of copies, and dictionary keys
+    are always copied. x can be a string or anything else with the same
+    find(), indexing and slicing methods that supports the buffer interface,
+    such as an mmap.mmap object.
+    
+    If spans is a dictionary and x is a bencoded dictionary, the (start, 
+    end) offsets in x of each of its values are stored in spans under the
+    value's key. For example, x[slice(*spans['info'])] is the info 
+    dictionary of a torrent exactly as it was encoded."""
+    length = len(x)
+    if hasattr(x, 'index'):
+        index = x.index
+    else:
+        def index(sub, start):
+            i = x.find(sub, start)
+            if i == -1:
+                raise ValueError
+            return i
+    def decode_int(f):
+        f += 1
+        newf = index('e', f)
+        n = int(x[f:newf])
+        if x[f] == '-':
+            if x[f + 1] == '0':
+                raise ValueError
+        elif x[f] == '0' and newf != f+1:
+            raise ValueError
+        return (n, newf+1)
+    def decode_string(f):
+        colon = index(':', f)
+        if not x[f:colon].isdigit() or (x[f] == '0' and colon != f+1):
+            raise ValueError
+        n = int(x[f:colon])
+        colon += 1
+        end = colon+n
+        if end > length:
+            raise ValueError
+        if n >= threshold:
+            return (buffer(x, colon, n), end)
+        return (x[colon:end], end)
+    def decode_list(f):
+        r, f = [], f+1
+        while x[f] != 'e':
+            v, f = func[x[f]](f)
+            r.append(v)
+        return (r, f + 1)
+    def decode_dict(f):
+        top = f == 0 and spans is not None
+        r, f = {}, f+1
+        while x[f] != 'e':
+            # Keys are always copied
+            colon = index(':', f)
+            if not x[f:colon].isdigit() or (x[f] == '0' and colon != f+1):
+                raise ValueError
+            n = int(x[f:colon])
+            colon += 1
+            f = colon+n
+            if f > length:
+                raise ValueError
+            k = x[colon:f]
+            start = f
+            r[k], f = func[x[f]](f)
+            if top:
+                spans[k] = (start, f)
+        return (r, f + 1)
+    func = {}
+    func['l'] = decode_list
+    func['d'] = decode_dict
+    func['i'] = decode_int
+    for c in '0123456789':
+        func[c] = decode_string
+    try:
+        r, l = func[x[0]](0)
+    except (IndexError, KeyError, ValueError):
+        raise BTFailure("not a valid bencoded string")
+    except RuntimeError:
+        # Nested deeper than the recursion limit
+        raise BTFailure("not a valid bencoded string (nested too deep)")
+    if l != len(x):
+        raise BTFailure("invalid bencoded value (data after valid prefix)")
+    return r
+
+# States of the containers Decoder is inside
+_LIST, _KEY, _VALUE = 0, 1, 2
+
+class Decoder(object):
+    """Incremental bdecoder. Data is given to it in chunks with feed() as it
+    arrives, and it raises BTFailure as soon as the data can't be valid or
+    goes over a limit, so a broken or hostile server can be dropped early.
+
+    While data arrives it is only checked, without building any values or
+    copying strings, which are skipped over. Once it is complete, close()
+    decodes it in one go with bdecode_views, so results are the same as 
+    bdecode_views and long strings point into the data.
+    
+    Arguments:
+    max_size - Maximum total length of the data. Default: unlimited
+    max_depth - Maximum nesting of lists and dictionaries. Default: 
+                unlimited
+    max_string - Maximum length of a single string. Default: unlimited
+    spans - Dictionary to store the spans of top-level dictionary values in,
+            see bdecode_views. Default: None
+    threshold - Length from which strings are returned as buffer objects,
+                see bdecode_views. Default: VIEW_THRESHOLD
+    """
+    def __init__(self, max_size=None, max_depth=None, max_string=None, 
+                 spans=None, threshold=VIEW_THRESHOLD):
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.spans = spans
+        self.threshold = threshold
+        self.size = 0
+        # Every chunk of data fed
+        self._chunks = []
+        # The start of a value that is split between chunks, and its offset
+        # in the data
+        self._pending = ''
+        self._offset = 0
+        # Bytes of the current string still to come
+        self._skip = 0
+        # _LIST, _KEY or _VALUE for each container being checked, innermost
+        # last
+        self._stack = []
+        self._done = False
+    
+    def feed(self, data):
+        """Checks the next chunk of data. Returns True once a complete 
+        value has been read."""
+        if data:
+            self.size += len(data)
+            if self.max_size is not None and self.size > self.max_size:
+                raise BTFailure("bencoded value is larger than %s bytes" 
+                                % self.max_size)
+            self._chunks.append(data)
+            f = min(self._skip, len(data))
+            self._skip -= f
+            self._offset += f
+            if f < len(data):
+                if self._done:
+                    raise BTFailure("invalid bencoded value (data after "
+                                    "valid prefix)")
+                x = self._pending + data[f:]
+                f = self._parse(x)
+                self._offset += f
+                self._pending = x[f:]
+        return self._done and not self._skip
+    
+    def close(self):
+        """Returns the decoded value, raising BTFailure if it is 
+        incomplete."""
+        if not self._done or self._skip:
+            raise BTFailure("not a valid bencoded string (incomplete)")
+        return bdecode_views(self.get_data(), self.threshold, self.spans)
+    
+    def get_data(self):
+        """Returns the data fed so far as a single string."""
+        if len(self._chunks) != 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0]
+    
+    def _parse(self, x):
+        """Checks as much of x as possible. Returns the offset in x of the
+        first value that isn't complete yet, or len(x) if x ends part of the
+        way through a string."""
+        stack = self._stack
+        f = 0
+        length = len(x)
+        try:
+            while f < length:
+                if self._done:
+                    raise BTFailure("invalid bencoded value (data after "
+                                    "valid prefix)")
+                c = x[f]
+                if stack:
+                    if c == 'e' and stack[-1] != _VALUE:
+                        stack.pop()
+                        f += 1
+                        self._end_value()
+                        continue
+                    if stack[-1] == _KEY and c not in '0123456789':
+                        raise ValueError
+                if c == 'l' or c == 'd':
+                    if self.max_depth is not None \
+                            and len(stack) >= self.max_depth:
+                        raise BTFailure("bencoded value is nested more than "
+                                        "%s deep" % self.max_depth)
+                    if c == 'l':
+                        stack.append(_LIST)
+                    else:
+                        stack.append(_KEY)
+                    f += 1
+                    continue
+                elif c == 'i':
+                    newf = x.find('e', f)
+                    if newf == -1:
+                        # Integers don't get this long
+                        if length - f > 64:
+                            raise ValueError
+                        break
+                    f += 1
+                    int(x[f:newf])
+                    if x[f] == '-':
+                        if x[f + 1] == '0':
+                            raise ValueError
+                    elif x[f] == '0' and newf != f+1:
+                        raise ValueError
+                    f = newf + 1
+                elif c in '0123456789':
+                    colon = x.find(':', f)
+                    if colon == -1:
+                        # Neither do lengths
+                        if length - f > 20:
+                            raise ValueError
+                        break
+                    if not x[f:colon].isdigit() \
+                            or (c == '0' and colon != f+1):
+                        raise ValueError
+                    n = int(x[f:colon])
+                    if self.max_string is not None and n > self.max_string:
+                        raise BTFailure("bencoded string is longer than %s "
+                                        "bytes" % self.max_string)
+                    f = colon + 1 + n
+                    if self.max_size is not None \
+                            and self._offset + f > self.max_size:
+                        raise BTFailure("bencoded value is larger than %s "
+                                        "bytes" % self.max_size)
+                    if f > length:
+                        self._skip = f - length
+                        f = length
+                else:
+                    raise ValueError
+                self._end_value()
+        except (IndexError, ValueError):
+            raise BTFailure("not a valid bencoded string")
+        return f
+    
+    def _end_value(self):
+        """Moves on from a value that has been read, to the next value of
+        its container, or to the end of the data."""
+        stack = self._stack
+        if not stack:
+            self._done = True
+        elif stack[-1] == _KEY:
+            stack[-1] = _VALUE
+        elif stack[-1] == _VALUE:
+            stack[-1] = _KEY
+
+def bdecode_stream(f, chunk_size=16384, **kwargs):
+    """Decodes bencoded data read from the file-like object f in chunks of
+    chunk_size bytes. Other keyword arguments are passed to Decoder, so
+    limits can be set. Returns a (value, data) tuple of the decoded value 
+    and the data read."""
+    decoder = Decoder(**kwargs)
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        decoder.feed(chunk)
+    return (decoder.close(), decoder.get_data())
+
 from types import StringType, IntType, LongType, DictType, ListType, TupleType
+from types import BufferType
 
 
 class Bencached(object):
@@ -95,6 +366,9 @@ def encode_bool(x, r):
 def encode_string(x, r):
     r.extend((str(len(x)), ':', x))
 
+def encode_buffer(x, r):
+    r.extend((str(len(x)), ':', str(x)))
+
 def encode_list(x, r):
     r.append('l')
     for i in x:
@@ -115,6 +389,7 @@ encode_func[Bencached] = encode_bencached
 encode_func[IntType] = encode_int
 encode_func[LongType] = encode_int
 encode_func[StringType] = encode_string
+encode_func[BufferType] = encode_buffer
 encode_func[ListType] = encode_list
 encode_func[TupleType] = encode_list
 encode_func[DictType] = encode_dict
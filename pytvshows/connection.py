@@ -0,0 +1,325 @@
+# encoding: utf-8
+"""
+PyTVShows - Pool of keep-alive HTTP connections shared by feeds, torrents and
+trackers
+"""
+
+import errno
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+import zlib
+
+# Errors sending a request on an idle connection that the server has closed
+_stale_errnos = (errno.ECONNRESET, errno.EPIPE)
+
+def _is_stale(e):
+    """Returns whether e, an error sending a request or reading the status
+    line of its response, means that the connection had been closed by the
+    server before the request got to it, so the request can be sent again.
+    Timeouts and other errors are not, as the server may have the request
+    and resending it would only wait for it all over again."""
+    if isinstance(e, httplib.BadStatusLine):
+        return True
+    return isinstance(e, socket.error) \
+        and not isinstance(e, socket.timeout) \
+        and bool(e.args) and e.args[0] in _stale_errnos
+
+class Response(object):
+    """The body of an HTTP response as a file-like object, decompressed if
+    the server gzipped it. Once the body has been read to the end, its
+    connection goes back to the pool to be used again. It has the same
+    properties as the responses of urllib2.urlopen().
+
+    Properties:
+    url - URL of the response, after redirects
+    code - HTTP status code
+    msg - HTTP reason phrase
+    headers - Response headers as a mimetools.Message object
+    """
+    def __init__(self, pool, key, connection, response, url):
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._buffer = ''
+        self._decompressor = None
+        # Bytes of the body read so far, as sent
+        self._bytes = 0
+        if self.headers.get('content-encoding', '').lower() \
+                in ('gzip', 'x-gzip'):
+            # Accept the gzip header and trailer
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if response.isclosed():
+            self._release()
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def read(self, size=-1):
+        """Reads up to size bytes of the body, or all of it if size is
+        negative. Errors raise urllib2.URLError."""
+        if self._decompressor is None and not self._buffer:
+            return self._read(size)
+        while self._decompressor is not None \
+                and (size < 0 or len(self._buffer) < size):
+            data = self._read(max(size, 16384))
+            if not data:
+                try:
+                    self._buffer += self._decompressor.flush()
+                except zlib.error, e:
+                    raise urllib2.URLError("Broken compression: %s" % e)
+                self._decompressor = None
+                break
+            try:
+                self._buffer += self._decompressor.decompress(data)
+            except zlib.error, e:
+                self.close()
+                raise urllib2.URLError("Broken compression: %s" % e)
+        if size < 0:
+            size = len(self._buffer)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+    def close(self):
+        """Closes the response. Its connection is closed too unless the
+        body was read to the end."""
+        if self._connection is not None:
+            self._pool._count_bytes(self._key, self._bytes)
+            self._connection.close()
+            self._connection = None
+            self._response = None
+
+    def discard(self):
+        """Closes the response, first reading the rest of the body if it is
+        short so the connection can be used again."""
+        if self._response is not None and self._response.length is not None \
+                and self._response.length <= 65536:
+            try:
+                self._read(-1)
+            except urllib2.URLError:
+                pass
+        self.close()
+
+    def _read(self, size):
+        """Reads up to size bytes of the body as it was sent, or all of it
+        if size is negative."""
+        if self._response is None:
+            return ''
+        try:
+            if size < 0:
+                data = self._response.read()
+            else:
+                data = self._response.read(size)
+        except (httplib.HTTPException, socket.error), e:
+            self.close()
+            raise urllib2.URLError(e)
+        self._bytes += len(data)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def _release(self):
+        self._pool._count_bytes(self._key, self._bytes)
+        self._pool._release(self._key, self._connection,
+                            self._response.will_close)
+        self._connection = None
+        self._response = None
+
+class ConnectionPool(object):
+    """Opens HTTP URLs, keeping connections open to be used again for later
+    requests to the same host. Gzip compression is asked for and the
+    User-Agent header is set on every request. Safe to use from several
+    threads.
+
+    Arguments:
+    user_agent - Value of the User-Agent header. Default: None
+    max_idle - Maximum number of idle connections kept for each host.
+               Default: 4
+    """
+    max_redirects = 5
+
+    def __init__(self, user_agent=None, max_idle=4):
+        self.user_agent = user_agent
+        self.max_idle = max_idle
+        # Idle connections for each (scheme, host) key
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._stats = self._new_stats()
+        # Host -> the same statistics for requests to that host
+        self._hosts = {}
+
+    def urlopen(self, url, headers=None):
+        """Sends a GET request for url, following redirects. Returns a
+        Response. Like urllib2.urlopen(), responses that aren't successful
+        raise urllib2.HTTPError and other errors raise urllib2.URLError.
+
+        URLs that aren't http or https, or that a proxy is set for in the
+        environment, are opened with urllib2 instead.
+
+        Arguments:
+        url - URL to open
+        headers - Dictionary of extra request headers. Default: None
+        """
+        request_headers = {'Accept-Encoding': 'gzip'}
+        if self.user_agent:
+            request_headers['User-Agent'] = self.user_agent
+        if headers:
+            request_headers.update(headers)
+        for i in range(self.max_redirects + 1):
+            scheme = urlparse.urlsplit(url)[0]
+            if scheme not in ('http', 'https') \
+                    or scheme in urllib.getproxies():
+                return self._urllib2_open(url, headers)
+            response = self._open(url, request_headers)
+            location = response.headers.get('location')
+            if response.code in (301, 302, 303, 307) and location:
+                response.discard()
+                url = urlparse.urljoin(url, location)
+                continue
+            if not 200 <= response.code < 300:
+                response.discard()
+                raise urllib2.HTTPError(url, response.code, response.msg,
+                                        response.headers, None)
+            return response
+        raise urllib2.HTTPError(url, response.code, "Too many redirects",
+                                response.headers, None)
+
+    def get_stats(self, host=None):
+        """Returns a dictionary of the number of requests sent, connections
+        opened, requests that failed and bytes received, and the total 
+        seconds spent waiting for responses. They are for requests to host 
+        if it is given, otherwise for every request."""
+        self._lock.acquire()
+        try:
+            if host is None:
+                return self._stats.copy()
+            return self._hosts.get(host, self._new_stats()).copy()
+        finally:
+            self._lock.release()
+
+    def get_hosts(self):
+        """Returns the hosts requests have been sent to."""
+        self._lock.acquire()
+        try:
+            return self._hosts.keys()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Closes every idle connection."""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _open(self, url, headers):
+        scheme, netloc, path, query = urlparse.urlsplit(url)[:4]
+        path = path or '/'
+        if query:
+            path += '?' + query
+        key = (scheme, netloc.lower())
+        while True:
+            connection = self._get_idle(key)
+            reused = connection is not None
+            if not reused:
+                if scheme == 'https':
+                    connection = httplib.HTTPSConnection(netloc)
+                else:
+                    connection = httplib.HTTPConnection(netloc)
+            start = time.time()
+            try:
+                connection.request('GET', path, None, headers)
+                response = connection.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                # The server may have closed an idle connection, so try
+                # again with a new one
+                if reused and _is_stale(e):
+                    continue
+                self._count(key, reused, time.time() - start, True)
+                raise urllib2.URLError(e)
+            self._count(key, reused, time.time() - start)
+            return Response(self, key, connection, response, url)
+
+    def _new_stats(self):
+        return {
+            'requests': 0,
+            'connections': 0,
+            'errors': 0,
+            'bytes': 0,
+            'response_time': 0.0,
+        }
+
+    def _count(self, key, reused, response_time, error=False):
+        self._lock.acquire()
+        try:
+            host = self._hosts.setdefault(key[1], self._new_stats())
+            for stats in (self._stats, host):
+                stats['requests'] += 1
+                if not reused:
+                    stats['connections'] += 1
+                if error:
+                    stats['errors'] += 1
+                stats['response_time'] += response_time
+        finally:
+            self._lock.release()
+
+    def _count_bytes(self, key, size):
+        self._lock.acquire()
+        try:
+            self._stats['bytes'] += size
+            self._hosts.setdefault(key[1], self._new_stats())['bytes'] += size
+        finally:
+            self._lock.release()
+
+    def _urllib2_open(self, url, headers):
+        request = urllib2.Request(url)
+        if self.user_agent:
+            request.add_header('User-Agent', self.user_agent)
+        if headers:
+            for name, value in headers.items():
+                request.add_header(name, value)
+        return urllib2.urlopen(request)
+
+    def _get_idle(self, key):
+        """Returns an idle connection for key, or None if there isn't one."""
+        self._lock.acquire()
+        try:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop()
+            return None
+        finally:
+            self._lock.release()
+
+    def _release(self, key, connection, will_close):
+        """Keeps connection for another request to key if it can be used
+        again."""
+        if not will_close:
+            self._lock.acquire()
+            try:
+                connections = self._idle.setdefault(key, [])
+                if len(connections) < self.max_idle:
+                    connections.append(connection)
+                    return
+            finally:
+                self._lock.release()
+        connection.close()
@@ -0,0 +1,123 @@
+# encoding: utf-8
+"""
+PyTVShows - UNIX socket for controlling a running daemon
+"""
+
+import os
+import select
+import socket
+import threading
+
+class ControlError(Exception): pass
+
+class ControlServer(object):
+    """Answers commands sent to a UNIX socket, in a thread of its own.
+
+    A client connects, sends a command as a line of words separated by
+    spaces, and reads the response until the connection is closed. The
+    first line of the response is "ok", or "error: " followed by a message.
+
+    Arguments:
+    path - Path of the socket
+    handler - Callable given the list of words of a command, which returns
+              the rest of the response as a string or raises ControlError
+    """
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        self._socket = None
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        """Creates the socket, replacing any left behind, and starts
+        answering commands. Raises socket.error if it can't be created."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        os.chmod(self.path, 0600)
+        sock.listen(5)
+        self._socket = sock
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def close(self):
+        """Stops answering commands and removes the socket."""
+        if self._socket is None:
+            return
+        self._stop = True
+        self._thread.join()
+        self._socket.close()
+        self._socket = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _serve(self):
+        while not self._stop:
+            # Wake up regularly to see if we should stop
+            if not select.select([self._socket], [], [], 0.5)[0]:
+                continue
+            try:
+                connection = self._socket.accept()[0]
+            except socket.error:
+                continue
+            try:
+                try:
+                    connection.settimeout(5)
+                    connection.sendall(self._respond(_read_line(connection)))
+                except socket.error:
+                    pass
+            finally:
+                connection.close()
+
+    def _respond(self, line):
+        try:
+            words = line.split()
+            if not words:
+                raise ControlError, "No command"
+            return "ok\n" + self.handler(words)
+        except ControlError, e:
+            return "error: %s\n" % e
+        except Exception, e:
+            # Keep answering later commands
+            return "error: Unexpected error: %s\n" % e
+
+def send_command(path, words, timeout=60):
+    """Sends a command to the ControlServer listening at path. Returns the
+    response, without its status line, if it succeeded. Raises ControlError
+    with the message if it failed, and socket.error if the daemon can't be
+    reached."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(' '.join(words) + "\n")
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    response = ''.join(chunks)
+    status, body = (response.split("\n", 1) + [''])[:2]
+    if status != "ok":
+        if status.startswith("error: "):
+            status = status[7:]
+        raise ControlError, status
+    return body
+
+def _read_line(connection, limit=4096):
+    """Reads a line of at most limit bytes from a socket."""
+    data = ''
+    while "\n" not in data and len(data) < limit:
+        chunk = connection.recv(limit - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data.split("\n", 1)[0]
@@ -0,0 +1,99 @@
+# encoding: utf-8
+"""
+PyTVShows - Bounded thread pool for running independent jobs concurrently
+"""
+
+import sys
+import threading
+
+def run(func, items, jobs=1, done=None):
+    """Calls func on every item using at most jobs threads. Returns a list
+    of outcomes in the same order as items.
+
+    An outcome is a (True, return value) tuple if the call succeeded, a
+    (False, exc_info) tuple if it raised an exception, or None if it was
+    never started.
+
+    Arguments:
+    func - Callable taking a single item as its argument
+    items - Sequence of items
+    jobs - Maximum number of threads. Default: 1, which calls func in the
+           calling thread
+    done - Callable given (index, outcome) as each call finishes. Calls are
+           never made concurrently. If it returns True, no more items are
+           started.
+    """
+    items = list(items)
+    outcomes = [None] * len(items)
+    if jobs <= 1 or len(items) <= 1:
+        for i in range(len(items)):
+            outcomes[i] = call(func, items[i])
+            if done and done(i, outcomes[i]):
+                break
+        return outcomes
+    lock = threading.Lock()
+    state = {'next': 0, 'stop': False}
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if state['stop'] or state['next'] >= len(items):
+                    return
+                i = state['next']
+                state['next'] += 1
+            finally:
+                lock.release()
+            outcome = call(func, items[i])
+            lock.acquire()
+            try:
+                outcomes[i] = outcome
+                if done and done(i, outcome):
+                    state['stop'] = True
+            finally:
+                lock.release()
+    threads = []
+    for n in range(min(jobs, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+def run_async(func, items, callback):
+    """The asynchronous counterpart of run(). Calls func on every item at
+    once, then callback with the list of outcomes, in the same order as
+    items, when they have all finished.
+
+    Arguments:
+    func - Callable taking an item and a callable to give its outcome to
+           when it has finished. It can give it straight away
+    items - Sequence of items
+    callback - Callable taking the list of outcomes
+    """
+    items = list(items)
+    outcomes = [None] * len(items)
+    state = {'remaining': len(items)}
+    if not items:
+        callback(outcomes)
+        return
+    def finished(i, outcome):
+        outcomes[i] = outcome
+        state['remaining'] -= 1
+        if not state['remaining']:
+            callback(outcomes)
+    for i in range(len(items)):
+        func(items[i], lambda outcome, i=i: finished(i, outcome))
+
+def reraise(exc_info):
+    """Raises an exception from an exc_info tuple returned by run()."""
+    raise exc_info[0], exc_info[1], exc_info[2]
+
+def call(func, *args):
+    """Calls func with args and returns its outcome, as returned by 
+    run()."""
+    try:
+        return (True, func(*args))
+    except Exception:
+        return (False, sys.exc_info())
@@ -0,0 +1,54 @@
+# encoding: utf-8
+"""
+PyTVShows - Classifies torrents by quality from their titles
+"""
+
+import re
+
+class QualityMatcher(object):
+    """Gives torrent titles a quality using a dictionary of substrings to
+    integer qualities, such as quality_matches in the config.
+
+    All the substrings are found in a single scan of the title with one
+    compiled regular expression. Where several substrings match, the result
+    is always the same:
+
+    - Where substrings start at the same place in the title, the longest
+      one that matches is found, along with any substrings inside it.
+    - The title's quality is the highest quality of the substrings found,
+      or 0 if there are none.
+
+    Arguments:
+    matches - Dictionary of substrings to integer qualities
+    """
+    def __init__(self, matches):
+        self.matches = dict(matches)
+        patterns = [pattern for pattern in self.matches.keys() if pattern]
+        # Longest first, so the longest alternative matching at a position
+        # is the one found
+        patterns.sort(key=lambda pattern: (-len(pattern), pattern))
+        # Quality of each pattern when found, which is the best of the
+        # patterns inside it
+        self._qualities = {}
+        for pattern in patterns:
+            self._qualities[pattern] = max([quality for other, quality
+                                            in self.matches.items()
+                                            if other and other in pattern])
+        if patterns:
+            self._re = re.compile('|'.join([re.escape(pattern)
+                                            for pattern in patterns]))
+        else:
+            self._re = None
+
+    def get_quality(self, title):
+        """Returns the integer quality of a torrent title."""
+        if self._re is None:
+            return 0
+        best = None
+        for match in self._re.findall(title):
+            quality = self._qualities[match]
+            if best is None or quality > best:
+                best = quality
+        if best is None:
+            return 0
+        return best
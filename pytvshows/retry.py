@@ -0,0 +1,181 @@
+# encoding: utf-8
+"""
+PyTVShows - Record of torrents that failed, to retry them with backoff
+"""
+
+import ConfigParser
+import os
+import sys
+import threading
+import time
+
+import pytvshows.logger as logging
+
+class FailedTorrents(object):
+    """Failed downloads of torrent URLs, so torrents that don't work aren't
+    downloaded and checked again on every run. It also limits how often a
+    warning is given about the same thing. It can be saved to and loaded
+    from a file so it is kept between runs. Safe to use from several
+    threads.
+
+    A torrent that fails is retried after retry_delay seconds, doubled for
+    every further failure up to max_retry_delay. After max_attempts failures
+    it isn't retried until it is forgotten, max_age seconds after its last
+    failure.
+
+    Arguments:
+    max_attempts - Failures after which a torrent is given up on. Default: 8
+    """
+    retry_delay = 1800
+    max_retry_delay = 7 * 86400
+    max_age = 30 * 86400
+    # Seconds between warnings about the same thing
+    warn_interval = 86400
+
+    def __init__(self, max_attempts=8):
+        self.max_attempts = max_attempts
+        # URL -> dictionary of attempts, last_failure and error
+        self._torrents = {}
+        # Key -> time of last warning
+        self._warnings = {}
+        self._lock = threading.Lock()
+
+    def record_failure(self, url, error=None):
+        """Records that the torrent at url failed, with error as the
+        reason."""
+        self._lock.acquire()
+        try:
+            record = self._torrents.setdefault(url, self._new_record())
+            record['attempts'] += 1
+            record['last_failure'] = time.time()
+            record['error'] = str(error or '').replace("\n", " ")
+        finally:
+            self._lock.release()
+
+    def record_success(self, url):
+        """Forgets any failures of the torrent at url."""
+        self._lock.acquire()
+        try:
+            if url in self._torrents:
+                del self._torrents[url]
+        finally:
+            self._lock.release()
+
+    def get_retry_time(self, url):
+        """Returns the time the torrent at url can next be tried, None if it
+        can be tried now, or 0 if it has been given up on."""
+        self._lock.acquire()
+        try:
+            if url not in self._torrents:
+                return None
+            record = self._torrents[url]
+        finally:
+            self._lock.release()
+        if record['attempts'] >= self.max_attempts:
+            return 0
+        delay = min(self.retry_delay * 2 ** min(record['attempts'] - 1, 16),
+                    self.max_retry_delay)
+        if time.time() >= record['last_failure'] + delay:
+            return None
+        return record['last_failure'] + delay
+
+    def filter(self, torrents):
+        """Returns the torrents, objects with a url property, that can be
+        tried now."""
+        ready = []
+        for torrent in torrents:
+            retry_time = self.get_retry_time(torrent.url)
+            if retry_time is None:
+                ready.append(torrent)
+            elif retry_time == 0:
+                logging.debug("Skipping %s, it has failed too many times."
+                                % torrent.url)
+            else:
+                logging.debug("Skipping %s until %s, it failed recently."
+                    % (torrent.url, time.strftime("%Y-%m-%d %H:%M",
+                                                  time.localtime(retry_time))))
+        return ready
+
+    def should_warn(self, key):
+        """Returns True, and records the warning, if there hasn't been a
+        warning about key for warn_interval seconds."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if now - self._warnings.get(key, 0) < self.warn_interval:
+                return False
+            self._warnings[key] = now
+            return True
+        finally:
+            self._lock.release()
+
+    def load(self, path):
+        """Loads failures and warnings from path, replacing anything
+        recorded. A missing file is treated as empty."""
+        parser = ConfigParser.RawConfigParser()
+        parser.read(path)
+        torrents = {}
+        warnings = {}
+        for section in parser.sections():
+            try:
+                if section.startswith('warning '):
+                    warnings[section[8:]] = float(parser.get(section,
+                                                             'time'))
+                    continue
+                record = self._new_record()
+                record['attempts'] = int(parser.get(section, 'attempts'))
+                record['last_failure'] = float(parser.get(section,
+                                                          'last_failure'))
+                if parser.has_option(section, 'error'):
+                    record['error'] = parser.get(section, 'error')
+            except (ConfigParser.Error, ValueError):
+                continue
+            torrents[section] = record
+        self._lock.acquire()
+        try:
+            self._torrents = torrents
+            self._warnings = warnings
+        finally:
+            self._lock.release()
+
+    def save(self, path):
+        """Saves failures and warnings to path, forgetting torrents that
+        haven't failed for max_age seconds and warnings that no longer stop
+        another one."""
+        now = time.time()
+        parser = ConfigParser.RawConfigParser()
+        self._lock.acquire()
+        try:
+            for url in sorted(self._torrents.keys()):
+                record = self._torrents[url]
+                if now - record['last_failure'] > self.max_age:
+                    del self._torrents[url]
+                    continue
+                parser.add_section(url)
+                parser.set(url, 'attempts', record['attempts'])
+                parser.set(url, 'last_failure', repr(record['last_failure']))
+                parser.set(url, 'error', record['error'])
+            for key in sorted(self._warnings.keys()):
+                if now - self._warnings[key] > self.warn_interval:
+                    del self._warnings[key]
+                    continue
+                section = 'warning ' + key
+                parser.add_section(section)
+                parser.set(section, 'time', repr(self._warnings[key]))
+        finally:
+            self._lock.release()
+        fp = open(path + '-temp', "w")
+        try:
+            parser.write(fp)
+        finally:
+            fp.close()
+        if sys.platform[:3] == 'win' and os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '-temp', path)
+
+    def _new_record(self):
+        return {
+            'attempts': 0,
+            'last_failure': 0.0,
+            'error': '',
+        }
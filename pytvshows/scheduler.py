@@ -0,0 +1,160 @@
+# encoding: utf-8
+"""
+PyTVShows - Decides when to check each show's feed when running as a daemon
+"""
+
+import threading
+import time
+
+# Torrents published closer together than this are taken to be the same
+# episode, such as different qualities or mirrors
+SAME_EPISODE = 6 * 3600
+
+def get_interval(published_times, now, minimum, maximum, pending=False):
+    """Returns the number of seconds to wait before checking a show again,
+    from the times its torrents were published.
+
+    Shows are checked about four times between episodes, and every minimum
+    seconds once the next episode is due. Shows with no new episodes for
+    much longer than usual have probably ended or are on a break, so they
+    are checked every maximum seconds. Shows with episodes waiting for a
+    better quality or a working torrent are checked every minimum seconds.
+
+    Arguments:
+    published_times - Publishing times of the show's torrents in seconds
+                      since the epoch
+    now - Current time in seconds since the epoch
+    minimum - Minimum interval in seconds
+    maximum - Maximum interval in seconds
+    pending - True if the show has episodes that haven't been downloaded
+              yet. Default: False
+    """
+    if pending:
+        return minimum
+    times = sorted(published_times)
+    gaps = []
+    for i in range(1, len(times)):
+        if times[i] - times[i - 1] >= SAME_EPISODE:
+            gaps.append(times[i] - times[i - 1])
+    if not gaps:
+        return minimum
+    gaps.sort()
+    cadence = gaps[len(gaps) // 2]
+    since = now - times[-1]
+    if since > 4 * cadence and since > 14 * 86400:
+        return maximum
+    # Time until the next episode could appear
+    due = 0.8 * cadence - since
+    if due <= 0:
+        return minimum
+    return max(minimum, min(due, cadence / 4, maximum))
+
+class Scheduler(object):
+    """Keeps track of when each show is next due to be checked. Safe to use
+    from several threads.
+
+    Arguments:
+    minimum - Minimum interval between checks of a show in seconds
+    maximum - Maximum interval between checks of a show in seconds.
+              Default: 86400
+    """
+    def __init__(self, minimum, maximum=86400):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        # Key -> dictionary of last_check, next_check and interval
+        self._shows = {}
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """Adds a show, due to be checked now."""
+        self._lock.acquire()
+        try:
+            self._shows[key] = {
+                'last_check': None,
+                'next_check': time.time(),
+                'interval': None,
+            }
+        finally:
+            self._lock.release()
+
+    def remove(self, key):
+        self._lock.acquire()
+        try:
+            del self._shows[key]
+        finally:
+            self._lock.release()
+
+    def keys(self):
+        self._lock.acquire()
+        try:
+            return self._shows.keys()
+        finally:
+            self._lock.release()
+
+    def get_due(self, now=None):
+        """Returns the keys of the shows due to be checked, longest overdue
+        first."""
+        if now is None:
+            now = time.time()
+        self._lock.acquire()
+        try:
+            due = [(info['next_check'], key)
+                   for key, info in self._shows.items()
+                   if info['next_check'] <= now]
+        finally:
+            self._lock.release()
+        due.sort()
+        return [key for next_check, key in due]
+
+    def get_next_check(self):
+        """Returns the time the next show is due to be checked, or None if
+        there are no shows."""
+        self._lock.acquire()
+        try:
+            if not self._shows:
+                return None
+            return min([info['next_check']
+                        for info in self._shows.values()])
+        finally:
+            self._lock.release()
+
+    def checked(self, key, published_times, pending=False, now=None):
+        """Records that a show was checked and schedules its next check.
+        See get_interval() for the arguments. Returns the interval."""
+        if now is None:
+            now = time.time()
+        interval = get_interval(published_times, now, self.minimum,
+                                self.maximum, pending)
+        self._lock.acquire()
+        try:
+            info = self._shows[key]
+            info['last_check'] = now
+            info['next_check'] = now + interval
+            info['interval'] = interval
+        finally:
+            self._lock.release()
+        return interval
+
+    def refresh(self, key=None):
+        """Makes a show, or every show if key is None, due now."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if key is None:
+                keys = self._shows.keys()
+            else:
+                keys = [key]
+            for key in keys:
+                self._shows[key]['next_check'] = now
+        finally:
+            self._lock.release()
+
+    def get_info(self, key):
+        """Returns a copy of the last_check, next_check and interval of a
+        show. Times are in seconds since the epoch, and last_check and
+        interval are None until it has been checked."""
+        self._lock.acquire()
+        try:
+            return self._shows[key].copy()
+        finally:
+            self._lock.release()
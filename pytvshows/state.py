@@ -0,0 +1,446 @@
+# encoding: utf-8
+"""
+PyTVShows - Stores the state of each show, committing each show as soon as it
+has been checked
+"""
+
+import ConfigParser
+import os
+import sys
+import threading
+try:
+    import sqlite3
+except ImportError:
+    try:
+        from pysqlite2 import dbapi2 as sqlite3
+    except ImportError:
+        sqlite3 = None
+
+class StateError(Exception): pass
+
+def _to_str(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def _clean(values):
+    """Returns a copy of a dictionary of a show's state, with values
+    converted to strings and None values left out."""
+    cleaned = {}
+    for key, value in values.items():
+        if value is not None:
+            cleaned[key] = _to_str(value)
+    return cleaned
+
+def _replace(temp_path, path):
+    if sys.platform[:3] == 'win' and os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+def read_ini(path):
+    """Returns the shows in a state file in the original ConfigParser format
+    as a dictionary of exact_name to dictionaries of state."""
+    parser = ConfigParser.RawConfigParser()
+    try:
+        parser.read(path)
+    except ConfigParser.Error, e:
+        raise StateError, "Can't read %s: %s" % (path, e)
+    shows = {}
+    for exact_name in parser.sections():
+        values = {}
+        for key, value in parser.items(exact_name):
+            if value != 'None':
+                values[key] = value
+        shows[exact_name] = values
+    return shows
+
+def get_backend(path):
+    """Returns the name of the backend the state file at path is stored
+    with, or None if it is empty. Files that are neither a journal nor an
+    SQLite database are taken to be in the original format, 'ini'."""
+    try:
+        fp = open(path, "rb")
+        try:
+            start = fp.read(64)
+        finally:
+            fp.close()
+    except IOError, e:
+        raise StateError, "Can't read %s: %s" % (path, e)
+    if not start:
+        return None
+    for backend in ('journal', 'sqlite'):
+        if start.startswith(backends[backend].header):
+            return backend
+    return 'ini'
+
+class IniStateStore(object):
+    """The original state file, read and written with ConfigParser. The
+    whole file is rewritten on every commit, so it is slow with many shows.
+
+    Arguments:
+    path - Path of the state file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._shows = {}
+        if os.path.exists(path):
+            self._shows = read_ini(path)
+
+    def is_store(cls, path):
+        """Returns True if the file at path is empty or in the original
+        format."""
+        return get_backend(path) in (None, 'ini')
+    is_store = classmethod(is_store)
+
+    def get_all(self):
+        """Returns a dictionary of exact_name to dictionaries of state."""
+        self._lock.acquire()
+        try:
+            shows = {}
+            for exact_name, values in self._shows.items():
+                shows[exact_name] = values.copy()
+            return shows
+        finally:
+            self._lock.release()
+
+    def set(self, exact_name, values):
+        """Replaces the state of a show and commits it. Values that are
+        None are left out."""
+        self.set_many({exact_name: values})
+
+    def set_many(self, shows):
+        """Replaces the state of several shows, given as a dictionary of
+        exact_name to dictionaries of state, and commits them together."""
+        self._lock.acquire()
+        try:
+            for exact_name, values in shows.items():
+                self._shows[exact_name] = _clean(values)
+            self._write()
+        finally:
+            self._lock.release()
+
+    def remove(self, exact_name):
+        """Forgets a show and commits it."""
+        self._lock.acquire()
+        try:
+            if exact_name in self._shows:
+                del self._shows[exact_name]
+                self._write()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        pass
+
+    def _write(self):
+        parser = ConfigParser.RawConfigParser()
+        for exact_name in sorted(self._shows.keys()):
+            parser.add_section(exact_name)
+            for key, value in sorted(self._shows[exact_name].items()):
+                parser.set(exact_name, key, value)
+        try:
+            fp = open(self.path + '-temp', "w")
+            try:
+                fp.write("# ***WARNING***: This is a file automatically "
+                         "generated by PyTVShows. \n"
+                         "# Do NOT edit unless you absolutely positively "
+                         "know what you're doing.\n\n")
+                parser.write(fp)
+            finally:
+                fp.close()
+            _replace(self.path + '-temp', self.path)
+        except (IOError, OSError), e:
+            raise StateError, "Can't write state file: %s" % e
+
+class JournalStateStore(object):
+    """An append-only journal. Each commit appends a line with the whole
+    state of a show and flushes it to disk, so a crash loses at most the
+    show being committed. A partly written last line is ignored.
+
+    The journal is compacted to a line per show when it is opened and
+    whenever it grows to compact_ratio times that.
+
+    Arguments:
+    path - Path of the journal
+    compact_ratio - Default: 4
+    """
+    header = "# PyTVShows state journal 1\n"
+
+    def __init__(self, path, compact_ratio=4):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        self._shows = {}
+        self._fp = None
+        if os.path.exists(path):
+            self._read()
+        self._lock.acquire()
+        try:
+            self._compact()
+        finally:
+            self._lock.release()
+
+    def is_store(cls, path):
+        """Returns True if the file at path is empty or a journal."""
+        return get_backend(path) in (None, 'journal')
+    is_store = classmethod(is_store)
+
+    def get_all(self):
+        """Returns a dictionary of exact_name to dictionaries of state."""
+        self._lock.acquire()
+        try:
+            shows = {}
+            for exact_name, values in self._shows.items():
+                shows[exact_name] = values.copy()
+            return shows
+        finally:
+            self._lock.release()
+
+    def set(self, exact_name, values):
+        """Replaces the state of a show and commits it. Values that are
+        None are left out."""
+        self.set_many({exact_name: values})
+
+    def set_many(self, shows):
+        """Replaces the state of several shows, given as a dictionary of
+        exact_name to dictionaries of state, and commits them together."""
+        lines = []
+        cleaned = {}
+        for exact_name, values in shows.items():
+            cleaned[exact_name] = _clean(values)
+            lines.append(self._format('S', exact_name, cleaned[exact_name]))
+        self._lock.acquire()
+        try:
+            self._append(lines)
+            self._shows.update(cleaned)
+        finally:
+            self._lock.release()
+
+    def remove(self, exact_name):
+        """Forgets a show and commits it."""
+        self._lock.acquire()
+        try:
+            if exact_name in self._shows:
+                self._append([self._format('D', exact_name)])
+                del self._shows[exact_name]
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+        finally:
+            self._lock.release()
+
+    def _read(self):
+        try:
+            fp = open(self.path, "rb")
+            try:
+                data = fp.read()
+            finally:
+                fp.close()
+        except IOError, e:
+            raise StateError, "Can't read state journal: %s" % e
+        if data and not data.startswith(self.header):
+            raise StateError, "%s is not a state journal" % self.path
+        # The last line is only complete if it ends with a newline
+        for line in data.split("\n")[:-1]:
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split("\t")
+            try:
+                fields = [field.decode('string_escape') for field in fields]
+            except ValueError:
+                continue
+            if fields[0] == 'D' and len(fields) == 2:
+                if fields[1] in self._shows:
+                    del self._shows[fields[1]]
+            elif fields[0] == 'S' and len(fields) >= 2:
+                values = {}
+                for field in fields[2:]:
+                    key, value = (field.split('=', 1) + [''])[:2]
+                    values[key] = value
+                self._shows[fields[1]] = values
+
+    def _format(self, kind, exact_name, values=None):
+        fields = [kind, exact_name]
+        if values:
+            for key, value in sorted(values.items()):
+                fields.append("%s=%s" % (key, value))
+        return "\t".join([field.encode('string_escape')
+                          for field in fields]) + "\n"
+
+    def _append(self, lines):
+        """Appends lines to the journal and flushes them to disk, compacting
+        it first if it has grown too long. Must be called with the lock
+        held."""
+        try:
+            if self._records + len(lines) \
+                    > self.compact_ratio * max(len(self._shows), 25):
+                self._compact()
+            self._fp.write(''.join(lines))
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+        except (IOError, OSError), e:
+            raise StateError, "Can't write state journal: %s" % e
+        self._records += len(lines)
+
+    def _compact(self):
+        """Rewrites the journal with a line per show. Must be called with
+        the lock held."""
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        try:
+            fp = open(self.path + '-temp', "wb")
+            try:
+                fp.write(self.header)
+                for exact_name in sorted(self._shows.keys()):
+                    fp.write(self._format('S', exact_name,
+                                          self._shows[exact_name]))
+                fp.flush()
+                os.fsync(fp.fileno())
+            finally:
+                fp.close()
+            _replace(self.path + '-temp', self.path)
+            self._fp = open(self.path, "ab")
+        except (IOError, OSError), e:
+            raise StateError, "Can't write state journal: %s" % e
+        self._records = len(self._shows)
+
+class SqliteStateStore(object):
+    """An SQLite database, with a row for each value of each show. Each
+    commit is a transaction.
+
+    Arguments:
+    path - Path of the database
+    """
+    header = "SQLite format 3\0"
+
+    def __init__(self, path):
+        if sqlite3 is None:
+            raise StateError, "The sqlite state backend needs sqlite3 or " \
+                              "pysqlite2"
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            # Commits can come from the threads checking shows, so the
+            # connection is shared and guarded by the lock
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.text_factory = str
+            self._db.execute("CREATE TABLE IF NOT EXISTS state ("
+                             "exact_name TEXT, key TEXT, value TEXT, "
+                             "PRIMARY KEY (exact_name, key))")
+            self._db.commit()
+        except sqlite3.Error, e:
+            raise StateError, "Can't open state database: %s" % e
+
+    def is_store(cls, path):
+        """Returns True if the file at path is empty or an SQLite
+        database."""
+        return get_backend(path) in (None, 'sqlite')
+    is_store = classmethod(is_store)
+
+    def get_all(self):
+        """Returns a dictionary of exact_name to dictionaries of state."""
+        shows = {}
+        self._lock.acquire()
+        try:
+            try:
+                rows = self._db.execute("SELECT exact_name, key, value "
+                                        "FROM state").fetchall()
+            except sqlite3.Error, e:
+                raise StateError, "Can't read state database: %s" % e
+        finally:
+            self._lock.release()
+        for exact_name, key, value in rows:
+            shows.setdefault(exact_name, {})[key] = value
+        return shows
+
+    def set(self, exact_name, values):
+        """Replaces the state of a show and commits it. Values that are
+        None are left out."""
+        self.set_many({exact_name: values})
+
+    def set_many(self, shows):
+        """Replaces the state of several shows, given as a dictionary of
+        exact_name to dictionaries of state, and commits them together."""
+        rows = []
+        for exact_name, values in shows.items():
+            for key, value in _clean(values).items():
+                rows.append((exact_name, key, value))
+        self._execute(
+            [("DELETE FROM state WHERE exact_name = ?", [(exact_name,)
+                for exact_name in shows.keys()]),
+             ("INSERT INTO state VALUES (?, ?, ?)", rows)])
+
+    def remove(self, exact_name):
+        """Forgets a show and commits it."""
+        self._execute([("DELETE FROM state WHERE exact_name = ?",
+                        [(exact_name,)])])
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._db.close()
+        finally:
+            self._lock.release()
+
+    def _execute(self, statements):
+        """Runs a list of (sql, list of parameters) tuples in a
+        transaction."""
+        self._lock.acquire()
+        try:
+            try:
+                for sql, parameters in statements:
+                    self._db.executemany(sql, parameters)
+                self._db.commit()
+            except sqlite3.Error, e:
+                self._db.rollback()
+                raise StateError, "Can't write state database: %s" % e
+        finally:
+            self._lock.release()
+
+backends = {
+    'ini': IniStateStore,
+    'journal': JournalStateStore,
+    'sqlite': SqliteStateStore,
+}
+
+def open_store(backend, path):
+    """Opens the state store at path with the named backend, creating it if
+    it doesn't exist.
+
+    A state file at path that is stored with another backend, such as one
+    in the original format from an older version, is imported the first
+    time, and kept with the name of its backend added, such as
+    path + '.ini'.
+    """
+    if backend not in backends:
+        raise StateError, "Unknown state backend: %s" % backend
+    store_class = backends[backend]
+    if os.path.exists(path) and not store_class.is_store(path):
+        old_backend = get_backend(path)
+        old_store = backends[old_backend](path)
+        try:
+            shows = old_store.get_all()
+        finally:
+            old_store.close()
+        temp_path = path + '-import'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        store = store_class(temp_path)
+        try:
+            store.set_many(shows)
+        finally:
+            store.close()
+        try:
+            _replace(path, "%s.%s" % (path, old_backend))
+            _replace(temp_path, path)
+        except OSError, e:
+            raise StateError, "Can't import state file: %s" % e
+    return store_class(path)
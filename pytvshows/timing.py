@@ -0,0 +1,149 @@
+# encoding: utf-8
+"""
+PyTVShows - Timings of the phases of a run, for profiling
+"""
+
+import threading
+import time
+
+class Timings(object):
+    """Durations of the phases of a run, such as downloading feeds or
+    checking trackers, grouped by show and by host. Safe to use from several
+    threads.
+
+    Nothing is recorded until enable() is called, and start() and stop() do
+    almost nothing until then. They are used like this:
+
+        start = timings.start()
+        try:
+            ...
+        finally:
+            timings.stop(start, 'feed', show=self.exact_name)
+    """
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        # (phase, show, host) -> list of durations in seconds
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """Starts recording."""
+        self.started = time.time()
+        self.enabled = True
+
+    def start(self):
+        """Returns the start time to pass to stop(), or None if recording
+        isn't enabled."""
+        if not self.enabled:
+            return None
+        return time.time()
+
+    def stop(self, start, phase, show=None, host=None):
+        """Records the time since start as a duration of phase, for a show
+        or a host."""
+        if start is None:
+            return
+        duration = time.time() - start
+        self._lock.acquire()
+        try:
+            self._durations.setdefault((phase, show, host), []).append(
+                duration)
+        finally:
+            self._lock.release()
+
+    def get_report(self):
+        """Returns a dictionary with the wall time since enable() and a
+        summary of each phase (see summarize()) overall, for each show and
+        for each host."""
+        self._lock.acquire()
+        try:
+            durations = self._durations.items()
+        finally:
+            self._lock.release()
+        phases = {}
+        shows = {}
+        hosts = {}
+        for (phase, show, host), values in durations:
+            phases.setdefault(phase, []).extend(values)
+            if show is not None:
+                shows.setdefault(show, {}).setdefault(phase, []).extend(
+                    values)
+            if host is not None:
+                hosts.setdefault(host, {}).setdefault(phase, []).extend(
+                    values)
+        for group in [phases] + shows.values() + hosts.values():
+            for phase, values in group.items():
+                group[phase] = summarize(values)
+        wall_time = 0.0
+        if self.started is not None:
+            wall_time = time.time() - self.started
+        return {
+            'wall_time': wall_time,
+            'phases': phases,
+            'shows': shows,
+            'hosts': hosts,
+        }
+
+def summarize(values):
+    """Returns a dictionary of the count, total, p50, p95 and max of a list
+    of durations."""
+    values = sorted(values)
+    if not values:
+        return {'count': 0, 'total': 0.0, 'p50': 0.0, 'p95': 0.0,
+                'max': 0.0}
+    return {
+        'count': len(values),
+        'total': sum(values),
+        'p50': _percentile(values, 0.5),
+        'p95': _percentile(values, 0.95),
+        'max': values[-1],
+    }
+
+def _percentile(values, fraction):
+    """Returns the nearest-rank percentile of a sorted list."""
+    index = max(int(fraction * len(values) + 0.5) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+def to_json(value, indent=0):
+    """Encodes dictionaries, lists, strings, numbers, booleans and None as
+    JSON, with dictionary keys sorted."""
+    if value is None:
+        return 'null'
+    elif value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif isinstance(value, (int, long)):
+        return str(value)
+    elif isinstance(value, float):
+        return '%.6f' % value
+    elif isinstance(value, basestring):
+        if isinstance(value, str):
+            value = value.decode('utf-8', 'replace')
+        return '"%s"' % ''.join([_json_char(c) for c in value])
+    spaces = '  ' * (indent + 1)
+    if isinstance(value, dict):
+        if not value:
+            return '{}'
+        items = []
+        for key in sorted(value.keys()):
+            name = key
+            if not isinstance(name, basestring):
+                name = str(name)
+            items.append('%s%s: %s' % (spaces, to_json(name),
+                                       to_json(value[key], indent + 1)))
+        return '{\n%s\n%s}' % (',\n'.join(items), '  ' * indent)
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            return '[]'
+        items = [spaces + to_json(item, indent + 1) for item in value]
+        return '[\n%s\n%s]' % (',\n'.join(items), '  ' * indent)
+    raise TypeError, "Can't encode %r as JSON" % (value,)
+
+def _json_char(c):
+    if c == '"' or c == '\\':
+        return '\\' + c
+    elif c < ' ' or c > '~':
+        return '\\u%04x' % ord(c)
+    return c
@@ -0,0 +1,253 @@
+# encoding: utf-8
+"""
+PyTVShows - On-disk cache of downloaded torrent files
+"""
+
+import ConfigParser
+import os
+import sys
+import threading
+import time
+
+import pytvshows.logger as logging
+
+class TorrentCache(object):
+    """Cache of downloaded torrent files, so torrents of an episode that is
+    waiting for a better quality aren't downloaded again on every run. Safe
+    to use from several threads.
+
+    Torrent files are stored once each in a directory, named by their
+    info_hash. An index file in the same directory records the info_hash
+    of each URL, along with the ETag and Last-Modified headers it was sent
+    with so it can be revalidated with a conditional request. When the files
+    take up more than max_size bytes, the least recently used are removed.
+
+    The cache does nothing until load() has been called with a directory.
+
+    Arguments:
+    max_size - Maximum total size in bytes of the cached files. Default:
+               50MB
+    ttl - Seconds after a torrent is downloaded or revalidated during which
+          it is used without asking the server. Default: 86400
+    """
+    # Seconds after which URLs that haven't been used are forgotten
+    max_age = 30 * 86400
+
+    def __init__(self, max_size=52428800, ttl=86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = None
+        # URL -> dictionary of info_hash (hex), etag, last_modified,
+        # filename, fetched and used
+        self._urls = {}
+        # info_hash (hex) -> size in bytes of stored torrent file
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'revalidated': 0}
+
+    def load(self, directory):
+        """Uses directory for the cache, creating it if necessary, and
+        loads its index."""
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        parser = ConfigParser.RawConfigParser()
+        parser.read(os.path.join(directory, 'index'))
+        sizes = {}
+        for filename in os.listdir(directory):
+            if filename.endswith('.torrent'):
+                sizes[filename[:-8]] = \
+                    os.path.getsize(os.path.join(directory, filename))
+        urls = {}
+        for url in parser.sections():
+            entry = self._new_entry()
+            for key in entry.keys():
+                if parser.has_option(url, key):
+                    entry[key] = parser.get(url, key)
+            try:
+                entry['fetched'] = float(entry['fetched'])
+                entry['used'] = float(entry['used'])
+            except ValueError:
+                continue
+            if entry['info_hash'] in sizes:
+                urls[url] = entry
+        self._lock.acquire()
+        try:
+            self.directory = directory
+            self._urls = urls
+            self._sizes = sizes
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """Saves the index, forgetting URLs that haven't been used for a 
+        long time and removing torrent files that no URL uses."""
+        if self.directory is None:
+            return
+        now = time.time()
+        parser = ConfigParser.RawConfigParser()
+        self._lock.acquire()
+        try:
+            used = {}
+            for url in sorted(self._urls.keys()):
+                entry = self._urls[url]
+                if now - entry['used'] > self.max_age:
+                    del self._urls[url]
+                    continue
+                used[entry['info_hash']] = True
+                parser.add_section(url)
+                for key in sorted(entry.keys()):
+                    if entry[key] is not None:
+                        parser.set(url, key, entry[key])
+            for info_hash in self._sizes.keys():
+                if info_hash not in used:
+                    self._remove_file(info_hash)
+        finally:
+            self._lock.release()
+        path = os.path.join(self.directory, 'index')
+        fp = open(path + '-temp', "w")
+        try:
+            parser.write(fp)
+        finally:
+            fp.close()
+        if sys.platform[:3] == 'win' and os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '-temp', path)
+
+    def get(self, url):
+        """Returns a (data, entry) tuple for the torrent file downloaded
+        from url, or None if it isn't cached. entry is a dictionary with the
+        etag, last_modified and filename it was sent with, and fresh, which
+        is True if it was downloaded or revalidated less than ttl seconds
+        ago."""
+        self._lock.acquire()
+        try:
+            if self.directory is None:
+                return None
+            if url not in self._urls:
+                self._stats['misses'] += 1
+                return None
+            entry = self._urls[url]
+            try:
+                fp = open(self._get_path(entry['info_hash']), "rb")
+                try:
+                    data = fp.read()
+                finally:
+                    fp.close()
+            except IOError:
+                del self._urls[url]
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            now = time.time()
+            entry['used'] = now
+            entry = entry.copy()
+        finally:
+            self._lock.release()
+        entry['fresh'] = now - entry['fetched'] < self.ttl
+        return (data, entry)
+
+    def put(self, url, data, info_hash, etag=None, last_modified=None,
+            filename=None):
+        """Stores the torrent file data downloaded from url. info_hash is
+        the torrent's info_hash, and etag, last_modified and filename are
+        the response headers to store with it. If the file can't be 
+        written, a warning is logged and it isn't cached."""
+        if self.directory is None:
+            return
+        info_hash = info_hash.encode('hex')
+        path = self._get_path(info_hash)
+        self._lock.acquire()
+        try:
+            if info_hash not in self._sizes:
+                try:
+                    fp = open(path + '-temp', "wb")
+                    try:
+                        fp.write(data)
+                    finally:
+                        fp.close()
+                    if sys.platform[:3] == 'win' and os.path.exists(path):
+                        os.remove(path)
+                    os.rename(path + '-temp', path)
+                except (IOError, OSError), e:
+                    try:
+                        os.remove(path + '-temp')
+                    except OSError:
+                        pass
+                    logging.warn("Can't add torrent to the cache: %s" % e)
+                    return
+                self._sizes[info_hash] = len(data)
+            now = time.time()
+            self._urls[url] = {
+                'info_hash': info_hash,
+                'etag': etag,
+                'last_modified': last_modified,
+                'filename': filename,
+                'fetched': now,
+                'used': now,
+            }
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def revalidated(self, url):
+        """Records that the server confirmed the cached torrent file for url
+        hasn't changed."""
+        self._lock.acquire()
+        try:
+            if url in self._urls:
+                self._urls[url]['fetched'] = time.time()
+                self._stats['revalidated'] += 1
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """Returns a dictionary of the number of URLs found in the cache
+        (hits), not found (misses) and revalidated with the server."""
+        self._lock.acquire()
+        try:
+            return self._stats.copy()
+        finally:
+            self._lock.release()
+
+    def _new_entry(self):
+        return {
+            'info_hash': None,
+            'etag': None,
+            'last_modified': None,
+            'filename': None,
+            'fetched': 0.0,
+            'used': 0.0,
+        }
+
+    def _get_path(self, info_hash):
+        return os.path.join(self.directory, info_hash + '.torrent')
+
+    def _remove_file(self, info_hash):
+        """Removes a stored torrent file. Must be called with the lock
+        held."""
+        try:
+            os.remove(self._get_path(info_hash))
+        except OSError:
+            pass
+        del self._sizes[info_hash]
+
+    def _evict(self):
+        """Removes the least recently used torrent files until they fit in
+        max_size. Must be called with the lock held."""
+        total = sum(self._sizes.values())
+        if total <= self.max_size:
+            return
+        used = {}
+        for entry in self._urls.values():
+            used[entry['info_hash']] = max(entry['used'],
+                                           used.get(entry['info_hash'], 0))
+        info_hashes = self._sizes.keys()
+        info_hashes.sort(key=lambda info_hash: used.get(info_hash, 0))
+        for info_hash in info_hashes:
+            if total <= self.max_size:
+                break
+            total -= self._sizes[info_hash]
+            self._remove_file(info_hash)
+        for url, entry in self._urls.items():
+            if entry['info_hash'] not in self._sizes:
+                del self._urls[url]
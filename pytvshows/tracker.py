@@ -0,0 +1,231 @@
+# encoding: utf-8
+"""
+PyTVShows - Bookkeeping for BitTorrent trackers
+"""
+
+import ConfigParser
+import os
+import sys
+import threading
+import time
+
+class ScrapeCache(object):
+    """In-memory cache of tracker scrape responses, keyed by scrape URL and
+    info_hash. Safe to use from several threads.
+    """
+    def __init__(self):
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def get(self, scrape_url, info_hash):
+        """Returns the cached response, or None if there isn't one or it has
+        expired."""
+        key = (scrape_url, info_hash)
+        self._lock.acquire()
+        try:
+            if key not in self._responses:
+                return None
+            expires, response = self._responses[key]
+            if expires < time.time():
+                del self._responses[key]
+                return None
+            return response
+        finally:
+            self._lock.release()
+
+    def set(self, scrape_url, info_hash, response, ttl):
+        """Caches response for ttl seconds."""
+        if ttl <= 0:
+            return
+        self._lock.acquire()
+        try:
+            self._responses[(scrape_url, info_hash)] = \
+                (time.time() + ttl, response)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Removes every cached response."""
+        self._lock.acquire()
+        try:
+            self._responses.clear()
+        finally:
+            self._lock.release()
+
+class TrackerHealth(object):
+    """Success and failure history of tracker announce URLs, used to try
+    working trackers first and to skip dead ones. It can be saved to and
+    loaded from a file so it is kept between runs. Safe to use from several
+    threads.
+    
+    Trackers that have failed several times in a row are skipped for a
+    backoff period that doubles with each further failure. Success and
+    failure counts decay over time, so a tracker that recovers is tried
+    again and eventually ranked as if it had never failed.
+    """
+    # Seconds for success and failure counts to halve
+    half_life = 7 * 86400
+    # Failures in a row before a tracker is skipped
+    failure_threshold = 2
+    # Seconds a tracker is skipped for when it reaches failure_threshold,
+    # doubled for every further failure up to max_backoff
+    backoff = 3600
+    max_backoff = 86400
+    
+    def __init__(self):
+        self._trackers = {}
+        self._lock = threading.Lock()
+    
+    def record_success(self, url, latency):
+        """Records a response from the tracker at url that took latency
+        seconds."""
+        self._lock.acquire()
+        try:
+            record = self._get_record(url)
+            record['successes'] += 1
+            record['failures_in_row'] = 0
+            if record['latency']:
+                record['latency'] = 0.7 * record['latency'] + 0.3 * latency
+            else:
+                record['latency'] = latency
+            record['last_seen'] = record['last_checked']
+        finally:
+            self._lock.release()
+    
+    def record_failure(self, url):
+        """Records that the tracker at url could not be reached or gave an
+        unusable response."""
+        self._lock.acquire()
+        try:
+            record = self._get_record(url)
+            record['failures'] += 1
+            record['failures_in_row'] += 1
+        finally:
+            self._lock.release()
+    
+    def is_dead(self, url, now=None):
+        """Returns True if the tracker at url should be skipped for now."""
+        if now is None:
+            now = time.time()
+        self._lock.acquire()
+        try:
+            if url not in self._trackers:
+                return False
+            record = self._trackers[url]
+            excess = record['failures_in_row'] - self.failure_threshold
+            if excess < 0:
+                return False
+            backoff = min(self.backoff * 2 ** min(excess, 16), 
+                          self.max_backoff)
+            return now - record['last_checked'] < backoff
+        finally:
+            self._lock.release()
+    
+    def order(self, urls):
+        """Sorts announce URLs by how well their trackers have worked. 
+        Returns a (urls, skipped) tuple with the URLs worth trying, best 
+        first, and the ones that are dead for now. Unknown trackers keep 
+        their relative order."""
+        now = time.time()
+        alive = []
+        skipped = []
+        for url in urls:
+            if self.is_dead(url, now):
+                skipped.append(url)
+            else:
+                alive.append(url)
+        self._lock.acquire()
+        try:
+            scores = {}
+            for url in alive:
+                scores[url] = self._score(url, now)
+        finally:
+            self._lock.release()
+        alive.sort(key=lambda url: scores[url])
+        return (alive, skipped)
+    
+    def load(self, path):
+        """Loads tracker history from path, replacing anything recorded. A 
+        missing file is treated as empty."""
+        parser = ConfigParser.RawConfigParser()
+        parser.read(path)
+        trackers = {}
+        for url in parser.sections():
+            record = self._new_record()
+            try:
+                for key in record.keys():
+                    if parser.has_option(url, key):
+                        record[key] = float(parser.get(url, key))
+            except ValueError:
+                continue
+            record['failures_in_row'] = int(record['failures_in_row'])
+            trackers[url] = record
+        self._lock.acquire()
+        try:
+            self._trackers = trackers
+        finally:
+            self._lock.release()
+    
+    def save(self, path):
+        """Saves tracker history to path, forgetting trackers that haven't 
+        been checked for a long time."""
+        now = time.time()
+        parser = ConfigParser.RawConfigParser()
+        self._lock.acquire()
+        try:
+            for url in sorted(self._trackers.keys()):
+                record = self._trackers[url]
+                if now - record['last_checked'] > 8 * self.half_life:
+                    continue
+                parser.add_section(url)
+                for key in sorted(record.keys()):
+                    parser.set(url, key, repr(record[key]))
+        finally:
+            self._lock.release()
+        fp = open(path + '-temp', "w")
+        try:
+            parser.write(fp)
+        finally:
+            fp.close()
+        if sys.platform[:3] == 'win' and os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '-temp', path)
+    
+    def _new_record(self):
+        return {
+            'successes': 0.0,
+            'failures': 0.0,
+            'failures_in_row': 0,
+            'latency': 0.0,
+            'last_seen': 0.0,
+            'last_checked': 0.0,
+        }
+    
+    def _get_record(self, url):
+        """Returns the record for url with its counts decayed up to now, and 
+        its last_checked time set to now. Must be called with the lock 
+        held."""
+        now = time.time()
+        if url not in self._trackers:
+            self._trackers[url] = self._new_record()
+        record = self._trackers[url]
+        if record['last_checked']:
+            decay = 0.5 ** (max(now - record['last_checked'], 0) 
+                            / self.half_life)
+            record['successes'] *= decay
+            record['failures'] *= decay
+        record['last_checked'] = now
+        return record
+    
+    def _score(self, url, now):
+        """Returns a sort key for url, lowest is best. Must be called with 
+        the lock held."""
+        if url not in self._trackers:
+            return (0.5, 0.0)
+        record = self._trackers[url]
+        decay = 0.5 ** (max(now - record['last_checked'], 0) / self.half_life)
+        successes = record['successes'] * decay
+        failures = record['failures'] * decay
+        # Estimated failure rate, starting from an even chance
+        return ((failures + 1) / (successes + failures + 2), 
+                record['latency'])
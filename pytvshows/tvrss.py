@@ -0,0 +1,155 @@
+# encoding: utf-8
+"""
+PyTVShows - Fast parser for the RSS feeds of tvRSS.net
+"""
+
+import calendar
+import email.Utils
+import re
+import time
+import xml.parsers.expat
+
+class UnsupportedFeedError(Exception): pass
+
+# feedparser's names for the versions of RSS that are supported
+_versions = {
+    '2.0': 'rss20',
+    '0.92': 'rss092',
+    '0.91': 'rss091u',
+}
+# Item elements that are kept, by the names feedparser gives them
+_fields = {
+    'title': 'title',
+    'link': 'link',
+    'description': 'description',
+    'pubDate': 'updated',
+    'guid': 'id',
+}
+# Text that feedparser would treat as HTML and change, so the results would
+# differ
+_markup_re = re.compile(u'[<>&]')
+_scheme_re = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*:')
+# feedparser and email.Utils read two-digit years differently
+_year_re = re.compile(r'\b\d{4}\b')
+
+class Result(dict):
+    """A parsed feed or entry, with its values readable as attributes too,
+    like the results of feedparser."""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError, name
+
+class Parser(object):
+    """Incremental parser for the RSS feeds of tvRSS.net, built on expat.
+    Data is given to it in chunks with feed() as it arrives.
+
+    Only the title, link, description, publishing time and GUID of each item
+    are read, which is all Show needs, and none of feedparser's generic
+    object tree is built. Results look like feedparser's for those fields,
+    so they can be used in its place:
+
+        result['entries'][0].title
+        result['entries'][0].updated_parsed
+
+    Anything feedparser would read differently raises UnsupportedFeedError,
+    so the feed can be given to feedparser instead: XML errors, anything
+    but plain RSS in UTF-8, items without a title or a publishing time in
+    RFC 822 format with a time zone, relative links and markup or entities
+    in titles and descriptions.
+    """
+    def __init__(self):
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.XmlDeclHandler = self._declaration
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._characters
+        self._parser.buffer_text = True
+        self._result = Result(entries=[])
+        # Names of the elements that are open, outermost first
+        self._path = []
+        self._entry = None
+        self._text = None
+
+    def feed(self, data):
+        """Parses the next chunk of data."""
+        self._parse(data, False)
+
+    def close(self):
+        """Finishes parsing and returns the feed."""
+        self._parse('', True)
+        if 'version' not in self._result:
+            raise UnsupportedFeedError, "not an RSS feed"
+        return self._result
+
+    def _parse(self, data, final):
+        try:
+            self._parser.Parse(data, final)
+        except xml.parsers.expat.ExpatError, e:
+            raise UnsupportedFeedError, str(e)
+
+    def _declaration(self, version, encoding, standalone):
+        # feedparser guesses at the encoding of other feeds
+        if encoding and encoding.lower() not in ('utf-8', 'us-ascii'):
+            raise UnsupportedFeedError, "unsupported encoding: %s" % encoding
+
+    def _start(self, name, attributes):
+        depth = len(self._path)
+        self._path.append(name)
+        if depth == 0:
+            if name != 'rss' or attributes.get('version') not in _versions:
+                raise UnsupportedFeedError, "not a supported RSS feed"
+            self._result['version'] = _versions[attributes['version']]
+        if 'xml:base' in attributes:
+            raise UnsupportedFeedError, "xml:base is not supported"
+        if depth >= 3 and self._entry is not None and ':' in name:
+            # Extensions such as dc:date can change what feedparser reads
+            raise UnsupportedFeedError, "unsupported element in item: %s" \
+                                        % name
+        if self._text is not None:
+            raise UnsupportedFeedError, "markup in %s" % self._path[-2]
+        if depth == 2 and name == 'item' and self._path[1] == 'channel':
+            self._entry = Result()
+        elif depth == 3 and self._entry is not None and name in _fields:
+            self._text = []
+
+    def _end(self, name):
+        depth = len(self._path) - 1
+        self._path.pop()
+        if depth == 3 and self._text is not None:
+            self._set_field(_fields[name], u''.join(self._text).strip())
+            self._text = None
+        elif depth == 2 and self._entry is not None:
+            self._add_entry(self._entry)
+            self._entry = None
+
+    def _characters(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _set_field(self, field, value):
+        if field == 'updated':
+            parsed = email.Utils.parsedate_tz(value)
+            if not parsed or parsed[9] is None or not _year_re.search(value):
+                raise UnsupportedFeedError, "unsupported date: %s" % value
+            self._entry['updated_parsed'] = time.gmtime(
+                calendar.timegm(parsed[:9]) - parsed[9])
+        elif field in ('title', 'description') and _markup_re.search(value):
+            raise UnsupportedFeedError, "markup in %s" % field
+        self._entry[field] = value
+
+    def _add_entry(self, entry):
+        if 'title' not in entry:
+            raise UnsupportedFeedError, "item without a title"
+        elif 'updated_parsed' not in entry:
+            raise UnsupportedFeedError, "item without a publishing time"
+        elif 'link' not in entry or not _scheme_re.match(entry['link']):
+            raise UnsupportedFeedError, "item without an absolute link"
+        self._result['entries'].append(entry)
+
+def parse(data):
+    """Parses a feed with Parser and returns it."""
+    parser = Parser()
+    parser.feed(data)
+    return parser.close()